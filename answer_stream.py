@@ -0,0 +1,112 @@
+"""
+Incremental parser for Aristo's streamed ["answer", "label"] replies.
+
+Chat completions arrive a few characters at a time. The parser walks the
+JSON array as it grows and reports answer text as soon as it is decoded,
+and the label once its closing quote arrives, so the client can start
+rendering at time-to-first-token. Replies that don't start with a JSON
+array are passed through as plain answer text.
+"""
+
+import json
+
+_WHITESPACE = ' \t\r\n'
+
+
+class AnswerStreamParser:
+    """Feed raw completion deltas in; get ('token', text) / ('label', label) events out"""
+
+    def __init__(self):
+        self.raw = []
+        self.label = None
+        self._state = 'start'
+        self._escape = ''
+        self._label_chars = []
+
+    def feed(self, chunk):
+        self.raw.append(chunk)
+        events = []
+        answer_chars = []
+
+        def flush_answer():
+            if answer_chars:
+                events.append(('token', ''.join(answer_chars)))
+                answer_chars.clear()
+
+        for index, ch in enumerate(chunk):
+            state = self._state
+            if state == 'raw':
+                answer_chars.append(chunk[index:])
+                break
+            if state == 'start':
+                if ch in _WHITESPACE:
+                    continue
+                if ch == '[':
+                    self._state = 'before_answer'
+                    continue
+                # Anything before this was whitespace, so the answer starts here
+                self._state = 'raw'
+                answer_chars.append(chunk[index:])
+                break
+            if state == 'before_answer':
+                if ch in _WHITESPACE:
+                    continue
+                if ch == '"':
+                    self._state = 'answer'
+                    continue
+                # Not the expected shape: everything received so far is the answer
+                self._state = 'raw'
+                answer_chars.append(''.join(self.raw))
+                break
+            if state in ('answer', 'label'):
+                decoded = self._string_char(ch)
+                if decoded is None:
+                    continue
+                if decoded is _END:
+                    if state == 'answer':
+                        flush_answer()
+                        self._state = 'after_answer'
+                    else:
+                        self.label = ''.join(self._label_chars)
+                        events.append(('label', self.label))
+                        self._state = 'done'
+                    continue
+                if state == 'answer':
+                    answer_chars.append(decoded)
+                else:
+                    self._label_chars.append(decoded)
+                continue
+            if state == 'after_answer':
+                if ch == '"':
+                    self._state = 'label'
+                continue
+            # 'done': ignore the closing bracket and anything after it
+
+        flush_answer()
+        return events
+
+    def _string_char(self, ch):
+        """Decode one character inside a JSON string; None while an escape is incomplete"""
+        if self._escape:
+            self._escape += ch
+            if self._escape.startswith('\\u') and len(self._escape) < 6:
+                return None
+            escape, self._escape = self._escape, ''
+            try:
+                return json.loads(f'"{escape}"')
+            except ValueError:
+                return escape
+        if ch == '\\':
+            self._escape = ch
+            return None
+        if ch == '"':
+            return _END
+        return ch
+
+    @property
+    def text(self):
+        """The full raw completion received so far"""
+        return ''.join(self.raw)
+
+
+_END = object()
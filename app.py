@@ -1,20 +1,101 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
 from flask_cors import CORS
 import os
+import io
 import json
+import logging
+import re
+import signal
+from concurrent.futures import ThreadPoolExecutor
 import openai
 from openai import OpenAI
 from dotenv import load_dotenv
+import metrics
+from answer_stream import AnswerStreamParser
+from audio_blob_store import chapter_audio_key, create_default_store as create_audio_blob_store
+from audio_blob_store import is_valid_key, manifest_etag, text_hash
+from audio_formats import AUDIO_MIME_TYPES, audio_duration, join_audio, sniff_format
+from book_search import create_default_search
+from chapter_store import ChapterStore
+from content_store import create_default_store as create_content_store
+from context_selection import create_default_selector
+from corpus import create_default_corpus
+from log_config import configure_logging
+from response_cache import create_default_cache as create_response_cache
+from response_cache import make_response_key, normalize_question
+from retrieval import chapter_indexes, content_hash
+from single_flight import SingleFlight
+from span_locator import locate_span
+from prerender_jobs import JobStore, PrerenderWorker
+from prompt_builder import PromptTooLargeError, create_default_builder
+from prompt_store import PromptConfigError, PromptsNotFoundError, PromptStore
+from reader_state import ReaderStateError, create_default_store as create_reader_state_store
+from text_segmentation import TTS_MAX_CHARS, split_segments, split_text, timing_map
+from tts_cache import create_default_cache, make_cache_key
+from upstream import UpstreamUnavailable, chat_request_tokens, create_default_policies
 
 # Load environment variables from .env file
 load_dotenv()
 
+configure_logging()
+logger = logging.getLogger('aristo')
+
 app = Flask(__name__)
 CORS(app)
+metrics.instrument_flask(app)
 
 # Initialize OpenAI client using environment variables
+# Retries are handled by upstream_policies, so the SDK's own retries are disabled
 openai_client = OpenAI(
-    api_key=os.getenv('OPENAI_API_KEY')
+    api_key=os.getenv('OPENAI_API_KEY'),
+    max_retries=0,
+    timeout=float(os.getenv('OPENAI_TIMEOUT', '30'))
+)
+
+# Rate limits, retries and circuit breakers for chat, selection and TTS calls
+upstream_policies = create_default_policies()
+
+# Prompt templates, parsed once and reloaded when prompts.json changes (or on SIGHUP)
+prompt_store = PromptStore(
+    os.getenv('PROMPTS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts.json')),
+    check_interval=float(os.getenv('PROMPTS_CHECK_INTERVAL', '2'))
+)
+
+def _reload_prompts_on_signal(signum, frame):
+    prompt_store.request_reload()
+
+try:
+    signal.signal(signal.SIGHUP, _reload_prompts_on_signal)
+except (AttributeError, ValueError):
+    pass  # SIGHUP unavailable (Windows) or not imported from the main thread
+
+# Picks the chapter passages included in LLM prompts
+context_selector = create_default_selector()
+
+# Lays out prompts for upstream prefix caching and keeps them under PROMPT_TOKEN_BUDGET
+prompt_builder = create_default_builder(context_selector)
+
+# Cached Aristo answers keyed on normalized question + chapter hash
+aristo_cache = create_response_cache()
+
+# Chapter texts by content hash, so clients can send the hash instead of the text
+content_store = create_content_store()
+
+# Concurrent identical upstream calls (same cache key) share one request
+upstream_flights = SingleFlight()
+
+# Shared cache of synthesized audio (memory LRU + disk)
+audio_cache = create_default_cache()
+
+# Whole chapters of audio as raw blobs plus a segment manifest
+audio_blob_store = create_audio_blob_store()
+
+# Bounded pool for fanning out chapter segment synthesis to OpenAI TTS
+audio_synthesis_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('AUDIO_SYNTH_WORKERS', '4')),
+    thread_name_prefix='tts'
 )
 
 # Sample book content
@@ -55,21 +136,85 @@ The art of reading is also the art of questioning, of remaining curious and open
     ]
 }
 
+def load_chapter_store():
+    """Index the book named by BOOK_PATH, falling back to the built-in sample book"""
+    book_path = os.getenv('BOOK_PATH')
+    if book_path:
+        try:
+            return ChapterStore.from_json_file(book_path)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load book from %s, using sample book: %s", book_path, e)
+    return ChapterStore(SAMPLE_BOOK)
+
+chapter_store = load_chapter_store()
+
+# Ingested books (see ingest_books.py), memory-mapped and served from /api/books
+corpus = create_default_corpus()
+
+def payload_response(payload):
+    """Serve a precomputed JSON payload, answering 304 when the client's ETag matches"""
+    response = Response(payload.body, mimetype='application/json')
+    response.set_etag(payload.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/book')
 def get_book():
-    return jsonify(SAMPLE_BOOK)
+    return payload_response(chapter_store.book_payload)
+
+@app.route('/api/book/toc')
+def get_book_toc():
+    """Table of contents without chapter bodies"""
+    return payload_response(chapter_store.toc_payload)
 
 @app.route('/api/book/chapter/<int:chapter_id>')
 def get_chapter(chapter_id):
-    chapter = next((ch for ch in SAMPLE_BOOK['chapters'] if ch['id'] == chapter_id), None)
-    if chapter:
-        return jsonify(chapter)
+    payload = chapter_store.chapter_payload(chapter_id)
+    if payload:
+        return payload_response(payload)
     return jsonify({'error': 'Chapter not found'}), 404
 
+def corpus_response(etag, build):
+    """JSON response for corpus data; build() only runs when the client's copy is stale"""
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(json.dumps(build(), ensure_ascii=False), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/books')
+def list_books():
+    """Catalog of ingested books, paged with offset/limit"""
+    books = corpus.books()
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    return jsonify({'total': len(books), 'offset': offset, 'books': books[offset:offset + limit]})
+
+@app.route('/api/books/<book_id>')
+def get_corpus_book(book_id):
+    """Table of contents of an ingested book"""
+    book = corpus.get(book_id)
+    if not book:
+        return jsonify({'error': 'Book not found'}), 404
+    return corpus_response(book.etag, book.toc)
+
+@app.route('/api/books/<book_id>/chapters/<int:chapter_id>')
+def get_corpus_chapter(book_id, chapter_id):
+    book = corpus.get(book_id)
+    entry = book.find(chapter_id) if book else None
+    if not entry:
+        return jsonify({'error': 'Chapter not found'}), 404
+    return corpus_response(
+        entry.etag,
+        lambda: {'id': entry.id, 'title': entry.title, 'content': book.text(entry)}
+    )
+
 @app.route('/api/config')
 def get_config():
     """Return public configuration for the frontend"""
@@ -84,149 +229,366 @@ def get_config():
         },
         'features': {
             'openai_enabled': openai_enabled,
-            'ai_audio_enabled': openai_enabled  # Same as openai_enabled for TTS
+            'ai_audio_enabled': openai_enabled,  # Same as openai_enabled for TTS
+            'reader_state': reader_state is not None
         }
     })
 
+def chat_settings():
+    """Return (model, max_tokens, temperature) for Aristo chat completions"""
+    return (
+        os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
+        int(os.getenv('OPENAI_MAX_TOKENS', '500')),
+        float(os.getenv('OPENAI_TEMPERATURE', '0.7'))
+    )
+
+def build_aristo_messages(standard_prompts, user_input, chapter_context, context_mode=None):
+    """Build the OpenAI chat messages for a reader question (stable instructions and chapter first)"""
+    return prompt_builder.aristo_messages(standard_prompts, user_input, chapter_context, context_mode)
+
+def parse_aristo_response(ai_response):
+    """Split Aristo's ["answer", "label"] reply into response fields"""
+    logger.debug("Parsing Aristo response", extra={'response_chars': len(ai_response)})
+    
+    # Parse the JSON array response from Aristo
+    try:
+        parsed_response = json.loads(ai_response)
+    except json.JSONDecodeError:
+        logger.info("Aristo response was not JSON, returning it as plain text")
+        # Fallback if response isn't valid JSON
+        return {
+            'response': ai_response,
+            'label': 'analysis',  # Provide default label
+            'note': 'Response not in JSON format'
+        }
+    
+    if isinstance(parsed_response, list) and len(parsed_response) >= 2:
+        # Extract the answer (first item) and label (second item)
+        answer = parsed_response[0]
+        label = parsed_response[1]
+        logger.debug("Extracted Aristo label", extra={'label': label, 'valid': label in ('context', 'analysis')})
+        return {
+            'response': answer,  # Only return the answer to display
+            'label': label       # Include label for backend use
+        }
+    
+    logger.info("Aristo response was not a [answer, label] array")
+    # Fallback if response isn't in expected format
+    return {
+        'response': ai_response,
+        'label': 'analysis',  # Provide default label
+        'note': 'Response not in expected JSON array format'
+    }
+
+def aristo_fallback_response(user_input):
+    """Canned answer used when the AI service is unavailable"""
+    return f"""I understand you're asking about: "{user_input}"
+
+While I'd love to provide detailed AI-powered insights, it seems there's an issue connecting to the AI service right now. 
+
+Here are some general reading strategies that might help:
+• Try breaking down complex passages into smaller parts
+• Look for key themes and main ideas
+• Consider the context and background of what you're reading
+• Make connections to your own experiences or other texts
+• Don't hesitate to look up unfamiliar terms or concepts
+
+Please check your OpenAI API configuration and try again for more personalized assistance."""
+
+def resolve_chapter_content(content=None, digest=None, book_id=None, chapter_id=None):
+    """
+    Return (content, content_hash) for a chapter sent as text, as the hash of
+    text sent earlier, or as a server-side book/chapter id. Returns None when
+    the reference is unknown here, in which case the client resends the text.
+    """
+    if isinstance(content, str) and content:
+        return content, content_store.put(content)
+    if digest:
+        content = content_store.get(digest)
+        return (content, digest) if content is not None else None
+    if chapter_id is not None:
+        try:
+            content = load_book_chapter_text(str(book_id or DEFAULT_BOOK_ID), int(chapter_id))
+        except (TypeError, ValueError):
+            content = None
+        if content is not None:
+            return content, content_hash(content)
+    return None
+
+def chapter_unknown_error(digest):
+    """(body, status) for a chapter reference that could not be resolved"""
+    if digest:
+        # 409 tells the client to retry with the chapter text included
+        return {'error': 'Unknown chapter content hash', 'code': 'chapter_content_unknown'}, 409
+    return {'error': 'Chapter not found'}, 404
+
+def resolve_chapter_context(chapter_context):
+    """Return chapterContext with content and contentHash filled in, or None if its chapter is unknown"""
+    if not chapter_context:
+        return chapter_context
+    resolved = resolve_chapter_content(
+        chapter_context.get('content'), chapter_context.get('contentHash'),
+        chapter_context.get('bookId'), chapter_context.get('chapterId')
+    )
+    if resolved is None:
+        return None
+    content, digest = resolved
+    return {
+        'title': '',
+        'chapterNumber': chapter_context.get('chapterId'),
+        **chapter_context,
+        'content': content,
+        'contentHash': digest
+    }
+
+def selection_chapter(data):
+    """(chapter_content, chapter_hash) for a find-relevant-text request; None if its reference is unknown"""
+    resolved = resolve_chapter_content(
+        data.get('chapterContent'), data.get('chapterHash'), data.get('bookId'), data.get('chapterId')
+    )
+    if resolved is None:
+        if data.get('chapterHash') or data.get('chapterId') is not None:
+            return None
+        return '', None
+    chapter_content, chapter_hash = resolved
+    stripped = chapter_content.strip()
+    if stripped != chapter_content:
+        chapter_content, chapter_hash = stripped, content_hash(stripped)
+    return chapter_content, chapter_hash
+
+def aristo_cache_key(user_input, chapter_context, context_mode):
+    """Cache key for an Aristo answer; the chapter is identified by its content hash"""
+    chapter_identity = None
+    if chapter_context:
+        chapter_identity = (
+            chapter_context.get('chapterNumber'),
+            chapter_context.get('title'),
+            chapter_context.get('contentHash') or content_hash(chapter_context.get('content', ''))
+        )
+    return make_response_key(
+        normalize_question(user_input),
+        chapter_identity,
+        context_mode or context_selector.mode,
+        prompt_store.version,
+        *chat_settings()
+    )
+
+def load_standard_prompts():
+    """Return (standard_prompts, error_response) from the prompt store"""
+    try:
+        return prompt_store.get(), None
+    except PromptsNotFoundError:
+        return None, (jsonify({'error': 'Prompts configuration not found'}), 500)
+    except PromptConfigError:
+        return None, (jsonify({'error': 'Invalid prompts configuration'}), 500)
+
+def wants_cache_bypass(data):
+    """True when the client asked to skip cached answers (noCache flag or Cache-Control: no-cache)"""
+    return bool(data.get('noCache')) or 'no-cache' in request.headers.get('Cache-Control', '')
+
+def fetch_aristo_answer(messages, cache_key):
+    """Call OpenAI for an Aristo answer, parse it and cache it"""
+    model, max_tokens, temperature = chat_settings()
+    response = upstream_policies['chat'].call(
+        openai_client.chat.completions.create,
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        tokens=chat_request_tokens(messages, max_tokens)
+    )
+    
+    ai_response = response.choices[0].message.content.strip()
+    answer = parse_aristo_response(ai_response)
+    aristo_cache.put(cache_key, answer)
+    return answer
+
 @app.route('/api/aristo', methods=['POST'])
 def ask_aristo():
     try:
         data = request.get_json()
         user_input = data.get('input', '').strip()
         chapter_context = data.get('chapterContext')
+        context_mode = data.get('contextMode')  # 'full' sends the whole chapter
         
         if not user_input:
             return jsonify({'error': 'No input provided'}), 400
         
-        # Load standard prompts
-        try:
-            with open('prompts.json', 'r') as f:
-                prompts_data = json.load(f)
-                standard_prompts = prompts_data['standard_prompts']
-        except FileNotFoundError:
-            return jsonify({'error': 'Prompts configuration not found'}), 500
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Invalid prompts configuration'}), 500
-        
-        # Prepare messages for OpenAI
-        messages = []
+        # The chapter may be sent as text, as the hash of text sent before, or by id
+        resolved_context = resolve_chapter_context(chapter_context)
+        if chapter_context and resolved_context is None:
+            body, status = chapter_unknown_error(chapter_context.get('contentHash'))
+            return jsonify(body), status
+        chapter_context = resolved_context
         
-        # Add standard prompts and replace placeholder with user input and context
-        for prompt in standard_prompts:
-            if prompt['role'] == 'system':
-                messages.append({
-                    'role': 'system',
-                    'content': prompt['content']
-                })
-            elif prompt['role'] == 'user':
-                # Build the content with chapter context if available
-                content = ""
-                
-                if chapter_context:
-                    content += f"CURRENT READING CONTEXT:\n"
-                    content += f"Chapter {chapter_context['chapterNumber']}: {chapter_context['title']}\n\n"
-                    content += f"Chapter Content:\n{chapter_context['content']}\n\n"
-                    content += f"---\n\n"
-                
-                # Replace placeholder with actual user input
-                user_prompt = prompt['content'].replace('{user_input}', user_input)
-                content += user_prompt
-                
-                messages.append({
-                    'role': 'user',
-                    'content': content
-                })
+        # Load standard prompts
+        standard_prompts, error_response = load_standard_prompts()
+        if error_response:
+            return error_response
         
-        # Call OpenAI API
-        try:
-            response = openai_client.chat.completions.create(
-                model=os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
-                messages=messages,
-                max_tokens=int(os.getenv('OPENAI_MAX_TOKENS', '500')),
-                temperature=float(os.getenv('OPENAI_TEMPERATURE', '0.7'))
-            )
-            
-            ai_response = response.choices[0].message.content.strip()
-            
-            print(f"=== ARISTO RESPONSE PARSING DEBUG ===")
-            print(f"Raw AI response: {ai_response}")
-            print(f"Response length: {len(ai_response)}")
-            print(f"Response type: {type(ai_response)}")
-            
-            # Parse the JSON array response from Aristo
-            try:
-                parsed_response = json.loads(ai_response)
-                print(f"Parsed response: {parsed_response}")
-                print(f"Parsed response type: {type(parsed_response)}")
-                print(f"Is list: {isinstance(parsed_response, list)}")
-                print(f"List length: {len(parsed_response) if isinstance(parsed_response, list) else 'N/A'}")
-                
-                if isinstance(parsed_response, list) and len(parsed_response) >= 2:
-                    # Extract the answer (first item) and label (second item)
-                    answer = parsed_response[0]
-                    label = parsed_response[1]
-                    
-                    print(f"Extracted answer: {answer}")
-                    print(f"Extracted label: {label}")
-                    print(f"Label type: {type(label)}")
-                    print(f"Label is valid: {label in ['context', 'analysis']}")
-                    
-                    return jsonify({
-                        'success': True,
-                        'response': answer,  # Only return the answer to display
-                        'label': label,      # Include label for backend use
-                        'user_input': user_input
-                    })
-                else:
-                    print(f"❌ Response not in expected format")
-                    # Fallback if response isn't in expected format
-                    return jsonify({
-                        'success': True,
-                        'response': ai_response,
-                        'user_input': user_input,
-                        'label': 'analysis',  # Provide default label
-                        'note': 'Response not in expected JSON array format'
-                    })
-            except json.JSONDecodeError:
-                print(f"❌ JSON decode error")
-                # Fallback if response isn't valid JSON
+        cache_key = aristo_cache_key(user_input, chapter_context, context_mode)
+        if wants_cache_bypass(data):
+            aristo_cache.record_bypass()
+        else:
+            cached_answer = aristo_cache.get(cache_key)
+            if cached_answer is not None:
                 return jsonify({
                     'success': True,
-                    'response': ai_response,
+                    **cached_answer,
                     'user_input': user_input,
-                    'label': 'analysis',  # Provide default label
-                    'note': 'Response not in JSON format'
+                    'cached': True
                 })
+        
+        # Prepare messages for OpenAI
+        try:
+            messages = build_aristo_messages(standard_prompts, user_input, chapter_context, context_mode)
+        except PromptTooLargeError as e:
+            return jsonify({'error': str(e)}), 413
+        
+        # Call OpenAI API (identical in-flight questions share one call)
+        try:
+            answer, _ = upstream_flights.do(('chat', cache_key), fetch_aristo_answer, messages, cache_key)
+            
+            return jsonify({
+                'success': True,
+                **answer,
+                'user_input': user_input
+            })
             
         except Exception as openai_error:
-            print(f"OpenAI API Error: {openai_error}")
+            logger.warning("OpenAI chat failed, using fallback answer: %s", openai_error)
             
             # Provide a fallback response when OpenAI is not available
-            fallback_response = f"""I understand you're asking about: "{user_input}"
-
-While I'd love to provide detailed AI-powered insights, it seems there's an issue connecting to the AI service right now. 
-
-Here are some general reading strategies that might help:
-• Try breaking down complex passages into smaller parts
-• Look for key themes and main ideas
-• Consider the context and background of what you're reading
-• Make connections to your own experiences or other texts
-• Don't hesitate to look up unfamiliar terms or concepts
-
-Please check your OpenAI API configuration and try again for more personalized assistance."""
-            
             return jsonify({
                 'success': True,
-                'response': fallback_response,
+                'response': aristo_fallback_response(user_input),
                 'user_input': user_input,
                 'label': 'analysis',  # Provide default label for fallback
                 'fallback': True
             })
             
-    except Exception as e:
-        print(f"Server Error: {e}")
+    except Exception:
+        logger.exception("Error answering Aristo question")
         return jsonify({'error': 'Internal server error'}), 500
 
+def sse_event(event, data):
+    """Format one Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/aristo/stream', methods=['POST'])
+def ask_aristo_stream():
+    """Server-Sent Events variant of /api/aristo that streams the answer as it is generated"""
+    data = request.get_json(silent=True) or {}
+    user_input = (data.get('input') or '').strip()
+    chapter_context = data.get('chapterContext')
+    context_mode = data.get('contextMode')
+    
+    if not user_input:
+        return jsonify({'error': 'No input provided'}), 400
+    
+    resolved_context = resolve_chapter_context(chapter_context)
+    if chapter_context and resolved_context is None:
+        body, status = chapter_unknown_error(chapter_context.get('contentHash'))
+        return jsonify(body), status
+    chapter_context = resolved_context
+    
+    standard_prompts, error_response = load_standard_prompts()
+    if error_response:
+        return error_response
+    
+    sse_headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    cache_key = aristo_cache_key(user_input, chapter_context, context_mode)
+    
+    cached_answer = None
+    if wants_cache_bypass(data):
+        aristo_cache.record_bypass()
+    else:
+        cached_answer = aristo_cache.get(cache_key)
+    
+    if cached_answer is not None:
+        def replay():
+            yield sse_event('token', {'text': cached_answer['response']})
+            yield sse_event('label', {'label': cached_answer['label']})
+            yield sse_event('done', {'success': True, **cached_answer, 'user_input': user_input, 'cached': True})
+        return Response(replay(), mimetype='text/event-stream', headers=sse_headers)
+    
+    try:
+        messages = build_aristo_messages(standard_prompts, user_input, chapter_context, context_mode)
+    except PromptTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
+    
+    def generate():
+        parser = AnswerStreamParser()
+        try:
+            model, max_tokens, temperature = chat_settings()
+            with upstream_policies['chat'].guard(tokens=chat_request_tokens(messages, max_tokens)):
+                stream = openai_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True
+                )
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    for event, value in parser.feed(delta):
+                        if event == 'token':
+                            yield sse_event('token', {'text': value})
+                        else:
+                            yield sse_event('label', {'label': value})
+        except Exception as openai_error:
+            logger.warning("OpenAI chat stream failed: %s", openai_error)
+            if not parser.text:
+                fallback = aristo_fallback_response(user_input)
+                yield sse_event('token', {'text': fallback})
+                yield sse_event('label', {'label': 'analysis'})
+                yield sse_event('done', {
+                    'success': True,
+                    'response': fallback,
+                    'label': 'analysis',
+                    'user_input': user_input,
+                    'fallback': True
+                })
+            else:
+                yield sse_event('error', {'error': 'AI response interrupted'})
+            return
+        
+        # The final event carries the authoritative parse of the whole reply
+        answer = parse_aristo_response(parser.text.strip())
+        aristo_cache.put(cache_key, answer)
+        if parser.label is None:
+            yield sse_event('label', {'label': answer['label']})
+        yield sse_event('done', {'success': True, **answer, 'user_input': user_input})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=sse_headers)
+
+def collect_cache_metrics():
+    aristo_stats = aristo_cache.stats()
+    metrics.record_cache_stats('aristo', aristo_stats['hits'], aristo_stats['misses'])
+    audio_stats = audio_cache.stats()
+    metrics.record_cache_stats('audio', audio_stats['hits_memory'] + audio_stats['hits_disk'], audio_stats['misses'])
+
+metrics.registry.add_collector(collect_cache_metrics)
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """Hit/miss counters for the server-side caches"""
+    return jsonify({
+        'aristo': aristo_cache.stats(),
+        'audio': audio_cache.stats(),
+        'coalescing': upstream_flights.stats(),
+        'corpus': corpus.stats(),
+        'content': content_store.stats(),
+        'prompts': prompt_builder.stats(),
+        'search': book_search.stats(),
+        'reader_state': reader_state.stats() if reader_state is not None else None,
+        'upstream': {name: policy.stats() for name, policy in upstream_policies.items()}
+    })
+
 @app.route('/test_supabase.html')
 def test_supabase():
     return render_template('test_supabase.html')
@@ -239,238 +601,759 @@ def test_frontend():
 def test_audio_persistence():
     return render_template('test_audio_persistence.html')
 
+def selection_settings():
+    """Return (model, max_tokens, temperature) for text-selection completions"""
+    return (
+        os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
+        int(os.getenv('OPENAI_MAX_TOKENS', '300')),
+        0.3  # Lower temperature for more precise selection
+    )
+
+def build_selection_messages(user_question, aristo_response, chapter_content, context_mode=None, chapter_hash=None):
+    """Build the chat messages asking the model to quote the most relevant chapter snippet"""
+    # Only the passages most related to the exchange are offered for selection
+    return prompt_builder.selection_messages(
+        user_question, aristo_response, chapter_content, context_mode, chapter_hash
+    )
+
+def selection_flight_key(user_question, aristo_response, chapter_content, context_mode=None, chapter_hash=None):
+    """Identity of a text-selection upstream call, used to coalesce duplicates"""
+    return make_response_key(
+        user_question,
+        aristo_response,
+        chapter_hash or content_hash(chapter_content),
+        context_mode or context_selector.mode,
+        *selection_settings()
+    )
+
+def fetch_selected_text(messages):
+    """Ask OpenAI to quote the most relevant chapter snippet"""
+    model, max_tokens, temperature = selection_settings()
+    response = upstream_policies['selection'].call(
+        openai_client.chat.completions.create,
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        tokens=chat_request_tokens(messages, max_tokens)
+    )
+    return response.choices[0].message.content.strip()
+
+def local_text_selection(user_question, aristo_response, chapter_content, chapter_hash=None):
+    """Answer a text-selection request from the sentence index alone"""
+    match = chapter_indexes.get(chapter_content, chapter_hash).best_match(f"{user_question} {aristo_response}")
+    if not match:
+        return {
+            'success': False,
+            'error': 'No relevant text found in chapter content'
+        }
+    return {
+        'success': True,
+        'selectedText': match['text'],
+        'start': match['start'],
+        'end': match['end'],
+        'local': True
+    }
+
+def resolve_selected_text(chapter_content, selected_text):
+    """Map the model's quote back onto the chapter (exact, or fuzzy multi-sentence span)"""
+    span = locate_span(chapter_content, selected_text)
+    if span:
+        start, end = span
+        logger.debug("Selected text located", extra={'start': start, 'end': end})
+        return {
+            'success': True,
+            'selectedText': chapter_content[start:end],
+            'start': start,
+            'end': end
+        }
+    logger.info("AI-selected text not found in chapter content", extra={'selected_chars': len(selected_text)})
+    return {
+        'success': False,
+        'error': 'AI selected text not found in chapter content'
+    }
+
+def fallback_text_selection(user_question, chapter_content, chapter_hash=None):
+    """Text selection used when the AI service fails"""
+    match = find_fallback_match(user_question, chapter_content, chapter_hash)
+    
+    if match:
+        # The index already knows where its sentence sits; no need to search for it again
+        return {
+            'success': True,
+            'selectedText': match['text'],
+            'start': match['start'],
+            'end': match['end'],
+            'fallback': True
+        }
+    logger.info("Fallback text selection found no match")
+    return {
+        'success': False,
+        'error': 'Could not find relevant text with AI or fallback method'
+    }
+
 @app.route('/api/find-relevant-text', methods=['POST'])
 def find_relevant_text():
     """Find the most relevant text snippet from chapter content using AI"""
-    print("=== FIND RELEVANT TEXT API CALLED ===")
     try:
         data = request.get_json()
-        print(f"Received data keys: {list(data.keys()) if data else 'None'}")
-        
         user_question = data.get('userQuestion', '').strip()
         aristo_response = data.get('aristoResponse', '').strip()
-        chapter_content = data.get('chapterContent', '').strip()
         
-        print(f"User question length: {len(user_question)}")
-        print(f"Aristo response length: {len(aristo_response)}")
-        print(f"Chapter content length: {len(chapter_content)}")
+        # The chapter may be sent as text, as the hash of text sent before, or by id
+        chapter = selection_chapter(data)
+        if chapter is None:
+            body, status = chapter_unknown_error(data.get('chapterHash'))
+            return jsonify(body), status
+        chapter_content, chapter_hash = chapter
+        
+        logger.debug("Find relevant text request", extra={
+            'question_chars': len(user_question),
+            'response_chars': len(aristo_response),
+            'chapter_chars': len(chapter_content)
+        })
+        
+        # Local mode answers from the sentence index without calling the LLM
+        if data.get('mode') == 'local':
+            if not user_question or not chapter_content:
+                return jsonify({'error': 'Missing required data'}), 400
+            return jsonify(local_text_selection(user_question, aristo_response, chapter_content, chapter_hash))
         
         if not all([user_question, aristo_response, chapter_content]):
-            print("ERROR: Missing required data")
             return jsonify({'error': 'Missing required data'}), 400
         
-        # Prepare the prompt for text selection
-        selection_prompt = f"""You are helping to identify the most relevant text snippet from a chapter that relates to a user's question and an AI assistant's response.
-
-USER'S QUESTION: {user_question}
-
-AI ASSISTANT'S RESPONSE: {aristo_response}
-
-CHAPTER CONTENT:
-{chapter_content}
-
-Your task is to find the most relevant text snippet from the chapter content that directly relates to both the user's question and the AI assistant's response. This text will be highlighted to show the connection.
-
-Rules:
-1. Select a continuous text snippet (not multiple separate pieces)
-2. The snippet should be between 10-200 words
-3. It should be the EXACT text as it appears in the chapter (maintain exact spelling, punctuation, and capitalization)
-4. Choose text that most directly relates to what the user asked about and what the AI responded about
-5. If multiple snippets are relevant, choose the most significant one
-6. Respond with ONLY the selected text snippet, no additional commentary or quotation marks
-
-Selected text snippet:"""
-
         try:
-            print("Calling OpenAI API for text selection...")
-            # Call OpenAI API for text selection
-            response = openai_client.chat.completions.create(
-                model=os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
-                messages=[
-                    {
-                        'role': 'user',
-                        'content': selection_prompt
-                    }
-                ],
-                max_tokens=int(os.getenv('OPENAI_MAX_TOKENS', '300')),
-                temperature=0.3  # Lower temperature for more precise selection
+            messages = build_selection_messages(
+                user_question, aristo_response, chapter_content, data.get('contextMode'), chapter_hash
             )
-            
-            selected_text = response.choices[0].message.content.strip()
-            print(f"OpenAI selected text length: {len(selected_text)}")
-            print(f"Selected text preview: {selected_text[:100]}...")
-            
-            # Validate that the selected text exists in the chapter content
-            if selected_text in chapter_content:
-                print("✅ Selected text found in chapter content")
-                return jsonify({
-                    'success': True,
-                    'selectedText': selected_text
-                })
-            else:
-                print("⚠️ Selected text not found exactly, trying fuzzy matching...")
-                # Try to find a close match (in case of minor formatting differences)
-                import difflib
-                
-                # Split chapter into sentences/phrases for fuzzy matching
-                chapter_sentences = []
-                for paragraph in chapter_content.split('\n\n'):
-                    sentences = paragraph.split('. ')
-                    chapter_sentences.extend(sentences)
-                
-                print(f"Split chapter into {len(chapter_sentences)} sentences")
-                
-                # Find best match
-                best_match = difflib.get_close_matches(
-                    selected_text, 
-                    chapter_sentences, 
-                    n=1, 
-                    cutoff=0.6
-                )
-                
-                if best_match:
-                    print(f"✅ Found fuzzy match: {best_match[0][:100]}...")
-                    return jsonify({
-                        'success': True,
-                        'selectedText': best_match[0].strip()
-                    })
-                else:
-                    print("❌ No fuzzy match found")
-                    return jsonify({
-                        'success': False,
-                        'error': 'AI selected text not found in chapter content'
-                    })
+        except PromptTooLargeError as e:
+            return jsonify({'error': str(e)}), 413
+        
+        try:
+            # Call OpenAI API for text selection (identical in-flight requests share one call)
+            flight_key = selection_flight_key(
+                user_question, aristo_response, chapter_content, data.get('contextMode'), chapter_hash
+            )
+            selected_text, _ = upstream_flights.do(('selection', flight_key), fetch_selected_text, messages)
+            return jsonify(resolve_selected_text(chapter_content, selected_text))
             
         except Exception as openai_error:
-            print(f"❌ OpenAI API Error in text selection: {openai_error}")
+            logger.warning("OpenAI text selection failed, using local fallback: %s", openai_error)
             
-            # Fallback: Use simple keyword matching
-            print("Trying fallback keyword matching...")
-            fallback_text = find_fallback_relevant_text(user_question, chapter_content)
+            # Fallback: Use local sentence index
+            return jsonify(fallback_text_selection(user_question, chapter_content, chapter_hash))
             
-            if fallback_text:
-                print(f"✅ Fallback found text: {fallback_text[:100]}...")
-                return jsonify({
-                    'success': True,
-                    'selectedText': fallback_text,
-                    'fallback': True
-                })
-            else:
-                print("❌ Fallback also failed")
-                return jsonify({
-                    'success': False,
-                    'error': 'Could not find relevant text with AI or fallback method'
-                })
-            
-    except Exception as e:
-        print(f"❌ Server Error in find_relevant_text: {e}")
-        print(f"Error details: {str(e)}")
+    except Exception:
+        logger.exception("Error in find_relevant_text")
         return jsonify({'error': 'Internal server error'}), 500
 
-def find_fallback_relevant_text(user_question, chapter_content):
-    """Fallback method to find relevant text using keyword matching"""
-    print("=== FALLBACK TEXT SELECTION START ===")
+def find_fallback_match(user_question, chapter_content, chapter_hash=None):
+    """Fallback method to find relevant text using the local BM25 sentence index; a match dict or None"""
     try:
-        import re
-        
-        # Extract key words from the user question (remove common words)
-        common_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'what', 'how', 'why', 'when', 'where', 'who', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 'can', 'may', 'might', 'this', 'that', 'these', 'those'}
-        
-        question_words = [word.lower().strip('.,!?;:') for word in user_question.split() if word.lower() not in common_words and len(word) > 2]
-        print(f"Extracted keywords: {question_words}")
-        
-        if not question_words:
-            print("No keywords extracted from question")
-            return None
-        
-        # Split chapter into sentences
-        sentences = []
-        for paragraph in chapter_content.split('\n\n'):
-            para_sentences = re.split(r'[.!?]+', paragraph)
-            sentences.extend([s.strip() for s in para_sentences if s.strip()])
-        
-        print(f"Split chapter into {len(sentences)} sentences")
-        
-        # Score sentences based on keyword matches
-        best_sentence = ""
-        best_score = 0
-        
-        for i, sentence in enumerate(sentences):
-            if len(sentence) < 20:  # Skip very short sentences
-                continue
-                
-            score = 0
-            sentence_lower = sentence.lower()
-            
-            matched_words = []
-            for word in question_words:
-                if word in sentence_lower:
-                    score += 1
-                    matched_words.append(word)
-            
-            # Bonus for longer, more complete sentences
-            if len(sentence) > 50:
-                score += 0.5
-            
-            if score > best_score and score > 0:
-                best_score = score
-                best_sentence = sentence
-                print(f"New best sentence (score {score}): {sentence[:100]}... (matched: {matched_words})")
-        
-        print(f"Final best sentence score: {best_score}")
-        print("=== FALLBACK TEXT SELECTION END ===")
-        return best_sentence if best_sentence else None
-        
-    except Exception as e:
-        print(f"❌ Error in fallback text selection: {e}")
+        return chapter_indexes.get(chapter_content, chapter_hash).best_match(user_question)
+    except Exception:
+        logger.exception("Error in fallback text selection")
         return None
 
+# Format used when a request doesn't name one: mp3, or the more compact opus/aac
+DEFAULT_AUDIO_FORMAT = os.getenv('AUDIO_FORMAT', 'mp3')
+
+def synthesize_speech(text, voice, model, fmt=DEFAULT_AUDIO_FORMAT):
+    """Return (audio_bytes, cache_key, cached, coalesced) for text, calling OpenAI TTS only on a cache miss
+
+    cached means the clip came from the audio cache; coalesced means it was
+    synthesized just now by a concurrent request for the same clip.
+    """
+    cache_key = make_cache_key(text, voice, model, fmt)
+    audio_bytes = audio_cache.get(cache_key)
+    if audio_bytes is not None:
+        return audio_bytes, cache_key, True, False
+    
+    # Concurrent requests for the same clip wait on a single upstream call
+    audio_bytes, shared = upstream_flights.do(('tts', cache_key), fetch_speech, text, voice, model, cache_key, fmt)
+    return audio_bytes, cache_key, False, shared
+
+def fetch_speech(text, voice, model, cache_key, fmt=DEFAULT_AUDIO_FORMAT):
+    """Call OpenAI TTS and store the result in the audio cache"""
+    logger.debug("Generating audio", extra={'text_chars': len(text), 'voice': voice, 'model': model, 'format': fmt})
+    
+    # OpenAI TTS API call
+    response = upstream_policies['tts'].call(
+        openai_client.audio.speech.create,
+        model=model,
+        voice=voice,
+        input=text,
+        response_format=fmt
+    )
+    audio_bytes = response.content
+    audio_cache.put(cache_key, audio_bytes)
+    return audio_bytes
+
+def stream_speech_chunks(text, voice, model, cache_key, fmt=DEFAULT_AUDIO_FORMAT):
+    """Yield audio chunks from OpenAI TTS as they arrive, caching the full clip once complete"""
+    chunk_size = int(os.getenv('AUDIO_STREAM_CHUNK_SIZE', '16384'))
+    chunks = []
+    with upstream_policies['tts'].guard(), openai_client.audio.speech.with_streaming_response.create(
+        model=model,
+        voice=voice,
+        input=text,
+        response_format=fmt
+    ) as response:
+        for chunk in response.iter_bytes(chunk_size):
+            chunks.append(chunk)
+            yield chunk
+    # Only reached when the upstream finished and the client read everything
+    audio_bytes = b''.join(chunks)
+    metrics.upstream_bytes.inc(len(audio_bytes), upstream='tts')
+    audio_cache.put(cache_key, audio_bytes)
+
+def split_text_for_tts(text):
+    """Segment texts for TTS, in the deterministic order the audio cache keys depend on"""
+    return [segment.text for segment in split_text(text)]
+
+def read_audio_format(data):
+    """Requested audio format from a payload ('mp3', 'opus' or 'aac'), or None if unsupported"""
+    fmt = str(data.get('format') or DEFAULT_AUDIO_FORMAT).lower()
+    return fmt if fmt in AUDIO_MIME_TYPES else None
+
+def read_audio_request(data, max_chars=TTS_MAX_CHARS):
+    """Extract (text, voice, model, fmt, error) from an audio request payload; error is a message or None"""
+    text = (data.get('text') or '').strip()
+    voice = data.get('voice') or 'alloy'  # alloy, echo, fable, onyx, nova, shimmer
+    model = data.get('model') or 'tts-1'  # tts-1 or tts-1-hd for higher quality
+    fmt = read_audio_format(data)
+    
+    if not text:
+        return text, voice, model, fmt, 'No text provided'
+        
+    if len(text) > max_chars:
+        return text, voice, model, fmt, f'Text too long. Maximum {max_chars} characters.'
+    
+    if fmt is None:
+        return text, voice, model, fmt, f"Unsupported format. Use one of: {', '.join(AUDIO_MIME_TYPES)}"
+    
+    return text, voice, model, fmt, None
+
+# Longer texts are segmented and synthesized in parallel by /api/generate-audio
+AUDIO_MAX_TEXT_CHARS = int(os.getenv('AUDIO_MAX_TEXT_CHARS', '100000'))
+
+def synthesize_long_speech(text, voice, model, fmt=DEFAULT_AUDIO_FORMAT):
+    """Synthesize text over the TTS limit segment by segment; returns (audio_bytes, cached, coalesced, timings)"""
+    segments = split_text(text)
+    futures = [
+        audio_synthesis_pool.submit(synthesize_speech, segment.text, voice, model, fmt) for segment in segments
+    ]
+    clips = [future.result() for future in futures]
+    # One playable file (Opus clips are remuxed into a single stream); durations are within it
+    audio_bytes, durations = join_audio([clip[0] for clip in clips], fmt)
+    timings = timing_map(segments, durations)
+    for timing, (_, cache_key, _, _) in zip(timings, clips):
+        timing['cache_key'] = cache_key
+        timing['audio_url'] = audio_clip_url(cache_key)
+    return (
+        audio_bytes,
+        all(cached for _, _, cached, _ in clips),
+        any(coalesced for _, _, _, coalesced in clips),
+        timings
+    )
+
+def upstream_unavailable_response(error):
+    """503 telling the client to use its local fallback (browser speech) for now"""
+    logger.warning("Upstream unavailable (%s), asking client to fall back", error)
+    return jsonify({
+        'error': 'Audio service temporarily unavailable',
+        'fallback_available': True
+    }), 503, {'Retry-After': str(max(1, round(error.retry_after)))}
+
 @app.route('/api/generate-audio', methods=['POST'])
 def generate_audio():
     """Generate high-quality audio for text using OpenAI TTS API"""
+    # Clients that ask for raw audio get the streaming response instead of base64 JSON
+    if request.accept_mimetypes.best_match(['application/json', *AUDIO_MIME_TYPES.values()]) in AUDIO_MIME_TYPES.values():
+        return stream_audio()
+    
     try:
         data = request.get_json()
-        text = data.get('text', '').strip()
-        voice = data.get('voice', 'alloy')  # alloy, echo, fable, onyx, nova, shimmer
-        model = data.get('model', 'tts-1')  # tts-1 or tts-1-hd for higher quality
+        text, voice, model, fmt, error = read_audio_request(data, max_chars=AUDIO_MAX_TEXT_CHARS)
+        if error:
+            return jsonify({'error': error}), 400
         
-        if not text:
-            return jsonify({'error': 'No text provided'}), 400
-            
-        if len(text) > 4096:  # OpenAI TTS limit
-            return jsonify({'error': 'Text too long. Maximum 4096 characters.'}), 400
-            
-        print(f"Generating audio for text length: {len(text)} characters with voice: {voice}")
-        
-        # OpenAI TTS API call
-        response = openai_client.audio.speech.create(
-            model=model,
-            voice=voice,
-            input=text,
-            response_format="mp3"
-        )
+        if len(text) > TTS_MAX_CHARS:
+            audio_bytes, cached, coalesced, timings = synthesize_long_speech(text, voice, model, fmt)
+            cache_key = None
+            duration = sum(timing['duration'] for timing in timings)
+        else:
+            audio_bytes, cache_key, cached, coalesced = synthesize_speech(text, voice, model, fmt)
+            timings = None
+            duration = audio_duration(audio_bytes, fmt)
         
         # Convert to base64 for JSON response
         import base64
-        audio_base64 = base64.b64encode(response.content).decode('utf-8')
-        
-        print(f"Audio generated successfully, size: {len(response.content)} bytes")
+        audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
         
         return jsonify({
             'success': True,
             'audio_data': audio_base64,
-            'format': 'mp3',
+            'format': fmt,
             'text_length': len(text),
             'voice': voice,
-            'model': model
+            'model': model,
+            'cache_key': cache_key,
+            'cached': cached,
+            'coalesced': coalesced,
+            'audio_url': audio_clip_url(cache_key) if cache_key else None,
+            'duration': duration,
+            'segments': timings
         })
         
+    except UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    except Exception as e:
+        logger.warning("Error generating audio: %s", e)
+        return jsonify({
+            'error': f'Failed to generate audio: {str(e)}',
+            'fallback_available': True
+        }), 500
+
+@app.route('/api/generate-audio/stream', methods=['GET', 'POST'])
+def stream_audio():
+    """Stream audio for text as it is synthesized (usable directly as an <audio> src via GET)"""
+    data = request.args if request.method == 'GET' else (request.get_json(silent=True) or {})
+    text, voice, model, fmt, error = read_audio_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    mimetype = AUDIO_MIME_TYPES[fmt]
+    cache_key = make_cache_key(text, voice, model, fmt)
+    headers = {
+        'X-Audio-Cache-Key': cache_key,
+        'Cache-Control': 'no-store',
+    }
+    
+    audio_bytes = audio_cache.get(cache_key)
+    if audio_bytes is not None:
+        headers['X-Audio-Cache'] = 'HIT'
+        return Response(audio_bytes, mimetype=mimetype, headers=headers)
+    
+    # Pull the first chunk eagerly so upstream failures still produce a JSON error
+    chunks = stream_speech_chunks(text, voice, model, cache_key, fmt)
+    try:
+        first_chunk = next(chunks, b'')
+    except UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
     except Exception as e:
-        print(f"Error generating audio: {e}")
+        logger.warning("Error streaming audio: %s", e)
         return jsonify({
             'error': f'Failed to generate audio: {str(e)}',
             'fallback_available': True
         }), 500
+    
+    def body():
+        yield first_chunk
+        yield from chunks
+    
+    headers['X-Audio-Cache'] = 'MISS'
+    return Response(stream_with_context(body()), mimetype=mimetype, headers=headers)
+
+def store_chapter_audio(book_id, chapter_id, voice, model, segments, audio, fmt=DEFAULT_AUDIO_FORMAT):
+    """Persist a fully synthesized chapter to the blob store as one file; returns (key, manifest)"""
+    key = chapter_audio_key(book_id, chapter_id, voice, model, fmt)
+    manifest = audio_blob_store.put_chapter(
+        key, list(zip(audio, segments)), voice=voice, model=model, fmt=fmt,
+        chapter_text_hash=text_hash('\n\n'.join(segments))
+    )
+    logger.info("Stored chapter audio %s", key, extra={'bytes': sum(len(a) for a in audio), 'format': fmt})
+    return key, manifest
+
+@app.route('/api/generate-audio/chapter', methods=['POST'])
+def generate_chapter_audio():
+    """Synthesize a whole chapter (or list of segments) in parallel, returning segments in order"""
+    data = request.get_json(silent=True) or {}
+    voice = data.get('voice') or 'alloy'
+    model = data.get('model') or 'tts-1'
+    fmt = read_audio_format(data)
+    if fmt is None:
+        return jsonify({'error': f"Unsupported format. Use one of: {', '.join(AUDIO_MIME_TYPES)}"}), 400
+    # With a chapter_id the finished chapter is also kept in the blob store
+    book_id = str(data.get('book_id') or DEFAULT_BOOK_ID)
+    chapter_id = data.get('chapter_id')
+    
+    # Segmented server-side so every client gets the same segments (and cache keys);
+    # start/end offsets index into the text, or into the given segments joined by blank lines
+    texts = data.get('segments')
+    if texts is None:
+        segments = split_text(data.get('text') or '')
+    else:
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return jsonify({'error': 'segments must be a list of strings'}), 400
+        segments = split_segments(texts)
+    
+    if not segments:
+        return jsonify({'error': 'No text provided'}), 400
+    
+    # All segments are submitted at once; the pool bounds upstream concurrency
+    futures = [
+        audio_synthesis_pool.submit(synthesize_speech, segment.text, voice, model, fmt) for segment in segments
+    ]
+    
+    if data.get('merged'):
+        return merged_chapter_audio(book_id, chapter_id, voice, model, fmt, segments, futures)
+    
+    audio = [None] * len(segments)
+    elapsed = [0.0]  # playback time before the next segment
+    
+    def segment_result(index):
+        import base64
+        segment = segments[index]
+        position = {'index': index, 'start': segment.start, 'end': segment.end, 'start_time': elapsed[0]}
+        try:
+            audio_bytes, cache_key, cached, coalesced = futures[index].result()
+        except Exception as e:
+            logger.warning("Error generating audio for segment %d: %s", index, e)
+            return {**position, 'success': False, 'error': str(e), 'audio_data': None, 'duration': 0.0}
+        audio[index] = audio_bytes
+        duration = audio_duration(audio_bytes, fmt)
+        elapsed[0] += duration
+        return {
+            **position,
+            'success': True,
+            'audio_data': base64.b64encode(audio_bytes).decode('utf-8'),
+            'text_length': len(segment.text),
+            'duration': duration,
+            'cache_key': cache_key,
+            'cached': cached,
+            'coalesced': coalesced,
+            'audio_url': audio_clip_url(cache_key)
+        }
+    
+    def store_chapter():
+        if chapter_id is None or any(audio_bytes is None for audio_bytes in audio):
+            return None
+        try:
+            key, _ = store_chapter_audio(
+                book_id, chapter_id, voice, model, [segment.text for segment in segments], audio, fmt
+            )
+            return key
+        except (OSError, ValueError) as e:
+            logger.warning("Could not store chapter audio: %s", e)
+            return None
+    
+    if data.get('stream'):
+        # Newline-delimited JSON, one line per segment in order as soon as it is ready
+        def body():
+            for index in range(len(segments)):
+                yield json.dumps(segment_result(index)) + '\n'
+            store_chapter()
+        return Response(stream_with_context(body()), mimetype='application/x-ndjson',
+                        headers={'X-Segment-Count': str(len(segments))})
+    
+    results = [segment_result(index) for index in range(len(segments))]
+    return jsonify({
+        'success': any(result['success'] for result in results),
+        'segments': results,
+        'segment_count': len(results),
+        'format': fmt,
+        'voice': voice,
+        'model': model,
+        'chapter_audio_key': store_chapter()
+    })
+
+def merged_chapter_audio(book_id, chapter_id, voice, model, fmt, segments, futures):
+    """
+    Store the synthesized segments as one chapter file and answer with its
+    manifest instead of inline audio: the client downloads the chapter once
+    (seeking with Range) and uses the segment offsets and start times for sync.
+    """
+    audio = []
+    for index, future in enumerate(futures):
+        try:
+            audio.append(future.result()[0])
+        except UpstreamUnavailable as e:
+            return upstream_unavailable_response(e)
+        except Exception as e:
+            logger.warning("Error generating audio for segment %d: %s", index, e)
+            return jsonify({
+                'error': f'Failed to generate audio for segment {index}: {str(e)}',
+                'fallback_available': True
+            }), 500
+    
+    texts = [segment.text for segment in segments]
+    if chapter_id is None:
+        # Text without a chapter id is stored under its content hash
+        chapter_id = 'text-' + text_hash('\n\n'.join(texts))[:16]
+    try:
+        key, manifest = store_chapter_audio(book_id, chapter_id, voice, model, texts, audio, fmt)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not store chapter audio: %s", e)
+        return jsonify({'error': 'Could not store chapter audio'}), 500
+    
+    add_audio_urls(key, manifest)
+    for entry, segment in zip(manifest['segments'], segments):
+        entry['start'] = segment.start
+        entry['end'] = segment.end
+    return jsonify({'success': True, 'chapter_audio_key': key, **manifest})
+
+# Versioned audio URLs (content-addressed, or carrying ?v=<etag>) never change
+AUDIO_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+def send_audio(f, size, etag, immutable, mimetype='audio/mpeg'):
+    """Serve an open audio file with ETag, Range and caching support"""
+    # wrap_file lets the WSGI server use sendfile() for whole-file responses
+    response = Response(wrap_file(request.environ, f), mimetype=mimetype, direct_passthrough=True)
+    response.content_length = size
+    response.set_etag(etag)
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = AUDIO_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    try:
+        return response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        f.close()
+        raise
+
+def audio_clip_url(cache_key):
+    return f"/api/audio/{cache_key}"
+
+@app.route('/api/audio/<cache_key>')
+def get_cached_audio(cache_key):
+    """A synthesized clip by its cache key (from /api/generate-audio); immutable since keys hash the text"""
+    if not re.fullmatch(r'[0-9a-f]{64}', cache_key):
+        return jsonify({'error': 'Audio not found'}), 404
+    path = audio_cache.file_path(cache_key)
+    if path is not None:
+        f = open(path, 'rb')
+        size = os.fstat(f.fileno()).st_size
+        # Keys don't say which format a clip is in; its first bytes do
+        head = f.read(4096)
+        f.seek(0)
+    else:
+        audio_bytes = audio_cache.get(cache_key)
+        if audio_bytes is None:
+            return jsonify({'error': 'Audio not found'}), 404
+        f, size = io.BytesIO(audio_bytes), len(audio_bytes)
+        head = audio_bytes[:4096]
+    return send_audio(f, size, cache_key, immutable=True, mimetype=AUDIO_MIME_TYPES[sniff_format(head)])
+
+def chapter_audio_manifest(key):
+    return audio_blob_store.get_manifest(key) if is_valid_key(key) else None
+
+def manifest_mimetype(manifest):
+    return AUDIO_MIME_TYPES.get(manifest.get('format'), 'audio/mpeg')
+
+def add_audio_urls(key, manifest):
+    """Annotate a manifest with its ETag and versioned (immutable) audio URLs; returns the ETag"""
+    etag = manifest_etag(manifest)
+    manifest['etag'] = etag
+    manifest['audio_url'] = f"/api/audio/chapters/{key}/audio?v={etag}"
+    for segment in manifest['segments']:
+        segment['audio_url'] = f"/api/audio/chapters/{key}/segments/{segment['index']}?v={etag}"
+    return etag
+
+@app.route('/api/audio/chapters/<key>')
+def get_chapter_audio_manifest(key):
+    """Segment offsets, durations and text hashes for a stored chapter, with versioned audio URLs"""
+    manifest = chapter_audio_manifest(key)
+    if not manifest:
+        return jsonify({'error': 'Chapter audio not found'}), 404
+    etag = add_audio_urls(key, manifest)
+    response = jsonify(manifest)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/audio/chapters/<key>/audio')
+def get_chapter_audio(key):
+    """The whole chapter as one audio file (seekable via Range)"""
+    manifest = chapter_audio_manifest(key)
+    if not manifest:
+        return jsonify({'error': 'Chapter audio not found'}), 404
+    etag = manifest_etag(manifest)
+    f, size = audio_blob_store.open_blob(key)
+    return send_audio(f, size, etag, immutable=request.args.get('v') == etag, mimetype=manifest_mimetype(manifest))
+
+@app.route('/api/audio/chapters/<key>/segments/<int:index>')
+def get_chapter_audio_segment(key, index):
+    """Raw audio for one segment, read straight out of the chapter blob"""
+    manifest = chapter_audio_manifest(key)
+    opened = audio_blob_store.open_segment(key, index, manifest) if manifest else None
+    if opened is None:
+        return jsonify({'error': 'Segment not found'}), 404
+    etag = f"{manifest_etag(manifest)}-{index}"
+    f, size = opened
+    return send_audio(
+        f, size, etag, immutable=request.args.get('v') == manifest_etag(manifest), mimetype=manifest_mimetype(manifest)
+    )
+
+DEFAULT_BOOK_ID = 'default'
+
+def load_book_chapter_text(book_id, chapter_id):
+    """Return the text of a chapter for background jobs, or None if unknown"""
+    if book_id != DEFAULT_BOOK_ID:
+        return corpus.chapter_text(book_id, chapter_id)
+    chapter = chapter_store.get_chapter(chapter_id)
+    return chapter['content'] if chapter else None
+
+prerender_store = JobStore(
+    os.getenv('PRERENDER_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prerender_jobs.db'))
+)
+prerender_worker = PrerenderWorker(
+    prerender_store,
+    load_chapter_text=load_book_chapter_text,
+    split_text=split_text_for_tts,
+    synthesize=synthesize_speech,
+    store_chapter=store_chapter_audio,
+    backoff_base=float(os.getenv('PRERENDER_BACKOFF_SECONDS', '30'))
+)
+
+def start_prerender_worker():
+    """Start the prerender worker unless PRERENDER_WORKER=false; called by the serving entry points, not on import"""
+    if os.getenv('PRERENDER_WORKER', 'true').lower() == 'true':
+        prerender_worker.start()
+
+@app.route('/api/prerender', methods=['POST'])
+def enqueue_prerender():
+    """Queue background synthesis of a book's chapters into the audio cache"""
+    data = request.get_json(silent=True) or {}
+    book_id = str(data.get('book_id') or DEFAULT_BOOK_ID)
+    voice = data.get('voice') or 'alloy'
+    model = data.get('model') or 'tts-1'
+    fmt = read_audio_format(data)
+    if fmt is None:
+        return jsonify({'error': f"Unsupported format. Use one of: {', '.join(AUDIO_MIME_TYPES)}"}), 400
+    
+    if book_id == DEFAULT_BOOK_ID:
+        book_chapter_ids = list(chapter_store.chapters)
+    else:
+        book = corpus.get(book_id)
+        if not book:
+            return jsonify({'error': 'Book not found'}), 404
+        book_chapter_ids = book.chapter_ids()
+    
+    chapter_ids = data.get('chapter_ids')
+    if chapter_ids is None:
+        chapter_ids = book_chapter_ids
+    elif not isinstance(chapter_ids, list) or not chapter_ids:
+        return jsonify({'error': 'chapter_ids must be a non-empty list'}), 400
+    try:
+        chapter_ids = [int(chapter_id) for chapter_id in chapter_ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'chapter_ids must be integers'}), 400
+
+    missing = [chapter_id for chapter_id in chapter_ids if load_book_chapter_text(book_id, chapter_id) is None]
+    if missing:
+        return jsonify({'error': 'Chapter not found', 'chapter_ids': missing}), 404
+    
+    job, created = prerender_store.enqueue(
+        book_id, chapter_ids, voice, model, fmt,
+        max_attempts=int(os.getenv('PRERENDER_MAX_ATTEMPTS', '5'))
+    )
+    return jsonify({'success': True, 'created': created, 'job': job}), 202
+
+@app.route('/api/prerender')
+def list_prerender_jobs():
+    return jsonify({'jobs': prerender_store.list(status=request.args.get('status'))})
+
+@app.route('/api/prerender/<int:job_id>')
+def get_prerender_job(job_id):
+    job = prerender_store.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job': job})
+
+# Book-wide passage search; indexes are built on first query and persisted as .npy
+book_search = create_default_search()
+
+def search_source(book_id):
+    """(etag, chapter lookup, chapter texts loader) for a searchable book, or None"""
+    if book_id == DEFAULT_BOOK_ID:
+        return (
+            chapter_store.book_payload.etag,
+            chapter_store.get_chapter,
+            lambda: [(c['id'], c['content']) for c in chapter_store.chapters.values()]
+        )
+    book = corpus.get(book_id)
+    if not book:
+        return None
+    return (
+        book.etag,
+        book.chapter,
+        lambda: ((entry.id, book.text(entry)) for entry in book.entries())
+    )
+
+@app.route('/api/search')
+def search_book():
+    """Passages from anywhere in a book ranked by similarity to the query q"""
+    query = (request.args.get('q') or '').strip()
+    book_id = request.args.get('book_id', DEFAULT_BOOK_ID)
+    top_k = min(max(request.args.get('k', 10, type=int), 1), 50)
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    source = search_source(book_id)
+    if not source:
+        return jsonify({'error': 'Book not found'}), 404
+    etag, get_chapter, load_chapters = source
+    
+    results = []
+    for chapter_id, start, end, score in book_search.search(book_id, etag, load_chapters, query, top_k):
+        chapter = get_chapter(chapter_id)
+        if not chapter:
+            continue
+        results.append({
+            'chapterId': chapter_id,
+            'chapterTitle': chapter['title'],
+            'start': start,
+            'end': end,
+            'text': chapter['content'][start:end],
+            'score': round(score, 4),
+        })
+    return jsonify({'query': query, 'bookId': book_id, 'results': results})
+
+# Highlights, notes and reading progress served from the backend (None unless READER_STATE_DB is set)
+reader_state = create_reader_state_store()
+
+def reader_state_disabled():
+    return jsonify({'error': 'Reader state is not enabled on this server'}), 404
+
+@app.route('/api/reader-state')
+def get_reader_state():
+    """Progress, highlights, notes and stored chapter audio (in ?format=) for one chapter, in a single response"""
+    if reader_state is None:
+        return reader_state_disabled()
+    book_id = request.args.get('book_id')
+    chapter_id = request.args.get('chapter_id')
+    voice = request.args.get('voice')
+    model = request.args.get('model')
+    fmt = read_audio_format(request.args) or DEFAULT_AUDIO_FORMAT
+    if not book_id:
+        return jsonify({'error': 'book_id is required'}), 400
+    
+    state = reader_state.chapter_state(book_id, chapter_id, voice, model)
+    state['chapter_audio'] = None
+    if chapter_id is not None and voice and model:
+        key = chapter_audio_key(book_id, chapter_id, voice, model, fmt)
+        manifest = chapter_audio_manifest(key)
+        if manifest:
+            add_audio_urls(key, manifest)
+            state['chapter_audio'] = manifest
+    return jsonify(state)
+
+@app.route('/api/reader-state/batch', methods=['POST'])
+def write_reader_state():
+    """Apply a batch of highlight/note/progress writes in one transaction"""
+    if reader_state is None:
+        return reader_state_disabled()
+    data = request.get_json(silent=True) or {}
+    ops = data.get('ops')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'error': 'ops must be a non-empty list'}), 400
+    try:
+        results = reader_state.apply(ops)
+    except ReaderStateError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'results': results})
 
 @app.route('/api/debug')
 def debug_info():
@@ -497,6 +1380,11 @@ if __name__ == '__main__':
     # Use PORT environment variable for Render, fallback to FLASK_PORT for local dev
     port = int(os.getenv('PORT', os.getenv('FLASK_PORT', '5001')))
     debug = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
+    # werkzeug's own "Running on" banner is held back with the access log (LOG_ACCESS_LEVEL)
+    logger.info("Serving on http://0.0.0.0:%d (debug=%s)", port, debug)
+    # In debug mode the reloader parent only watches files; the app runs in its child
+    if not debug or os.getenv('WERKZEUG_RUN_MAIN') == 'true':
+        start_prerender_worker()
     
     app.run(
         debug=debug,
@@ -0,0 +1,450 @@
+"""
+ASGI entry point with async handlers for the upstream-bound endpoints.
+
+The Flask views block a worker for the whole OpenAI round-trip, so
+concurrency is capped by the number of worker processes. Here the chat,
+text-selection and TTS endpoints are served by async handlers on a single
+AsyncOpenAI client (one pooled HTTP connection pool for the process), with
+a per-endpoint concurrency limit so a burst queues briefly and then gets a
+503 instead of exhausting the pool. CPU- and disk-bound steps (storing and
+indexing chapter text, building prompts, locating spans, parsing audio
+durations) run in worker threads so a large chapter doesn't stall the
+event loop. Every other route is passed through to the Flask app unchanged.
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 5001
+"""
+
+import asyncio
+import base64
+import contextlib
+import functools
+import logging
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import app as aristo
+import metrics
+from single_flight import AsyncSingleFlight
+from upstream import UpstreamUnavailable, chat_request_tokens
+
+logger = logging.getLogger('aristo.asgi')
+
+# One client for the whole process; its HTTP pool keeps upstream connections alive.
+# Retries, rate limits and circuit breaking come from aristo.upstream_policies.
+async_openai_client = AsyncOpenAI(
+    api_key=os.getenv('OPENAI_API_KEY'),
+    max_retries=0,
+    timeout=float(os.getenv('OPENAI_TIMEOUT', '30'))
+)
+
+# Identical in-flight upstream calls share one request
+upstream_flights = AsyncSingleFlight()
+
+
+class ConcurrencyLimitExceeded(Exception):
+    """Raised when a request waited too long for an upstream slot"""
+
+
+class ConcurrencyLimit:
+    """Async context manager bounding in-flight upstream calls for one endpoint"""
+
+    def __init__(self, name, limit, queue_timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __aenter__(self):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise ConcurrencyLimitExceeded(self.name)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+
+_queue_timeout = float(os.getenv('ASYNC_QUEUE_TIMEOUT', '10'))
+upstream_limits = {
+    'chat': ConcurrencyLimit('chat', int(os.getenv('ASYNC_CHAT_CONCURRENCY', '200')), _queue_timeout),
+    'selection': ConcurrencyLimit('selection', int(os.getenv('ASYNC_SELECTION_CONCURRENCY', '200')), _queue_timeout),
+    'tts': ConcurrencyLimit('tts', int(os.getenv('ASYNC_TTS_CONCURRENCY', '50')), _queue_timeout),
+}
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that closes its body iterator however the response ends (Starlette only stops iterating)"""
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+
+def busy_response(name):
+    logger.warning("Upstream concurrency limit reached for %s", name)
+    return JSONResponse(
+        {'error': 'Server busy, please retry shortly'},
+        status_code=503,
+        headers={'Retry-After': '1'}
+    )
+
+
+def upstream_unavailable_response(error):
+    logger.warning("Upstream unavailable (%s), asking client to fall back", error)
+    return JSONResponse(
+        {'error': 'Audio service temporarily unavailable', 'fallback_available': True},
+        status_code=503,
+        headers={'Retry-After': str(max(1, round(error.retry_after)))}
+    )
+
+
+def timed(route):
+    """Record request count and latency for an async handler, like metrics.instrument_flask does"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            finally:
+                metrics.observe_request(request.method, route, status, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+async def read_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def wants_cache_bypass(request, data):
+    return bool(data.get('noCache')) or 'no-cache' in request.headers.get('cache-control', '')
+
+
+async def fetch_aristo_answer(messages, cache_key):
+    model, max_tokens, temperature = aristo.chat_settings()
+    async with upstream_limits['chat']:
+        response = await aristo.upstream_policies['chat'].acall(
+            async_openai_client.chat.completions.create,
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            tokens=chat_request_tokens(messages, max_tokens)
+        )
+    answer = aristo.parse_aristo_response(response.choices[0].message.content.strip())
+    aristo.aristo_cache.put(cache_key, answer)
+    return answer
+
+
+async def fetch_selected_text(messages):
+    model, max_tokens, temperature = aristo.selection_settings()
+    async with upstream_limits['selection']:
+        response = await aristo.upstream_policies['selection'].acall(
+            async_openai_client.chat.completions.create,
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            tokens=chat_request_tokens(messages, max_tokens)
+        )
+    return response.choices[0].message.content.strip()
+
+
+async def ask_aristo(request):
+    data = await read_json(request)
+    user_input = (data.get('input') or '').strip()
+    chapter_context = data.get('chapterContext')
+    context_mode = data.get('contextMode')
+
+    if not user_input:
+        return JSONResponse({'error': 'No input provided'}, status_code=400)
+
+    resolved_context = await asyncio.to_thread(aristo.resolve_chapter_context, chapter_context)
+    if chapter_context and resolved_context is None:
+        body, status = aristo.chapter_unknown_error(chapter_context.get('contentHash'))
+        return JSONResponse(body, status_code=status)
+    chapter_context = resolved_context
+
+    try:
+        standard_prompts = aristo.prompt_store.get()
+    except aristo.PromptsNotFoundError:
+        return JSONResponse({'error': 'Prompts configuration not found'}, status_code=500)
+    except aristo.PromptConfigError:
+        return JSONResponse({'error': 'Invalid prompts configuration'}, status_code=500)
+
+    cache_key = aristo.aristo_cache_key(user_input, chapter_context, context_mode)
+    if wants_cache_bypass(request, data):
+        aristo.aristo_cache.record_bypass()
+    else:
+        cached_answer = aristo.aristo_cache.get(cache_key)
+        if cached_answer is not None:
+            return JSONResponse({'success': True, **cached_answer, 'user_input': user_input, 'cached': True})
+
+    try:
+        messages = await asyncio.to_thread(
+            aristo.build_aristo_messages, standard_prompts, user_input, chapter_context, context_mode
+        )
+    except aristo.PromptTooLargeError as e:
+        return JSONResponse({'error': str(e)}, status_code=413)
+    try:
+        answer, _ = await upstream_flights.do(('chat', cache_key), fetch_aristo_answer, messages, cache_key)
+    except ConcurrencyLimitExceeded:
+        return busy_response('chat')
+    except Exception as openai_error:
+        logger.warning("OpenAI chat failed, using fallback answer: %s", openai_error)
+        return JSONResponse({
+            'success': True,
+            'response': aristo.aristo_fallback_response(user_input),
+            'user_input': user_input,
+            'label': 'analysis',
+            'fallback': True
+        })
+
+    return JSONResponse({'success': True, **answer, 'user_input': user_input})
+
+
+async def find_relevant_text(request):
+    data = await read_json(request)
+    user_question = (data.get('userQuestion') or '').strip()
+    aristo_response = (data.get('aristoResponse') or '').strip()
+    chapter = await asyncio.to_thread(aristo.selection_chapter, data)
+    if chapter is None:
+        body, status = aristo.chapter_unknown_error(data.get('chapterHash'))
+        return JSONResponse(body, status_code=status)
+    chapter_content, chapter_hash = chapter
+
+    if data.get('mode') == 'local':
+        if not user_question or not chapter_content:
+            return JSONResponse({'error': 'Missing required data'}, status_code=400)
+        return JSONResponse(await asyncio.to_thread(
+            aristo.local_text_selection, user_question, aristo_response, chapter_content, chapter_hash
+        ))
+
+    if not all([user_question, aristo_response, chapter_content]):
+        return JSONResponse({'error': 'Missing required data'}, status_code=400)
+
+    try:
+        messages = await asyncio.to_thread(
+            aristo.build_selection_messages,
+            user_question, aristo_response, chapter_content, data.get('contextMode'), chapter_hash
+        )
+    except aristo.PromptTooLargeError as e:
+        return JSONResponse({'error': str(e)}, status_code=413)
+    flight_key = aristo.selection_flight_key(
+        user_question, aristo_response, chapter_content, data.get('contextMode'), chapter_hash
+    )
+    try:
+        selected_text, _ = await upstream_flights.do(('selection', flight_key), fetch_selected_text, messages)
+    except ConcurrencyLimitExceeded:
+        return busy_response('selection')
+    except Exception as openai_error:
+        logger.warning("OpenAI text selection failed, using local fallback: %s", openai_error)
+        return JSONResponse(await asyncio.to_thread(
+            aristo.fallback_text_selection, user_question, chapter_content, chapter_hash
+        ))
+
+    return JSONResponse(await asyncio.to_thread(aristo.resolve_selected_text, chapter_content, selected_text))
+
+
+async def synthesize_speech(text, voice, model, fmt=aristo.DEFAULT_AUDIO_FORMAT):
+    """Async counterpart of app.synthesize_speech sharing the same audio cache"""
+    cache_key = aristo.make_cache_key(text, voice, model, fmt)
+    audio_bytes = await asyncio.to_thread(aristo.audio_cache.get, cache_key)
+    if audio_bytes is not None:
+        return audio_bytes, cache_key, True, False
+
+    audio_bytes, shared = await upstream_flights.do(
+        ('tts', cache_key), fetch_speech, text, voice, model, cache_key, fmt
+    )
+    return audio_bytes, cache_key, False, shared
+
+
+async def synthesize_long_speech(text, voice, model, fmt=aristo.DEFAULT_AUDIO_FORMAT):
+    """Async counterpart of app.synthesize_long_speech; segments run concurrently under the TTS limit"""
+    segments = await asyncio.to_thread(aristo.split_text, text)
+    clips = await asyncio.gather(*(synthesize_speech(segment.text, voice, model, fmt) for segment in segments))
+    audio_bytes, durations = await asyncio.to_thread(aristo.join_audio, [clip[0] for clip in clips], fmt)
+    timings = aristo.timing_map(segments, durations)
+    for timing, (_, cache_key, _, _) in zip(timings, clips):
+        timing['cache_key'] = cache_key
+        timing['audio_url'] = aristo.audio_clip_url(cache_key)
+    return (
+        audio_bytes,
+        all(cached for _, _, cached, _ in clips),
+        any(coalesced for _, _, _, coalesced in clips),
+        timings
+    )
+
+
+async def fetch_speech(text, voice, model, cache_key, fmt=aristo.DEFAULT_AUDIO_FORMAT):
+    async with upstream_limits['tts']:
+        response = await aristo.upstream_policies['tts'].acall(
+            async_openai_client.audio.speech.create,
+            model=model,
+            voice=voice,
+            input=text,
+            response_format=fmt
+        )
+    audio_bytes = response.content
+    await asyncio.to_thread(aristo.audio_cache.put, cache_key, audio_bytes)
+    return audio_bytes
+
+
+async def generate_audio(request):
+    # Same negotiation as the Flask view: raw audio only when the client prefers it
+    accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+    if accept.best_match(['application/json', *aristo.AUDIO_MIME_TYPES.values()]) in aristo.AUDIO_MIME_TYPES.values():
+        return await stream_audio(request)
+
+    data = await read_json(request)
+    text, voice, model, fmt, error = aristo.read_audio_request(data, max_chars=aristo.AUDIO_MAX_TEXT_CHARS)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+
+    try:
+        if len(text) > aristo.TTS_MAX_CHARS:
+            audio_bytes, cached, coalesced, timings = await synthesize_long_speech(text, voice, model, fmt)
+            cache_key = None
+        else:
+            audio_bytes, cache_key, cached, coalesced = await synthesize_speech(text, voice, model, fmt)
+            timings = None
+            duration = await asyncio.to_thread(aristo.audio_duration, audio_bytes, fmt)
+    except ConcurrencyLimitExceeded:
+        return busy_response('tts')
+    except UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    except Exception as e:
+        logger.warning("Error generating audio: %s", e)
+        return JSONResponse({
+            'error': f'Failed to generate audio: {str(e)}',
+            'fallback_available': True
+        }, status_code=500)
+
+    return JSONResponse({
+        'success': True,
+        'audio_data': base64.b64encode(audio_bytes).decode('utf-8'),
+        'format': fmt,
+        'text_length': len(text),
+        'voice': voice,
+        'model': model,
+        'cache_key': cache_key,
+        'cached': cached,
+        'coalesced': coalesced,
+        'audio_url': aristo.audio_clip_url(cache_key) if cache_key else None,
+        'duration': sum(t['duration'] for t in timings) if timings else duration,
+        'segments': timings
+    })
+
+
+async def stream_audio(request):
+    data = dict(request.query_params) if request.method == 'GET' else await read_json(request)
+    text, voice, model, fmt, error = aristo.read_audio_request(data)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+
+    media_type = aristo.AUDIO_MIME_TYPES[fmt]
+    cache_key = aristo.make_cache_key(text, voice, model, fmt)
+    headers = {'X-Audio-Cache-Key': cache_key, 'Cache-Control': 'no-store'}
+
+    audio_bytes = await asyncio.to_thread(aristo.audio_cache.get, cache_key)
+    if audio_bytes is not None:
+        headers['X-Audio-Cache'] = 'HIT'
+        return Response(audio_bytes, media_type=media_type, headers=headers)
+
+    chunk_size = int(os.getenv('AUDIO_STREAM_CHUNK_SIZE', '16384'))
+
+    async def chunks():
+        received = []
+        async with upstream_limits['tts'], aristo.upstream_policies['tts'].aguard():
+            async with async_openai_client.audio.speech.with_streaming_response.create(
+                model=model,
+                voice=voice,
+                input=text,
+                response_format=fmt
+            ) as response:
+                async for chunk in response.iter_bytes(chunk_size):
+                    received.append(chunk)
+                    yield chunk
+        audio_bytes = b''.join(received)
+        metrics.upstream_bytes.inc(len(audio_bytes), upstream='tts')
+        await asyncio.to_thread(aristo.audio_cache.put, cache_key, audio_bytes)
+
+    # Pull the first chunk eagerly so upstream failures still produce a JSON error
+    stream = chunks()
+    try:
+        first_chunk = await stream.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b''
+    except ConcurrencyLimitExceeded:
+        return busy_response('tts')
+    except UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    except Exception as e:
+        logger.warning("Error streaming audio: %s", e)
+        return JSONResponse({
+            'error': f'Failed to generate audio: {str(e)}',
+            'fallback_available': True
+        }, status_code=500)
+
+    async def body():
+        try:
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            # On a client hang-up this exits the upstream response, the TTS slot and
+            # the breaker guard now rather than whenever the generator is collected
+            await stream.aclose()
+
+    headers['X-Audio-Cache'] = 'MISS'
+    return ClosingStreamingResponse(body(), media_type=media_type, headers=headers)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    aristo.start_prerender_worker()
+    yield
+    aristo.prerender_worker.stop(timeout=5)
+    await async_openai_client.close()
+
+
+application = Starlette(
+    routes=[
+        Route('/api/aristo', timed('/api/aristo')(ask_aristo), methods=['POST']),
+        Route('/api/find-relevant-text', timed('/api/find-relevant-text')(find_relevant_text), methods=['POST']),
+        Route('/api/generate-audio', timed('/api/generate-audio')(generate_audio), methods=['POST']),
+        Route('/api/generate-audio/stream', timed('/api/generate-audio/stream')(stream_audio), methods=['GET', 'POST']),
+        # Everything else (pages, book data, batch audio, SSE chat) is served by Flask
+        Mount('/', app=WSGIMiddleware(aristo.app)),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(
+        application,
+        host='0.0.0.0',
+        port=int(os.getenv('PORT', os.getenv('FLASK_PORT', '5001')))
+    )
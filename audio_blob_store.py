@@ -0,0 +1,255 @@
+"""
+Raw-bytes storage for chapter audio.
+
+Each chapter is stored as two files: a ``.bin`` blob holding every
+segment's audio back to back, and a ``.json`` manifest listing each
+segment's byte offset, length, duration and text hash. Nothing is base64
+encoded, so a stored chapter is the same size as the audio itself, and any
+segment (or byte range) is served by seeking into the blob.
+
+Opus chapters are stored as one logical Ogg stream (see
+audio_formats.join_ogg_opus) so the whole blob plays in every browser; a
+single segment is served as the stream's header pages plus that segment's
+pages, rebased to start at zero.
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import time
+
+from audio_formats import audio_duration, join_ogg_opus, ogg_opus_clip, ogg_opus_pre_skip
+
+_KEY_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,199}$')
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def chapter_audio_key(book_id, chapter_id, voice, model, fmt='mp3'):
+    """Storage key the server keeps a chapter's audio under (not the client's Supabase cache key)"""
+    raw = f"audio-{book_id}-ch{chapter_id}-{voice}-{model}" + ('' if fmt == 'mp3' else f"-{fmt}")
+    return re.sub(r'-+', '-', re.sub(r'[^A-Za-z0-9._-]', '-', raw)).lower()
+
+
+def is_valid_key(key):
+    return bool(_KEY_RE.match(key or ''))
+
+
+def manifest_etag(manifest):
+    """Validator for a stored chapter; changes whenever the chapter is rewritten"""
+    parts = (manifest['key'], manifest['created_at'], manifest['total_bytes'], manifest.get('text_hash'))
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()[:32]
+
+
+class BlobSlice(io.RawIOBase):
+    """Read-only, seekable view of length bytes at offset of an open blob file"""
+
+    def __init__(self, f, offset, length):
+        self._file = f
+        self._offset = offset
+        self._length = length
+        self._pos = 0
+        f.seek(offset)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._length
+        self._pos = max(0, min(pos, self._length))
+        self._file.seek(self._offset + self._pos)
+        return self._pos
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._length - self._pos)
+        if size <= 0:
+            return 0
+        read = self._file.readinto(memoryview(buffer)[:size])
+        self._pos += read
+        return read
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class AudioBlobStore:
+    """Directory of chapter blobs plus JSON manifests"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _base(self, key):
+        if not is_valid_key(key):
+            raise ValueError(f"Invalid audio key: {key!r}")
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], key)
+
+    def blob_path(self, key):
+        return self._base(key) + '.bin'
+
+    def manifest_path(self, key):
+        return self._base(key) + '.json'
+
+    def put_chapter(self, key, segments, voice=None, model=None, fmt='mp3', chapter_text_hash=None):
+        """
+        Store a chapter. segments is a list of (audio_bytes, text) pairs in
+        playback order; audio_bytes may be None for a segment that failed.
+        Returns the manifest.
+        """
+        if fmt == 'opus' and any(audio for audio, _ in segments):
+            # Chained Ogg links stop playing after the first in several browsers
+            blob, entries = self._join_opus(segments)
+        else:
+            blob = None
+            entries = []
+            offset = 0
+            start_time = 0.0
+            for index, (audio_bytes, text) in enumerate(segments):
+                audio_bytes = audio_bytes or b''
+                duration = audio_duration(audio_bytes, fmt) if audio_bytes else 0.0
+                entries.append({
+                    'index': index,
+                    'offset': offset,
+                    'length': len(audio_bytes),
+                    'duration': duration,
+                    'start_time': start_time,
+                    'text_hash': text_hash(text) if text is not None else None,
+                })
+                offset += len(audio_bytes)
+                start_time += duration or 0.0
+
+        manifest = {
+            'key': key,
+            'format': fmt,
+            'voice': voice,
+            'model': model,
+            'text_hash': chapter_text_hash,
+            'total_bytes': len(blob) if blob is not None else sum(entry['length'] for entry in entries),
+            'total_duration': sum(entry['duration'] or 0.0 for entry in entries),
+            'segments': entries,
+            'created_at': time.time(),
+        }
+        if blob is not None:
+            # Bytes of OpusHead/OpusTags pages at the start, prepended to single segments
+            manifest['header_bytes'] = entries[0]['offset']
+
+        base = self._base(key)
+        directory = os.path.dirname(base)
+        os.makedirs(directory, exist_ok=True)
+        # Blob first, manifest last: a manifest on disk always describes a complete blob
+        if blob is not None:
+            self._atomic_write(base + '.bin', lambda f: f.write(blob))
+        else:
+            self._atomic_write(base + '.bin', lambda f: [f.write(audio or b'') for audio, _ in segments])
+        self._atomic_write(base + '.json', lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+        return manifest
+
+    def _join_opus(self, segments):
+        """One logical Ogg Opus stream of the segments, and their manifest entries"""
+        blob, spans = join_ogg_opus([audio or b'' for audio, _ in segments])
+        pre_skip = ogg_opus_pre_skip(blob)
+        entries = []
+        for index, ((offset, length, start, end), (_, text)) in enumerate(zip(spans, segments)):
+            start_time = max(start - pre_skip, 0) / 48000
+            entries.append({
+                'index': index,
+                'offset': offset,
+                'length': length,
+                'duration': max(end - pre_skip, 0) / 48000 - start_time,
+                'start_time': start_time,
+                'granule_start': start,
+                'text_hash': text_hash(text) if text is not None else None,
+            })
+        return blob, entries
+
+    def _atomic_write(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def get_manifest(self, key):
+        """Return the manifest dict for key, or None"""
+        try:
+            with open(self.manifest_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def read_range(self, key, start, length):
+        """Read length bytes at offset start of a chapter blob"""
+        with open(self.blob_path(key), 'rb') as f:
+            f.seek(start)
+            return f.read(length)
+
+    def read_segment(self, key, index, manifest=None):
+        """Return the raw audio bytes of one segment, or None if missing"""
+        manifest = manifest or self.get_manifest(key)
+        if not manifest or not 0 <= index < len(manifest['segments']):
+            return None
+        segment = manifest['segments'][index]
+        if 'header_bytes' in manifest:
+            return self._opus_segment(key, manifest, segment)
+        return self.read_range(key, segment['offset'], segment['length'])
+
+    def _opus_segment(self, key, manifest, segment):
+        """A segment of a joined Ogg Opus blob as a standalone file"""
+        header_bytes = manifest['header_bytes']
+        with open(self.blob_path(key), 'rb') as f:
+            header = f.read(header_bytes)
+            f.seek(segment['offset'])
+            pages = f.read(segment['length'])
+        return ogg_opus_clip(header + pages, header_bytes, header_bytes, len(pages), segment['granule_start'])
+
+    def open_blob(self, key):
+        """Open a chapter blob for streaming; returns (file, size)"""
+        f = open(self.blob_path(key), 'rb')
+        return f, os.fstat(f.fileno()).st_size
+
+    def open_segment(self, key, index, manifest=None):
+        """Open one segment of a chapter blob as a seekable file; returns (file, size) or None"""
+        manifest = manifest or self.get_manifest(key)
+        if not manifest or not 0 <= index < len(manifest['segments']):
+            return None
+        segment = manifest['segments'][index]
+        if 'header_bytes' in manifest:
+            data = self._opus_segment(key, manifest, segment)
+            return io.BytesIO(data), len(data)
+        return BlobSlice(open(self.blob_path(key), 'rb'), segment['offset'], segment['length']), segment['length']
+
+    def delete(self, key):
+        for path in (self.manifest_path(key), self.blob_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def create_default_store():
+    return AudioBlobStore(os.getenv(
+        'AUDIO_BLOB_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio_blobs'),
+    ))
@@ -0,0 +1,333 @@
+"""
+Minimal audio container parsing for duration measurement.
+
+Only frame headers are read; nothing is decoded. This lets the server
+report segment durations (for highlight sync and seek tables) without
+shipping audio to the browser just to learn how long it is.
+
+MP3 and ADTS AAC clips can be concatenated as-is, since both are plain
+sequences of self-contained frames. Ogg Opus clips placed back to back form
+a chained Ogg stream, which several browsers stop playing after the first
+link, so join_ogg_opus remuxes them into one logical stream instead (no
+re-encoding: pages are renumbered and granule positions recomputed from
+packet durations). That is what lets a chapter's segments be stored and
+served as a single file.
+"""
+
+import struct
+import zlib
+
+# TTS response formats the server accepts, with the MIME type each is served as
+AUDIO_MIME_TYPES = {
+    'mp3': 'audio/mpeg',
+    'opus': 'audio/ogg',
+    'aac': 'audio/aac',
+}
+
+# Bitrates in kbps indexed by [version_key][layer][bitrate_index]
+_MP3_BITRATES = {
+    'v1': {
+        1: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    'v2': {
+        1: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        3: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),   # MPEG-2.5
+}
+
+
+def _skip_id3v2(data):
+    if len(data) >= 10 and data[:3] == b'ID3':
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def mp3_duration(data):
+    """Duration in seconds of an MP3 byte string, from its frame headers"""
+    pos = _skip_id3v2(data)
+    end = len(data)
+    seconds = 0.0
+    while pos + 4 <= end:
+        b1, b2 = data[pos + 1], data[pos + 2]
+        if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+            pos += 1
+            continue
+        version = (b1 >> 3) & 0x03
+        layer_bits = (b1 >> 1) & 0x03
+        bitrate_index = b2 >> 4
+        rate_index = (b2 >> 2) & 0x03
+        if version == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+            pos += 1
+            continue
+
+        layer = 4 - layer_bits
+        bitrate = _MP3_BITRATES['v1' if version == 3 else 'v2'][layer][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        padding = (b2 >> 1) & 0x01
+
+        if layer == 1:
+            samples = 384
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        elif layer == 2 or version == 3:
+            samples = 1152
+            frame_length = 144 * bitrate // sample_rate + padding
+        else:
+            samples = 576
+            frame_length = 72 * bitrate // sample_rate + padding
+
+        if frame_length <= 0:
+            pos += 1
+            continue
+        seconds += samples / sample_rate
+        pos += frame_length
+    return seconds
+
+
+_AAC_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+
+
+def adts_duration(data):
+    """Duration in seconds of an ADTS (raw AAC) byte string, from its frame headers"""
+    pos = _skip_id3v2(data)
+    end = len(data)
+    seconds = 0.0
+    while pos + 7 <= end:
+        # 12-bit sync word and layer bits 00
+        if data[pos] != 0xFF or (data[pos + 1] & 0xF6) != 0xF0:
+            pos += 1
+            continue
+        rate_index = (data[pos + 2] >> 2) & 0x0F
+        frame_length = (data[pos + 3] & 0x03) << 11 | data[pos + 4] << 3 | data[pos + 5] >> 5
+        if rate_index >= len(_AAC_SAMPLE_RATES) or frame_length < 7:
+            pos += 1
+            continue
+        blocks = (data[pos + 6] & 0x03) + 1
+        seconds += blocks * 1024 / _AAC_SAMPLE_RATES[rate_index]
+        pos += frame_length
+    return seconds
+
+
+_OGG_PAGE = struct.Struct('<4sBBqIIIB')
+_OGG_CONTINUED, _OGG_BOS, _OGG_EOS = 0x01, 0x02, 0x04
+_BIT_REVERSED = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def ogg_crc(data):
+    """Ogg page checksum: CRC-32 with polynomial 0x04c11db7, unreflected, no pre/post inversion"""
+    # zlib.crc32 is the reflected CRC of the same polynomial; reflecting the
+    # input bytes and the result gives Ogg's variant at C speed
+    crc = zlib.crc32(data.translate(_BIT_REVERSED), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int(f"{crc:032b}"[::-1], 2)
+
+
+def _ogg_pages(data):
+    """Yield (header_type, granule, serial, lacing, body) per page, skipping anything that isn't one"""
+    pos = 0
+    end = len(data)
+    while pos + _OGG_PAGE.size <= end:
+        if data[pos:pos + 4] != b'OggS':
+            pos = data.find(b'OggS', pos + 1)
+            if pos < 0:
+                return
+            continue
+        _, _, header_type, granule, serial, _, _, count = _OGG_PAGE.unpack_from(data, pos)
+        body = pos + _OGG_PAGE.size + count
+        if body > end:
+            return
+        lacing = data[pos + _OGG_PAGE.size:body]
+        yield header_type, granule, serial, lacing, data[body:body + sum(lacing)]
+        pos = body + sum(lacing)
+
+
+def _ogg_page(header_type, granule, serial, sequence, lacing, body):
+    page = bytearray(_OGG_PAGE.pack(b'OggS', 0, header_type, granule, serial, sequence, 0, len(lacing)))
+    page += lacing
+    page += body
+    struct.pack_into('<I', page, 22, ogg_crc(bytes(page)))
+    return bytes(page)
+
+
+def ogg_opus_duration(data):
+    """Duration in seconds of an Ogg Opus byte string, summed over chained streams"""
+    links = []  # [serial, pre-skip, last granule position] per logical stream, in order
+    for header_type, granule, serial, _, body in _ogg_pages(data):
+        if header_type & _OGG_BOS:
+            # Beginning of a stream; the first packet is OpusHead with pre-skip at byte 10
+            pre_skip = 0
+            if body[:8] == b'OpusHead' and len(body) >= 12:
+                pre_skip = struct.unpack_from('<H', body, 10)[0]
+            links.append([serial, pre_skip, 0])
+        elif granule >= 0:
+            for link in reversed(links):
+                if link[0] == serial:
+                    link[2] = granule
+                    break
+    # Opus granule positions always count 48 kHz samples
+    return sum(max(granule - pre_skip, 0) for _, pre_skip, granule in links) / 48000
+
+
+def ogg_opus_pre_skip(data):
+    """Pre-skip (48 kHz samples to discard at the start) from the first OpusHead in data"""
+    for _, _, _, _, body in _ogg_pages(data):
+        if body[:8] == b'OpusHead' and len(body) >= 12:
+            return struct.unpack_from('<H', body, 10)[0]
+        break
+    return 0
+
+
+def _opus_packet_samples(packet):
+    """48 kHz samples in an Opus packet, from its TOC byte (RFC 6716 section 3.1)"""
+    if not packet:
+        return 0
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame = (480, 960, 1920, 2880)[config & 3]  # SILK: 10, 20, 40, 60 ms
+    elif config < 16:
+        frame = (480, 960)[config & 1]  # hybrid: 10, 20 ms
+    else:
+        frame = (120, 240, 480, 960)[config & 3]  # CELT: 2.5, 5, 10, 20 ms
+    code = toc & 0x03
+    if code == 0:
+        return frame
+    if code < 3:
+        return frame * 2
+    return frame * (packet[1] & 0x3F) if len(packet) > 1 else 0
+
+
+def join_ogg_opus(clips):
+    """
+    Join standalone Ogg Opus clips into one logical stream.
+
+    The first clip's OpusHead/OpusTags pages open the stream. The audio
+    pages of every clip follow under its serial number, renumbered, with
+    granule positions recomputed from packet durations so each clip carries
+    on where the previous one ended. Returns (data, spans) with one span per
+    clip: (offset, length, start_granule, end_granule), the byte range of
+    its audio pages in data and the granule positions (48 kHz samples from
+    the start of the stream) it covers.
+    """
+    headers = []  # (header type, lacing, body)
+    pages = []    # [clip index, header type, granule, lacing, body]
+    bounds = []   # [start granule, end granule] per clip
+    serial = None
+    granule = 0
+    final_granule = None  # the last clip's own end, which may trim padding
+    for index, clip in enumerate(clips):
+        bounds.append([granule, granule])
+        keep_headers = serial is None
+        headers_left = 2  # OpusHead, OpusTags
+        continued = False
+        packet_head = b''
+        clip_granule = None
+        for header_type, page_granule, page_serial, lacing, body in _ogg_pages(clip):
+            if headers_left > 0:
+                if keep_headers:
+                    serial = page_serial
+                    headers.append((header_type & ~_OGG_EOS, lacing, body))
+                headers_left -= sum(1 for value in lacing if value < 255)
+                continue
+            completed = False
+            pos = 0
+            for value in lacing:
+                if not continued:
+                    packet_head = body[pos:pos + 2]
+                pos += value
+                continued = value == 255
+                if not continued:
+                    granule += _opus_packet_samples(packet_head)
+                    completed = True
+            if page_granule >= 0:
+                clip_granule = page_granule
+            pages.append([index, header_type & ~(_OGG_BOS | _OGG_EOS), granule if completed else -1, lacing, body])
+        bounds[-1][1] = granule
+        if clip_granule is not None:
+            final_granule = (index, bounds[-1][0] + clip_granule)
+
+    # End trimming is only allowed on the final page, so only the last clip keeps its own
+    if pages and final_granule and final_granule[0] == pages[-1][0]:
+        index, end_granule = final_granule
+        for page in reversed(pages):
+            if page[2] >= 0:
+                page[2] = min(page[2], end_granule)
+                bounds[index][1] = page[2]
+                break
+
+    out = bytearray()
+    sequence = 0
+    for header_type, lacing, body in headers:
+        out += _ogg_page(header_type, 0, serial, sequence, lacing, body)
+        sequence += 1
+    spans = []
+    page_index = 0
+    for index, (start_granule, end_granule) in enumerate(bounds):
+        offset = len(out)
+        while page_index < len(pages) and pages[page_index][0] == index:
+            _, header_type, page_granule, lacing, body = pages[page_index]
+            if page_index == len(pages) - 1:
+                header_type |= _OGG_EOS
+            out += _ogg_page(header_type, page_granule, serial, sequence, lacing, body)
+            sequence += 1
+            page_index += 1
+        spans.append((offset, len(out) - offset, start_granule, end_granule))
+    return bytes(out), spans
+
+
+def ogg_opus_clip(data, header_length, offset, length, start_granule):
+    """
+    Standalone Ogg Opus file for one span of a join_ogg_opus() stream: the
+    stream's header pages followed by the span's pages, renumbered and with
+    granule positions rebased to start at zero
+    """
+    out = bytearray(data[:header_length])
+    sequence = sum(1 for _ in _ogg_pages(out))
+    pages = list(_ogg_pages(data[offset:offset + length]))
+    for position, (header_type, granule, serial, lacing, body) in enumerate(pages):
+        if position == len(pages) - 1:
+            header_type |= _OGG_EOS
+        out += _ogg_page(header_type, granule - start_granule if granule >= 0 else -1, serial, sequence, lacing, body)
+        sequence += 1
+    return bytes(out)
+
+
+def join_audio(clips, fmt='mp3'):
+    """One playable file from clips of one format; returns (data, duration of each clip in it)"""
+    if fmt != 'opus':
+        return b''.join(clips), [audio_duration(clip, fmt) for clip in clips]
+    data, spans = join_ogg_opus(clips)
+    pre_skip = ogg_opus_pre_skip(data)
+    return data, [
+        (max(end - pre_skip, 0) - max(start - pre_skip, 0)) / 48000 for _, _, start, end in spans
+    ]
+
+
+def sniff_format(data):
+    """Format of an audio byte string ('mp3', 'opus' or 'aac') from its first bytes"""
+    pos = _skip_id3v2(data)
+    head = data[pos:pos + 4]
+    if head[:4] == b'OggS':
+        return 'opus'
+    if len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xF6) == 0xF0:
+        return 'aac'
+    return 'mp3'
+
+
+def audio_duration(data, fmt='mp3'):
+    """Duration in seconds for a supported format, or None if it can't be measured"""
+    if fmt == 'mp3':
+        return mp3_duration(data)
+    if fmt == 'aac':
+        return adts_duration(data)
+    if fmt == 'opus':
+        return ogg_opus_duration(data)
+    return None
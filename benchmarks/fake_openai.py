@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Stub OpenAI-compatible server for benchmarking Aristo without a real API key.
+
+Implements the two endpoints the app calls, with configurable latency and
+payload sizes:
+
+    POST /v1/chat/completions   (plain and stream=true)
+    POST /v1/audio/speech       (returns valid MPEG audio frames)
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Usage:
+    python benchmarks/fake_openai.py --port 8099 --chat-latency 0.8 --tts-latency 1.5
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# One MPEG-1 Layer III frame header (128 kbps, 44.1 kHz): 417-byte frames, 26 ms each
+_MP3_FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+
+
+class FakeOpenAIConfig:
+    def __init__(self, chat_latency=0.5, tts_latency=1.0, jitter=0.2, answer_words=80,
+                 audio_seconds_per_char=0.06, error_rate=0.0):
+        self.chat_latency = chat_latency
+        self.tts_latency = tts_latency
+        self.jitter = jitter
+        self.answer_words = answer_words
+        self.audio_seconds_per_char = audio_seconds_per_char
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def delay(self, base):
+        """Sleep for base seconds +/- jitter (as a fraction of base)"""
+        time.sleep(max(0.0, base * random.uniform(1 - self.jitter, 1 + self.jitter)))
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass  # keep benchmark output readable
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def _send(self, status, body, content_type='application/json', headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            config.count()
+            payload = self._read_json()
+            if config.error_rate and random.random() < config.error_rate:
+                body = json.dumps({'error': {'message': 'simulated overload', 'type': 'server_error'}})
+                return self._send(503, body.encode('utf-8'), headers={'Retry-After': '1'})
+            if self.path.endswith('/chat/completions'):
+                return self._chat(payload)
+            if self.path.endswith('/audio/speech'):
+                return self._speech(payload)
+            self._send(404, b'{"error": {"message": "not found"}}')
+
+        def _answer(self, payload):
+            words = ' '.join(random.choice(('the', 'reader', 'chapter', 'meaning', 'journey', 'words'))
+                             for _ in range(config.answer_words))
+            if 'most relevant' in json.dumps(payload.get('messages', [])).lower():
+                # Text-selection prompt: quote the start of the chapter back
+                for message in payload.get('messages', []):
+                    if 'CHAPTER CONTENT' in message.get('content', ''):
+                        chapter = message['content'].split('CHAPTER CONTENT', 1)[1]
+                        return chapter.strip(':\n ').split('.')[0] + '.'
+            return json.dumps([words.capitalize() + '.', 'analysis'])
+
+        def _chat(self, payload):
+            answer = self._answer(payload)
+            prompt_tokens = sum(len(m.get('content', '')) for m in payload.get('messages', [])) // 4
+            completion_tokens = len(answer) // 4
+            if payload.get('stream'):
+                return self._chat_stream(answer)
+            config.delay(config.chat_latency)
+            body = json.dumps({
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': payload.get('model', 'gpt-3.5-turbo'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': answer},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens
+                }
+            })
+            self._send(200, body.encode('utf-8'))
+
+        def _chat_stream(self, answer):
+            # Time to first token is 20% of the latency; the rest is spread over the tokens
+            pieces = answer.split(' ')
+            config.delay(config.chat_latency * 0.2)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            per_piece = config.chat_latency * 0.8 / max(len(pieces), 1)
+            for index, piece in enumerate(pieces):
+                chunk = {
+                    'id': 'chatcmpl-fake',
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': 'fake',
+                    'choices': [{'index': 0, 'delta': {'content': piece + (' ' if index < len(pieces) - 1 else '')},
+                                 'finish_reason': None}]
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                time.sleep(per_piece)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b'')
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+        def _speech(self, payload):
+            config.delay(config.tts_latency)
+            seconds = len(payload.get('input', '')) * config.audio_seconds_per_char
+            frames = max(1, int(seconds / 0.026))
+            self._send(200, _MP3_FRAME * frames, content_type='audio/mpeg')
+
+    return Handler
+
+
+def start_server(config, host='127.0.0.1', port=0):
+    """Start the stub in a background thread; returns the server (server.server_port is the port)"""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-openai', daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument('--chat-latency', type=float, default=0.5, help='Seconds per chat completion')
+    parser.add_argument('--tts-latency', type=float, default=1.0, help='Seconds per speech request')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Latency jitter as a fraction (0.2 = +/-20%%)')
+    parser.add_argument('--answer-words', type=int, default=80, help='Words in each chat answer')
+    parser.add_argument('--audio-seconds-per-char', type=float, default=0.06,
+                        help='Audio length generated per input character (sets response size)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 503')
+
+
+def config_from_args(args):
+    return FakeOpenAIConfig(
+        chat_latency=args.chat_latency,
+        tts_latency=args.tts_latency,
+        jitter=args.jitter,
+        answer_words=args.answer_words,
+        audio_seconds_per_char=args.audio_seconds_per_char,
+        error_rate=args.error_rate
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub OpenAI API for load testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config_from_args(args)))
+    print(f"Fake OpenAI listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
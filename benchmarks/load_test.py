@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Load driver for the Aristo API.
+
+Sends requests to /api/aristo, /api/find-relevant-text and/or
+/api/generate-audio at a fixed concurrency and reports latency
+percentiles, throughput, errors and server memory.
+
+By default it starts everything itself: the stub OpenAI server
+(fake_openai.py) and the app under the chosen server, pointed at the stub,
+so runs are repeatable and cost nothing:
+
+    python benchmarks/load_test.py --server gunicorn --concurrency 32 --duration 30
+    python benchmarks/load_test.py --server uvicorn --endpoints aristo --chat-latency 1.5
+
+To measure an already running deployment instead (memory is then only
+reported if you pass --pid):
+
+    python benchmarks/load_test.py --url http://localhost:5001 --endpoints audio
+"""
+
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_openai  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = (
+    'What is the main theme of this chapter?',
+    'Why does the author compare reading to a conversation?',
+    'What does the dawn imagery suggest?',
+    'How should I approach the journey described here?',
+    'What is meant by deep reading?',
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def rss_kb(pid):
+    """Resident and peak resident memory (kB) of pid and its children, from /proc (Linux only)"""
+    def read(p):
+        values = {}
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith(('VmRSS:', 'VmHWM:')):
+                        key, value = line.split(':', 1)
+                        values[key] = int(value.split()[0])
+        except OSError:
+            pass
+        return values
+
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    totals = {'VmRSS': 0, 'VmHWM': 0}
+    for p in pids:
+        for key, value in read(p).items():
+            totals[key] += value
+    return totals if totals['VmRSS'] else None
+
+
+class Workload:
+    """Builds request payloads; repeat_ratio of requests reuse a fixed payload (cache hits)"""
+
+    def __init__(self, chapters, endpoints, repeat_ratio):
+        self.chapters = chapters
+        self.endpoints = endpoints
+        self.repeat_ratio = repeat_ratio
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _unique(self):
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def next_request(self):
+        endpoint = random.choice(self.endpoints)
+        chapter = random.choice(self.chapters)
+        repeat = random.random() < self.repeat_ratio
+        n = 0 if repeat else self._unique()
+        question = random.choice(QUESTIONS) if not repeat else QUESTIONS[0]
+        if n:
+            question = f"{question} ({n})"
+
+        if endpoint == 'aristo':
+            return '/api/aristo', {
+                'input': question,
+                'chapterContext': {
+                    'title': chapter['title'],
+                    'chapterNumber': chapter['id'],
+                    'content': chapter['content']
+                }
+            }
+        if endpoint == 'find':
+            return '/api/find-relevant-text', {
+                'userQuestion': question,
+                'aristoResponse': 'The chapter describes reading as a conversation across time.',
+                'chapterContent': chapter['content']
+            }
+        # Audio: a paragraph of the chapter, made unique with a suffix unless repeating
+        paragraphs = [p for p in chapter['content'].split('\n\n') if p.strip()]
+        text = paragraphs[0] if repeat else random.choice(paragraphs)
+        if n:
+            text = f"{text} ({n})"
+        return '/api/generate-audio', {'text': text[:4000]}
+
+
+def run_load(base_url, workload, concurrency, duration, max_requests, timeout):
+    """Drive the workload; returns per-endpoint lists of (latency, status, bytes)"""
+    results = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    issued = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if time.monotonic() >= deadline or (max_requests and issued[0] >= max_requests):
+                    return
+                issued[0] += 1
+            path, payload = workload.next_request()
+            body = json.dumps(payload).encode('utf-8')
+            req = urllib.request.Request(
+                base_url + path, data=body, headers={'Content-Type': 'application/json'}
+            )
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=timeout) as response:
+                    size = len(response.read())
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                size = len(e.read() or b'')
+                status = e.code
+            except Exception:
+                size, status = 0, 'error'
+            elapsed = time.perf_counter() - started
+            with lock:
+                results.setdefault(path, []).append((elapsed, status, size))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+
+def report(results, wall_time, memory_before, memory_after):
+    print()
+    header = f"{'endpoint':<28}{'reqs':>7}{'ok':>7}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'avg KB':>8}"
+    print(header)
+    print('-' * len(header))
+    total = ok_total = 0
+    for path, samples in sorted(results.items()):
+        latencies = sorted(sample[0] for sample in samples)
+        ok = sum(1 for sample in samples if sample[1] == 200)
+        total += len(samples)
+        ok_total += ok
+        avg_kb = sum(sample[2] for sample in samples) / len(samples) / 1024
+        print(f"{path:<28}{len(samples):>7}{ok:>7}{len(samples) / wall_time:>8.1f}"
+              f"{percentile(latencies, 0.50) * 1000:>9.0f}{percentile(latencies, 0.95) * 1000:>9.0f}"
+              f"{percentile(latencies, 0.99) * 1000:>9.0f}{latencies[-1] * 1000:>9.0f}{avg_kb:>8.1f}")
+        statuses = {}
+        for sample in samples:
+            statuses[sample[1]] = statuses.get(sample[1], 0) + 1
+        if ok != len(samples):
+            print(f"{'':<28}statuses: {statuses}")
+    print('-' * len(header))
+    print(f"total: {total} requests in {wall_time:.1f}s = {total / wall_time:.1f} req/s, {ok_total} ok")
+    if memory_after:
+        before = f"{memory_before['VmRSS'] / 1024:.1f} MB -> " if memory_before else ''
+        print(f"server memory: RSS {before}{memory_after['VmRSS'] / 1024:.1f} MB, "
+              f"peak {memory_after['VmHWM'] / 1024:.1f} MB (all processes)")
+
+
+def start_app(server, port, workers, threads, fake_url, env_overrides):
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': env.get('OPENAI_API_KEY') or 'benchmark',
+        'OPENAI_BASE_URL': fake_url,
+        'PRERENDER_WORKER': 'false',
+        'FLASK_DEBUG': 'false',
+        'LOG_LEVEL': env.get('LOG_LEVEL', 'WARNING'),
+    })
+    env.update(env_overrides)
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-b', f'127.0.0.1:{port}', '-w', str(workers),
+                   '--threads', str(threads), '--timeout', '120', 'app:app']
+    elif server == 'uvicorn':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+                   '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+    else:
+        env['PORT'] = str(port)
+        command = [sys.executable, 'app.py']
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, start_new_session=True)
+
+    # Wait until the app answers
+    for _ in range(200):
+        if process.poll() is not None:
+            raise SystemExit(f"App server exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/book/toc', timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit('App server did not start')
+
+
+def stop_app(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Aristo API')
+    parser.add_argument('--url', help='Benchmark a running server instead of starting one')
+    parser.add_argument('--pid', type=int, help='With --url, server process to sample memory from')
+    parser.add_argument('--server', choices=('flask', 'gunicorn', 'uvicorn'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help='Server worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+    parser.add_argument('--endpoints', default='aristo,find,audio',
+                        help='Comma-separated subset of aristo, find, audio')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='Seconds to run')
+    parser.add_argument('--requests', type=int, default=0, help='Stop after this many requests (0 = no limit)')
+    parser.add_argument('--repeat-ratio', type=float, default=0.0,
+                        help='Fraction of requests repeating an earlier payload (exercises caches)')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Extra environment for the started app (repeatable)')
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - {'aristo', 'find', 'audio'}
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    fake = process = None
+    pid = args.pid
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        fake_config = fake_openai.config_from_args(args)
+        fake = fake_openai.start_server(fake_config)
+        fake_url = f'http://127.0.0.1:{fake.server_port}/v1'
+        port = free_port()
+        env_overrides = dict(item.split('=', 1) for item in args.env)
+        print(f"Starting {args.server} on port {port} against fake OpenAI at {fake_url}")
+        process = start_app(args.server, port, args.workers, args.threads, fake_url, env_overrides)
+        base_url = f'http://127.0.0.1:{port}'
+        pid = process.pid
+
+    try:
+        with urllib.request.urlopen(base_url + '/api/book', timeout=10) as response:
+            chapters = json.loads(response.read())['chapters']
+        memory_before = rss_kb(pid) if pid else None
+        print(f"Running {', '.join(endpoints)} at concurrency {args.concurrency} for {args.duration:.0f}s...")
+        results, wall_time = run_load(
+            base_url, Workload(chapters, endpoints, args.repeat_ratio),
+            args.concurrency, args.duration, args.requests, args.timeout
+        )
+        memory_after = rss_kb(pid) if pid else None
+        report(results, wall_time, memory_before, memory_after)
+        if fake is not None:
+            print(f"upstream calls served by fake OpenAI: {fake_config.requests}")
+    finally:
+        if process is not None:
+            stop_app(process)
+        if fake is not None:
+            fake.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Book-wide passage search.
+
+Every chapter of a book is cut into passages of a few sentences. Each
+passage becomes one row of a dense float32 matrix of hashed term features:
+stemmed words and adjacent word pairs (see retrieval.tokenize) are hashed
+into a fixed number of buckets, with a hash-derived sign so collisions tend
+to cancel, weighted by log term frequency and bucket IDF, and L2-normalized.
+A query is hashed the same way, so ranking every passage in the book is one
+matrix-vector product followed by a partial sort for the top k. Nothing
+leaves the machine.
+
+Indexes are written once per book version (keyed by the book's etag) as
+.npy files and loaded with mmap_mode='r', so the matrix sits in the page
+cache shared between workers rather than in each worker's heap.
+"""
+
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+from corpus import is_valid_book_id
+from retrieval import split_sentences, tokenize
+from single_flight import SingleFlight
+
+# Bumped when the features change (e.g. the stemmer), so saved indexes are rebuilt
+INDEX_VERSION = 1
+DEFAULT_DIMENSIONS = 2048
+# Passages grow sentence by sentence until they reach this many characters
+PASSAGE_CHARS = 500
+
+
+@lru_cache(maxsize=65536)
+def _bucket(term, dimensions):
+    """Bucket and sign of a term; crc32 so every process hashes alike"""
+    h = zlib.crc32(term.encode('utf-8'))
+    return h % dimensions, (1.0 if (h >> 31) & 1 else -1.0)
+
+
+def term_features(text):
+    """Stemmed words plus adjacent word pairs, with counts"""
+    terms = tokenize(text)
+    return Counter(terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])])
+
+
+def hashed_vector(text, dimensions):
+    """Unweighted hashed feature vector of text (sublinear term frequency)"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for term, count in term_features(text).items():
+        bucket, sign = _bucket(term, dimensions)
+        vector[bucket] += sign * (1.0 + math.log(count))
+    return vector
+
+
+def split_passages(text, max_chars=PASSAGE_CHARS):
+    """(start, end) character spans of consecutive sentences, about max_chars long"""
+    passages = []
+    start = end = None
+    for sentence_start, sentence_end in split_sentences(text):
+        if start is None:
+            start = sentence_start
+        end = sentence_end
+        if end - start >= max_chars:
+            passages.append((start, end))
+            start = None
+    if start is not None:
+        passages.append((start, end))
+    return passages
+
+
+class SearchIndex:
+    """Passage matrix, bucket IDF and passage locations of one book"""
+
+    def __init__(self, matrix, idf, locations):
+        self.matrix = matrix        # (passages, dimensions) float32, rows L2-normalized
+        self.idf = idf              # (dimensions,) float32
+        self.locations = locations  # [chapter_id, start, end] per row
+        self.dimensions = idf.shape[0]
+
+    def __len__(self):
+        return len(self.locations)
+
+    @classmethod
+    def build(cls, chapters, dimensions=DEFAULT_DIMENSIONS):
+        """Index an iterable of (chapter_id, text)"""
+        locations = []
+        rows = []
+        for chapter_id, text in chapters:
+            for start, end in split_passages(text):
+                locations.append([chapter_id, start, end])
+                rows.append(hashed_vector(text[start:end], dimensions))
+        matrix = np.vstack(rows) if rows else np.zeros((0, dimensions), dtype=np.float32)
+
+        df = np.count_nonzero(matrix, axis=0)
+        idf = (np.log((1.0 + len(rows)) / (1.0 + df)) + 1.0).astype(np.float32)
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        return cls(matrix, idf, locations)
+
+    def search(self, query, top_k=10):
+        """(row, score) of the best matching passages, best first"""
+        if not len(self):
+            return []
+        vector = hashed_vector(query, self.dimensions) * self.idf
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return []
+        scores = self.matrix @ (vector / norm)
+        if top_k < len(scores):
+            top = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top if scores[row] > 0]
+
+    def save(self, path):
+        """Write the index into a new directory at path"""
+        os.makedirs(path)
+        np.save(os.path.join(path, 'matrix.npy'), self.matrix)
+        np.save(os.path.join(path, 'idf.npy'), self.idf)
+        with open(os.path.join(path, 'passages.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'locations': self.locations}, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'passages.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError('Unsupported search index version')
+        matrix = np.load(os.path.join(path, 'matrix.npy'), mmap_mode='r')
+        idf = np.load(os.path.join(path, 'idf.npy'))
+        return cls(matrix, idf, meta['locations'])
+
+
+class BookSearch:
+    """Search indexes per book version, persisted under root and kept in a small LRU"""
+
+    def __init__(self, root, dimensions=DEFAULT_DIMENSIONS, max_loaded=16):
+        self.root = root
+        self.dimensions = dimensions
+        self.max_loaded = max(1, max_loaded)
+        self._loaded = OrderedDict()  # book_id -> (etag, SearchIndex)
+        self._lock = threading.Lock()
+        self._builds = SingleFlight()
+        self.builds = 0
+        self.loads = 0
+        self.queries = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, book_id, etag):
+        return os.path.join(self.root, book_id, f"{etag}-{self.dimensions}")
+
+    def index(self, book_id, etag, load_chapters):
+        """SearchIndex for this version of the book; load_chapters() yields (chapter_id, text) if it must be built"""
+        if not is_valid_book_id(book_id):
+            raise ValueError(f"Invalid book id: {book_id!r}")
+        with self._lock:
+            cached = self._loaded.get(book_id)
+            if cached and cached[0] == etag:
+                self._loaded.move_to_end(book_id)
+                return cached[1]
+        index, _ = self._builds.do((book_id, etag), self._open, book_id, etag, load_chapters)
+        with self._lock:
+            self._loaded[book_id] = (etag, index)
+            self._loaded.move_to_end(book_id)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return index
+
+    def _open(self, book_id, etag, load_chapters):
+        path = self._path(book_id, etag)
+        try:
+            index = SearchIndex.load(path)
+            with self._lock:
+                self.loads += 1
+            return index
+        except (OSError, ValueError):
+            pass
+        return self.build(book_id, etag, load_chapters())
+
+    def build(self, book_id, etag, chapters):
+        """Index chapters, save them as this book version's index and drop older versions"""
+        index = SearchIndex.build(chapters, self.dimensions)
+        book_dir = os.path.join(self.root, book_id)
+        os.makedirs(book_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=book_dir, suffix='.tmp')
+        path = self._path(book_id, etag)
+        try:
+            index.save(os.path.join(tmp_dir, 'index'))
+            shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.replace(os.path.join(tmp_dir, 'index'), path)
+            except OSError:
+                # Another worker saved the same version first
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        for name in os.listdir(book_dir):
+            if os.path.join(book_dir, name) != path and not name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(book_dir, name), ignore_errors=True)
+        with self._lock:
+            self.builds += 1
+        # Serve from the mapping so this worker shares pages with the others
+        return SearchIndex.load(path)
+
+    def search(self, book_id, etag, load_chapters, query, top_k=10):
+        """[(chapter_id, start, end, score)] of the passages best matching query"""
+        index = self.index(book_id, etag, load_chapters)
+        with self._lock:
+            self.queries += 1
+        return [tuple(index.locations[row]) + (score,) for row, score in index.search(query, top_k)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': len(self._loaded),
+                'passages': sum(len(index) for _, index in self._loaded.values()),
+                'builds': self.builds,
+                'loads': self.loads,
+                'queries': self.queries,
+            }
+
+
+def create_default_search():
+    return BookSearch(
+        os.getenv('SEARCH_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search_index')),
+        dimensions=int(os.getenv('SEARCH_DIMENSIONS', str(DEFAULT_DIMENSIONS))),
+        max_loaded=int(os.getenv('SEARCH_MAX_LOADED', '16'))
+    )
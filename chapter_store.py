@@ -0,0 +1,98 @@
+"""
+Indexed, pre-serialized chapter store for the book endpoints.
+
+A book is normalized once (chapters get an integer ``id``, ``title`` and
+``content`` regardless of whether the source uses ``id``/``content`` like
+SAMPLE_BOOK or ``number``/``text`` like book-of-mormon.json), indexed by
+chapter id, and serialized to JSON bytes up front. Each payload carries a
+strong ETag so unchanged responses can be answered with 304.
+"""
+
+import hashlib
+import json
+
+
+def _etag(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class Payload:
+    """Serialized JSON body plus its ETag"""
+
+    __slots__ = ('body', 'etag')
+
+    def __init__(self, obj):
+        self.body = _dumps(obj)
+        self.etag = _etag(self.body)
+
+
+def normalize_chapter(raw, index):
+    """Map a chapter from any supported book JSON shape onto id/title/content"""
+    chapter_id = raw.get('id')
+    if chapter_id is None:
+        try:
+            chapter_id = int(raw.get('number'))
+        except (TypeError, ValueError):
+            chapter_id = index + 1
+
+    chapter = {
+        'id': chapter_id,
+        'title': raw.get('title') or f"Chapter {index + 1}",
+        'content': raw.get('content') if raw.get('content') is not None else raw.get('text', ''),
+    }
+    if raw.get('number') is not None:
+        chapter['number'] = raw['number']
+    return chapter
+
+
+class ChapterStore:
+    """Immutable id -> chapter index with precomputed JSON payloads"""
+
+    def __init__(self, book):
+        chapters = [normalize_chapter(raw, i) for i, raw in enumerate(book.get('chapters', []))]
+
+        self.title = book.get('title', '')
+        self.author = book.get('author', '')
+        self.chapters = {}
+        self._chapter_payloads = {}
+        for chapter in chapters:
+            if chapter['id'] in self.chapters:
+                raise ValueError(f"Duplicate chapter id {chapter['id']} in '{self.title}'")
+            self.chapters[chapter['id']] = chapter
+            self._chapter_payloads[chapter['id']] = Payload(chapter)
+
+        self.book_payload = Payload({
+            'title': self.title,
+            'author': self.author,
+            'chapters': chapters,
+        })
+        self.toc_payload = Payload({
+            'title': self.title,
+            'author': self.author,
+            'chapters': [
+                {
+                    'id': chapter['id'],
+                    'title': chapter['title'],
+                    'length': len(chapter['content']),
+                    'etag': self._chapter_payloads[chapter['id']].etag,
+                }
+                for chapter in chapters
+            ],
+        })
+
+    @classmethod
+    def from_json_file(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def get_chapter(self, chapter_id):
+        """Return the normalized chapter dict, or None"""
+        return self.chapters.get(chapter_id)
+
+    def chapter_payload(self, chapter_id):
+        """Return the serialized chapter Payload, or None"""
+        return self._chapter_payloads.get(chapter_id)
@@ -0,0 +1,195 @@
+"""
+Content-addressed store of chapter text.
+
+Clients send a chapter's full text once; afterwards they refer to it by
+its SHA-256 hex digest (the same content_hash the response and index
+caches key on), so follow-up questions don't upload and parse the chapter
+again. Recently used texts are kept in a memory LRU bounded by size; every
+text is also written to a directory named by digest, so all workers (and
+restarts) can resolve a digest that any one of them has seen. The directory
+is bounded too: past max_disk_bytes the least recently used files (by
+mtime, bumped on every put and get, memory hits included) are deleted, as in the TTS cache, so clients
+posting arbitrary text can't fill the disk.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_valid_digest(digest):
+    return isinstance(digest, str) and bool(_DIGEST_RE.match(digest))
+
+
+class ContentStore:
+    """Memory LRU (bounded by total UTF-8 size) over an optional size-bounded on-disk directory"""
+
+    def __init__(self, root=None, max_bytes=64 * 1024 * 1024, max_disk_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # digest -> (text, size)
+        self._bytes = 0
+        self._disk_bytes = None  # computed lazily on first disk write
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+        if self.root:
+            os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest + '.txt')
+
+    def _remember(self, digest, text, size):
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return
+            self._entries[digest] = (text, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def put(self, text):
+        """Store text and return its digest"""
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()  # == retrieval.content_hash(text)
+        self._remember(digest, text, len(data))
+        if self.root and len(data) <= self.max_disk_bytes:
+            path = self._path(digest)
+            if os.path.exists(path):
+                self._touch(path)
+            else:
+                # New, or evicted from disk (perhaps by another worker) while still in memory here
+                self._write(path, data)
+                self._account_disk(len(data))
+        return digest
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _touch(self, path):
+        # Bump mtime so eviction approximates LRU
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _account_disk(self, size):
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+            else:
+                self._disk_bytes += size
+            over_limit = self._disk_bytes > self.max_disk_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _disk_files(self):
+        """(mtime, size, path) of every stored text"""
+        files = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith('.txt'):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        return files
+
+    def _evict_disk(self):
+        """Delete least recently used texts until under 90% of the disk limit"""
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_disk_bytes * 0.9)
+        evicted = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+            self.disk_evictions += evicted
+
+    def get(self, digest):
+        """Return the text for digest, or None if this store has never seen it"""
+        if not is_valid_digest(digest):
+            return None
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+        if entry is not None:
+            # Hot texts are served from memory; keep their files from looking idle to eviction
+            if self.root:
+                self._touch(self._path(digest))
+            return entry[0]
+        if self.root:
+            try:
+                with open(self._path(digest), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                self._touch(self._path(digest))
+                text = data.decode('utf-8')
+                self._remember(digest, text, len(data))
+                with self._lock:
+                    self.disk_hits += 1
+                return text
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits_memory': self.hits,
+                'hits_disk': self.disk_hits,
+                'misses': self.misses,
+                'disk_bytes': self._disk_bytes,
+                'disk_evictions': self.disk_evictions,
+            }
+
+
+def create_default_store():
+    root = os.getenv(
+        'CONTENT_STORE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content_store')
+    )
+    return ContentStore(
+        root or None,
+        max_bytes=int(float(os.getenv('CONTENT_STORE_MEMORY_MB', '64')) * 1024 * 1024),
+        max_disk_bytes=int(float(os.getenv('CONTENT_STORE_DISK_MB', '256')) * 1024 * 1024)
+    )
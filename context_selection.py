@@ -0,0 +1,106 @@
+"""
+Select the chapter passages worth sending to the LLM.
+
+Instead of pasting a whole chapter into every prompt, the chapter is cut
+into passages of a few sentences, ranked against the question with the
+BM25 index from retrieval.py, and the best passages are kept (in reading
+order) until a token budget is spent. Chapters already under the budget
+are sent unchanged, and CONTEXT_MODE=full restores whole-chapter prompts.
+"""
+
+import math
+import os
+
+from retrieval import BM25Index, IndexCache, split_sentences
+
+PASSAGE_SEPARATOR = '\n\n[...]\n\n'
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English prose)"""
+    return math.ceil(len(text) / 4)
+
+
+class PassageIndex:
+    """A chapter cut into consecutive sentence groups, indexed for BM25 ranking"""
+
+    def __init__(self, content, passage_tokens=150):
+        self.content = content
+        self.spans = []
+
+        start = end = None
+        for sentence_start, sentence_end in split_sentences(content):
+            if start is None:
+                start = sentence_start
+            elif estimate_tokens(content[start:sentence_end]) > passage_tokens:
+                self.spans.append((start, end))
+                start = sentence_start
+            end = sentence_end
+        if start is not None:
+            self.spans.append((start, end))
+        # Sentence spans stop before terminal punctuation; keep it in the passage
+        self.spans = [self._extend_to_punctuation(s, e) for s, e in self.spans]
+
+        self.index = BM25Index([content[s:e] for s, e in self.spans])
+
+    def _extend_to_punctuation(self, start, end):
+        while end < len(self.content) and self.content[end] in '.!?"\'”’)':
+            end += 1
+        return start, end
+
+    def select(self, query, token_budget, top_k):
+        """Return the best passages for query, in chapter order, within token_budget"""
+        ranked = [doc_id for doc_id, _ in self.index.search(query, top_k=len(self.spans))]
+        # With no lexical overlap at all, fall back to the opening of the chapter
+        if not ranked:
+            ranked = list(range(len(self.spans)))
+
+        chosen = []
+        used = 0
+        for doc_id in ranked:
+            if len(chosen) >= top_k:
+                break
+            start, end = self.spans[doc_id]
+            cost = estimate_tokens(self.content[start:end])
+            if used + cost > token_budget:
+                continue
+            chosen.append(doc_id)
+            used += cost
+
+        if not chosen:
+            # Even the best passage is over budget (e.g. one enormous sentence): truncate it
+            start, end = self.spans[ranked[0]]
+            return [self.content[start:min(end, start + token_budget * 4)]]
+
+        return [self.content[self.spans[i][0]:self.spans[i][1]] for i in sorted(chosen)]
+
+
+class ContextSelector:
+    """Builds the chapter text placed in LLM prompts"""
+
+    def __init__(self, mode='passages', token_budget=1500, top_k=6, passage_tokens=150):
+        self.mode = mode
+        self.token_budget = token_budget
+        self.top_k = top_k
+        self._indexes = IndexCache(factory=lambda content: PassageIndex(content, passage_tokens))
+
+    def select(self, content, query, mode=None, content_key=None, token_budget=None):
+        """Return (context_text, trimmed) for content given the question text"""
+        mode = mode or self.mode
+        token_budget = token_budget or self.token_budget
+        if mode == 'full' or estimate_tokens(content) <= token_budget:
+            return content, False
+
+        passages = self._indexes.get(content, content_key).select(query, token_budget, self.top_k)
+        if not passages:
+            return content, False
+        return PASSAGE_SEPARATOR.join(passages), True
+
+
+def create_default_selector():
+    return ContextSelector(
+        mode=os.getenv('CONTEXT_MODE', 'passages'),
+        token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500')),
+        top_k=int(os.getenv('CONTEXT_TOP_K', '6')),
+        passage_tokens=int(os.getenv('CONTEXT_PASSAGE_TOKENS', '150')),
+    )
@@ -0,0 +1,319 @@
+"""
+On-disk corpus of books, served from memory-mapped files.
+
+Each book is ingested once from its JSON source into a single ``.book``
+file: a fixed-size header, an offset index with one record per chapter
+(id, title and text offsets, lengths, content hash), a second index of
+record positions sorted by chapter id, and then every title and chapter
+body as contiguous UTF-8. At startup only the headers are read into a
+small catalog (id, title, author, chapter count). A book's file is mapped
+on first access, and chapters are decoded straight from the mapping on
+each request. Chapter text therefore lives in the OS page cache, shared
+between workers and reclaimable under pressure, rather than in the Python
+heap, so memory stays flat however many books are hosted. At most
+max_open books are mapped at a time (least recently used are unmapped),
+which also bounds open file descriptors.
+
+Re-ingesting a book replaces its file atomically; the next request notices
+the new file and maps it, while requests already reading the old mapping
+finish against it.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+from chapter_store import normalize_chapter
+
+_MAGIC = b'ARBK'
+_VERSION = 1
+# magic, version, flags, chapter count, book digest, title offset/length, author offset/length
+_HEADER = struct.Struct('<4sHHI16sQIQI')
+# chapter id, title offset/length, text offset/length (bytes), text length (characters), content digest
+_RECORD = struct.Struct('<qQIQII16s')
+_POSITION = struct.Struct('<I')
+
+_BOOK_ID_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,99}$')
+
+BOOK_SUFFIX = '.book'
+
+
+def is_valid_book_id(book_id):
+    return bool(_BOOK_ID_RE.match(book_id or ''))
+
+
+def book_id_from_path(path):
+    """Default book id for a source file: its name without extension, slugified"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r'-+', '-', re.sub(r'[^A-Za-z0-9._-]', '-', stem)).strip('-').lower()[:100]
+
+
+def encode_book(book):
+    """Serialize a book dict (any shape normalize_chapter accepts) into the .book layout"""
+    chapters = [normalize_chapter(raw, i) for i, raw in enumerate(book.get('chapters', []))]
+    seen = set()
+    for chapter in chapters:
+        if not isinstance(chapter['id'], int):
+            raise ValueError(f"Chapter id {chapter['id']!r} is not an integer")
+        if chapter['id'] in seen:
+            raise ValueError(f"Duplicate chapter id {chapter['id']} in '{book.get('title', '')}'")
+        seen.add(chapter['id'])
+
+    index_size = _HEADER.size + len(chapters) * (_RECORD.size + _POSITION.size)
+    text = bytearray()
+
+    def add(value):
+        data = (value or '').encode('utf-8')
+        offset = index_size + len(text)
+        text.extend(data)
+        return offset, len(data)
+
+    title_off, title_len = add(book.get('title', ''))
+    author_off, author_len = add(book.get('author', ''))
+
+    records = []
+    for chapter in chapters:
+        chapter_title_off, chapter_title_len = add(chapter['title'])
+        text_off, text_len = add(chapter['content'])
+        digest = hashlib.sha256(
+            json.dumps([chapter['id'], chapter['title'], chapter['content']]).encode('utf-8')
+        ).digest()[:16]
+        records.append(_RECORD.pack(
+            chapter['id'], chapter_title_off, chapter_title_len,
+            text_off, text_len, len(chapter['content']), digest
+        ))
+    positions = sorted(range(len(chapters)), key=lambda i: chapters[i]['id'])
+
+    body = b''.join(records) + b''.join(_POSITION.pack(i) for i in positions) + bytes(text)
+    header = _HEADER.pack(
+        _MAGIC, _VERSION, 0, len(chapters), hashlib.sha256(body).digest()[:16],
+        title_off, title_len, author_off, author_len
+    )
+    return header + body
+
+
+def _read_header(data):
+    magic, version, _flags, count, digest, title_off, title_len, author_off, author_len = \
+        _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError('Not a corpus book file')
+    return count, digest, title_off, title_len, author_off, author_len
+
+
+class ChapterEntry:
+    """Index record of one chapter; the text itself stays in the mapping"""
+
+    __slots__ = ('id', 'title', 'length', 'etag', '_text_off', '_text_len')
+
+    def __init__(self, chapter_id, title, length, etag, text_off, text_len):
+        self.id = chapter_id
+        self.title = title
+        self.length = length
+        self.etag = etag
+        self._text_off = text_off
+        self._text_len = text_len
+
+
+class MappedBook:
+    """Read-only view of one .book file through mmap"""
+
+    def __init__(self, book_id, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count, digest, title_off, title_len, author_off, author_len = _read_header(self._map)
+        self.book_id = book_id
+        self.count = count
+        self.etag = digest.hex()
+        self.title = self._str(title_off, title_len)
+        self.author = self._str(author_off, author_len)
+        self._positions_off = _HEADER.size + count * _RECORD.size
+
+    def _str(self, offset, length):
+        return self._map[offset:offset + length].decode('utf-8')
+
+    def _entry(self, position):
+        chapter_id, title_off, title_len, text_off, text_len, length, digest = \
+            _RECORD.unpack_from(self._map, _HEADER.size + position * _RECORD.size)
+        return ChapterEntry(chapter_id, self._str(title_off, title_len), length, digest.hex(), text_off, text_len)
+
+    def _chapter_id_at(self, position):
+        return struct.unpack_from('<q', self._map, _HEADER.size + position * _RECORD.size)[0]
+
+    def entries(self):
+        """Chapter index records in book order"""
+        return [self._entry(position) for position in range(self.count)]
+
+    def chapter_ids(self):
+        return [self._chapter_id_at(position) for position in range(self.count)]
+
+    def find(self, chapter_id):
+        """Index record for chapter_id, or None"""
+        # Chapters are usually numbered 1..n in order
+        if 0 < chapter_id <= self.count and self._chapter_id_at(chapter_id - 1) == chapter_id:
+            return self._entry(chapter_id - 1)
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            position = _POSITION.unpack_from(self._map, self._positions_off + mid * _POSITION.size)[0]
+            found = self._chapter_id_at(position)
+            if found == chapter_id:
+                return self._entry(position)
+            if found < chapter_id:
+                low = mid + 1
+            else:
+                high = mid
+        return None
+
+    def text(self, entry):
+        return self._str(entry._text_off, entry._text_len)
+
+    def chapter(self, chapter_id):
+        """Chapter dict shaped like ChapterStore.get_chapter, or None"""
+        entry = self.find(chapter_id)
+        if entry is None:
+            return None
+        return {'id': entry.id, 'title': entry.title, 'content': self.text(entry)}
+
+    def toc(self):
+        return {
+            'id': self.book_id,
+            'title': self.title,
+            'author': self.author,
+            'chapters': [
+                {'id': entry.id, 'title': entry.title, 'length': entry.length, 'etag': entry.etag}
+                for entry in self.entries()
+            ],
+        }
+
+
+class Corpus:
+    """Directory of .book files with a header catalog and an LRU of open mappings"""
+
+    def __init__(self, root, max_open=256):
+        self.root = root
+        self.max_open = max(1, max_open)
+        os.makedirs(self.root, exist_ok=True)
+        self._catalog = {}
+        self._catalog_mtime = None
+        self._open = OrderedDict()  # book_id -> (file identity, MappedBook)
+        self._lock = threading.Lock()
+        self.mapped = 0
+        self._scan()
+
+    def path(self, book_id):
+        if not is_valid_book_id(book_id):
+            raise ValueError(f"Invalid book id: {book_id!r}")
+        return os.path.join(self.root, book_id + BOOK_SUFFIX)
+
+    def _read_info(self, book_id, path):
+        with open(path, 'rb') as f:
+            data = f.read(_HEADER.size)
+            count, digest, title_off, title_len, author_off, author_len = _read_header(data)
+            f.seek(title_off)
+            title = f.read(title_len).decode('utf-8')
+            f.seek(author_off)
+            author = f.read(author_len).decode('utf-8')
+        return {'id': book_id, 'title': title, 'author': author, 'chapters': count, 'etag': digest.hex()}
+
+    def _scan(self):
+        """Rebuild the catalog from file headers if the directory changed"""
+        try:
+            mtime = os.stat(self.root).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._catalog_mtime:
+            return
+        catalog = {}
+        for name in os.listdir(self.root):
+            book_id = name[:-len(BOOK_SUFFIX)]
+            if not name.endswith(BOOK_SUFFIX) or not is_valid_book_id(book_id):
+                continue
+            try:
+                catalog[book_id] = self._read_info(book_id, os.path.join(self.root, name))
+            except (OSError, ValueError, struct.error):
+                continue
+        with self._lock:
+            self._catalog = catalog
+            self._catalog_mtime = mtime
+
+    def books(self):
+        """Catalog entries (id, title, author, chapters, etag) sorted by id"""
+        self._scan()
+        with self._lock:
+            return [self._catalog[book_id] for book_id in sorted(self._catalog)]
+
+    def __contains__(self, book_id):
+        return self.get(book_id) is not None
+
+    def get(self, book_id):
+        """The MappedBook for book_id, or None if there is no such book"""
+        try:
+            path = self.path(book_id)
+            st = os.stat(path)
+        except (ValueError, FileNotFoundError):
+            return None
+        identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._open.get(book_id)
+            if cached and cached[0] == identity:
+                self._open.move_to_end(book_id)
+                return cached[1]
+        try:
+            book = MappedBook(book_id, path)
+        except (OSError, ValueError, struct.error):
+            return None
+        with self._lock:
+            # Dropped mappings are unmapped once no request still holds them
+            self._open[book_id] = (identity, book)
+            self._open.move_to_end(book_id)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+            self.mapped += 1
+        return book
+
+    def chapter(self, book_id, chapter_id):
+        book = self.get(book_id)
+        return book.chapter(chapter_id) if book else None
+
+    def chapter_text(self, book_id, chapter_id):
+        chapter = self.chapter(book_id, chapter_id)
+        return chapter['content'] if chapter else None
+
+    def ingest(self, book, book_id):
+        """Write a book dict into the corpus (replacing any previous version); returns its catalog entry"""
+        path = self.path(book_id)
+        data = encode_book(book)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return self._read_info(book_id, path)
+
+    def ingest_file(self, path, book_id=None):
+        with open(path, 'r', encoding='utf-8') as f:
+            book = json.load(f)
+        return self.ingest(book, book_id or book_id_from_path(path))
+
+    def stats(self):
+        with self._lock:
+            return {'books': len(self._catalog), 'open': len(self._open), 'mapped': self.mapped}
+
+
+def create_default_corpus():
+    return Corpus(
+        os.getenv('CORPUS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')),
+        max_open=int(os.getenv('CORPUS_MAX_OPEN', '256'))
+    )
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Ingest book JSON files into the server-side corpus.
+
+Each file ({"title", "author", "chapters": [...]}, with chapters shaped
+like SAMPLE_BOOK or book-of-mormon.json) is converted into a memory-mapped
+.book file in CORPUS_DIR (see corpus.py) and served from
+/api/books/<book_id>. Running it again for the same id replaces the book;
+a running server picks up the new version on the next request. The book's
+search index (see book_search.py) is built as well, unless --no-search-index
+is given, in which case the server builds it on the first search.
+
+Usage:
+    python ingest_books.py book-of-mormon.json            # id "book-of-mormon"
+    python ingest_books.py books/*.json                   # many books at once
+    python ingest_books.py scripture.json --id bom        # choose the id
+    python ingest_books.py book.json --corpus-dir /data/corpus
+    python ingest_books.py books/*.json --no-search-index
+"""
+
+import argparse
+import os
+from dotenv import load_dotenv
+from book_search import create_default_search
+from corpus import Corpus, book_id_from_path, create_default_corpus, is_valid_book_id
+
+# Load environment variables
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest book JSON files into the corpus')
+    parser.add_argument('paths', nargs='+', help='Book JSON files')
+    parser.add_argument('--id', help='Book id (only with a single file; defaults to the file name)')
+    parser.add_argument('--corpus-dir',
+                        help="Corpus directory (default: CORPUS_DIR, else the server's corpus)")
+    parser.add_argument('--no-search-index', action='store_true',
+                        help="Don't build search indexes now (the server builds them on first search)")
+    args = parser.parse_args()
+
+    if args.id and len(args.paths) > 1:
+        raise SystemExit("❌ Error: --id can only be used with a single file")
+
+    corpus = Corpus(args.corpus_dir) if args.corpus_dir else create_default_corpus()
+    search = None if args.no_search_index else create_default_search()
+    ingested = failed = 0
+    for path in args.paths:
+        book_id = args.id or book_id_from_path(path)
+        if not is_valid_book_id(book_id):
+            print(f"❌ {path}: invalid book id {book_id!r}")
+            failed += 1
+            continue
+        try:
+            info = corpus.ingest_file(path, book_id)
+        except (OSError, ValueError) as e:
+            print(f"❌ {path}: {e}")
+            failed += 1
+            continue
+        size = os.path.getsize(corpus.path(book_id))
+        print(f"✅ {book_id}: {info['title'] or '(untitled)'} - {info['chapters']} chapters, {size / 1024:.1f} KB")
+        if search:
+            book = corpus.get(book_id)
+            index = search.build(book_id, book.etag, ((entry.id, book.text(entry)) for entry in book.entries()))
+            print(f"   🔎 Search index: {len(index)} passages")
+        ingested += 1
+
+    print(f"\n📚 Ingested {ingested} book(s) into {corpus.root}" + (f", {failed} failed" if failed else ''))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Logging setup for the server.
+
+LOG_LEVEL gates verbosity (DEBUG shows per-request details such as
+payload sizes; the default INFO keeps the hot path quiet). LOG_FORMAT=json
+emits one JSON object per line, with any ``extra={...}`` fields passed to
+the logger as top-level keys, for log aggregators; LOG_FORMAT=text is
+easier to read locally.
+
+Per-request lines from the HTTP client (httpx, one per upstream call) and
+the Flask dev server's access log are held to LOG_ACCESS_LEVEL, WARNING by
+default, so INFO doesn't emit a line for every request.
+"""
+
+import json
+import logging
+import os
+import sys
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Loggers that write one line per request or upstream call
+ACCESS_LOGGERS = ('httpx', 'httpcore', 'werkzeug')
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and not key.startswith('_')
+        )
+        return f"{line} {fields}" if fields else line
+
+
+def configure_logging():
+    """Install a single stderr handler on the root logger (idempotent)"""
+    root = logging.getLogger()
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    access_level = os.getenv('LOG_ACCESS_LEVEL', 'WARNING').upper()
+    for name in ACCESS_LOGGERS:
+        logging.getLogger(name).setLevel(access_level)
+    if any(getattr(handler, '_aristo', False) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler._aristo = True
+    if os.getenv('LOG_FORMAT', 'json').lower() == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root.addHandler(handler)
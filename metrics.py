@@ -0,0 +1,225 @@
+"""
+In-process metrics exposed in the Prometheus text format.
+
+Counters and histograms are plain Python objects guarded by a lock, so
+recording a sample is a dict lookup and an add; nothing is written
+anywhere until /metrics is scraped. Values are per process: with several
+gunicorn workers, each worker reports its own series (scrape them
+individually or sum them in Prometheus).
+"""
+
+import bisect
+import math
+import threading
+import time
+
+# Latency buckets in seconds, from local cache hits up to slow TTS calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self.labelnames, key, value) for key, value in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        samples = []
+        bucket_labels = self.labelnames + ('le',)
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                samples.append((self.name + '_bucket', bucket_labels, key + (_format_value(float(bound)),), cumulative))
+            samples.append((self.name + '_bucket', bucket_labels, key + ('+Inf',), series[-1]))
+            samples.append((self.name + '_sum', self.labelnames, key, series[-2]))
+            samples.append((self.name + '_count', self.labelnames, key, series[-1]))
+        return samples
+
+
+class Registry:
+    """Metrics plus collector callbacks sampled at scrape time"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """collect() is called on every scrape, to refresh gauges from other components"""
+        self._collectors.append(collect)
+
+    def render(self):
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labelnames, values, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labelnames, values)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'aristo_http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status')
+)
+http_latency = registry.histogram(
+    'aristo_http_request_duration_seconds', 'Time to produce a response (headers, for streams)', ('method', 'route')
+)
+upstream_requests = registry.counter(
+    'aristo_upstream_requests_total', 'OpenAI calls by upstream and outcome', ('upstream', 'outcome')
+)
+upstream_latency = registry.histogram(
+    'aristo_upstream_request_duration_seconds', 'OpenAI call latency per attempt', ('upstream',)
+)
+upstream_tokens = registry.counter(
+    'aristo_upstream_tokens_total', 'Tokens reported by OpenAI usage', ('upstream', 'kind')
+)
+upstream_bytes = registry.counter(
+    'aristo_upstream_bytes_total', 'Response bytes received from OpenAI', ('upstream',)
+)
+cache_lookups = registry.gauge(
+    'aristo_cache_lookups', 'Cache lookups since start by result', ('cache', 'result')
+)
+cache_hit_ratio = registry.gauge(
+    'aristo_cache_hit_ratio', 'Cache hits / lookups since start', ('cache',)
+)
+
+
+def observe_request(method, route, status, seconds):
+    http_requests.inc(method=method, route=route, status=str(status))
+    http_latency.observe(seconds, method=method, route=route)
+
+
+def observe_upstream(upstream, outcome, seconds=None, result=None):
+    """Record one upstream attempt; token and byte counts are read off result when present"""
+    upstream_requests.inc(upstream=upstream, outcome=outcome)
+    if seconds is not None:
+        upstream_latency.observe(seconds, upstream=upstream)
+    if result is None:
+        return
+    usage = getattr(result, 'usage', None)
+    if usage is not None:
+        upstream_tokens.inc(getattr(usage, 'prompt_tokens', 0) or 0, upstream=upstream, kind='prompt')
+        upstream_tokens.inc(getattr(usage, 'completion_tokens', 0) or 0, upstream=upstream, kind='completion')
+    content = getattr(result, 'content', None)
+    if isinstance(content, bytes):
+        upstream_bytes.inc(len(content), upstream=upstream)
+
+
+def record_cache_stats(name, hits, misses):
+    cache_lookups.set(hits, cache=name, result='hit')
+    cache_lookups.set(misses, cache=name, result='miss')
+    lookups = hits + misses
+    cache_hit_ratio.set(hits / lookups if lookups else 0.0, cache=name)
+
+
+def instrument_flask(app):
+    """Time every Flask request and count it by route template and status"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe_request(request.method, route, response.status_code, time.perf_counter() - started)
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return app.response_class(registry.render(), mimetype=None, content_type=CONTENT_TYPE)
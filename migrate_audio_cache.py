@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Migrate Aristo audio cache rows into the server-side blob store.
+
+Rows in the Supabase audio_cache table keep each chapter's audio as a JSON
+array of base64 strings. This script decodes them once and writes each
+chapter as a raw audio blob plus segment manifest (see audio_blob_store.py),
+which is a third smaller and can be served with ranged reads.
+
+Rows are keyed by the client's cache key
+(audio-{book}-ch{number}-{chapter id}-{title}-{voice}-{model}[-{format}]);
+each is stored under the key the server looks chapters up by, built from
+the row's book and chapter ids (book_id/chapter_id columns when an export
+carries them, else parsed from the cache key), its voice and model, and
+the format of its audio.
+
+Usage:
+    python migrate_audio_cache.py                     # read rows from Supabase
+    python migrate_audio_cache.py --input rows.json   # read an exported JSON array of rows
+    python migrate_audio_cache.py --dry-run           # report sizes without writing
+"""
+
+import argparse
+import base64
+import binascii
+import json
+import os
+import re
+import urllib.error
+import urllib.request
+from dotenv import load_dotenv
+from audio_blob_store import AudioBlobStore, chapter_audio_key, create_default_store, is_valid_key
+from audio_formats import sniff_format
+
+# Load environment variables
+load_dotenv()
+
+PAGE_SIZE = 50
+
+# Supabase chapter ids are UUIDs, which is what separates the chapter id
+# from the book id before it and the free-form chapter title after it
+_UUID = r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+_CLIENT_KEY_RE = re.compile(rf'^audio-(?P<book>{_UUID}|[a-z0-9-]+?)-ch\d+-(?P<chapter>{_UUID})-')
+
+
+def fetch_supabase_rows():
+    """Yield audio_cache rows from Supabase, one page at a time"""
+    supabase_url = os.getenv('SUPABASE_URL')
+    supabase_anon_key = os.getenv('SUPABASE_ANON_KEY')
+    if not supabase_url or not supabase_anon_key:
+        raise SystemExit("❌ Error: SUPABASE_URL and SUPABASE_ANON_KEY must be set in .env file")
+
+    headers = {
+        'apikey': supabase_anon_key,
+        'Authorization': f'Bearer {supabase_anon_key}',
+    }
+    offset = 0
+    while True:
+        request = urllib.request.Request(
+            f'{supabase_url}/rest/v1/audio_cache'
+            f'?select=cache_key,audio_data,voice,model,text_hash&order=id&limit={PAGE_SIZE}&offset={offset}',
+            headers=headers
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                rows = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise SystemExit(f"❌ Error reading audio_cache: HTTP {e.code}\n{e.read().decode('utf-8', 'replace')}")
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            return
+        offset += PAGE_SIZE
+
+
+def read_exported_rows(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = json.load(f)
+    if not isinstance(rows, list):
+        raise SystemExit(f"❌ Error: {path} must contain a JSON array of audio_cache rows")
+    return rows
+
+
+def decode_segments(audio_data):
+    """Decode the audio_data column (JSON array of base64 strings) into raw bytes per segment"""
+    segments = json.loads(audio_data) if isinstance(audio_data, str) else audio_data
+    if not isinstance(segments, list):
+        raise ValueError('audio_data is not a list')
+    return [base64.b64decode(segment, validate=True) if segment else None for segment in segments]
+
+
+def server_key(row, fmt='mp3'):
+    """Blob store key the server looks this row's chapter up by, or None if it can't be derived"""
+    book_id, chapter_id = row.get('book_id'), row.get('chapter_id')
+    if book_id is None or chapter_id is None:
+        match = _CLIENT_KEY_RE.match(row.get('cache_key') or '')
+        if not match:
+            return None
+        book_id, chapter_id = match.group('book'), match.group('chapter')
+    if not row.get('voice') or not row.get('model'):
+        return None
+    key = chapter_audio_key(book_id, chapter_id, row['voice'], row['model'], fmt)
+    return key if is_valid_key(key) else None
+
+
+def migrate(rows, store, dry_run=False):
+    migrated = skipped = 0
+    text_bytes = blob_bytes = 0
+    for row in rows:
+        try:
+            audio = decode_segments(row.get('audio_data'))
+        except (ValueError, TypeError, binascii.Error) as e:
+            print(f"⚠️  Skipping {row.get('cache_key')!r}: {e}")
+            skipped += 1
+            continue
+        # Rows from Opus-capable browsers hold Opus; the server keys and serves each format separately
+        fmt = sniff_format(next((segment for segment in audio if segment), b''))
+        key = server_key(row, fmt)
+        if key is None:
+            print(f"⚠️  Skipping row with unusable cache key: {row.get('cache_key')!r}")
+            skipped += 1
+            continue
+
+        size = sum(len(segment or b'') for segment in audio)
+        text_bytes += len(row['audio_data']) if isinstance(row['audio_data'], str) else 0
+        blob_bytes += size
+        if not dry_run:
+            store.put_chapter(
+                key, [(segment, None) for segment in audio],
+                voice=row.get('voice'), model=row.get('model'), fmt=fmt,
+                chapter_text_hash=row.get('text_hash')
+            )
+        print(f"{'🔍' if dry_run else '✅'} {key}: {len(audio)} segments, {size} bytes")
+        migrated += 1
+    return migrated, skipped, text_bytes, blob_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert base64 audio_cache rows into the audio blob store')
+    parser.add_argument('--input', help='JSON file of exported audio_cache rows (default: read from Supabase)')
+    parser.add_argument('--store-dir',
+                        help="Blob store directory (default: AUDIO_BLOB_DIR, else the server's audio_blobs)")
+    parser.add_argument('--dry-run', action='store_true', help='Decode and report without writing')
+    args = parser.parse_args()
+
+    print("🎵 Aristo Audio Cache Migration")
+    print("=" * 30)
+
+    rows = read_exported_rows(args.input) if args.input else fetch_supabase_rows()
+    store = None
+    if not args.dry_run:
+        store = AudioBlobStore(args.store_dir) if args.store_dir else create_default_store()
+    migrated, skipped, text_bytes, blob_bytes = migrate(rows, store, dry_run=args.dry_run)
+
+    print(f"\nMigrated {migrated} chapters, skipped {skipped}")
+    if text_bytes:
+        saved = text_bytes - blob_bytes
+        print(f"Base64 JSON: {text_bytes} bytes -> raw blobs: {blob_bytes} bytes "
+              f"({saved} bytes, {saved / text_bytes:.0%} saved)")
+
+
+if __name__ == '__main__':
+    main()
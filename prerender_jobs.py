@@ -0,0 +1,273 @@
+"""
+Background pre-synthesis of chapter audio.
+
+Jobs ("render these chapters of book X with voice/model Y as format Z") are stored in
+a local SQLite database so they survive restarts and can be shared by
+several worker processes. A background thread claims queued jobs, splits
+each chapter into TTS segments and synthesizes them through the normal
+audio path, so the results land in the server-side audio cache (and the
+chapter blob store) before any reader presses play. Failed jobs are retried with jittered exponential
+backoff; segments finished before a failure are cache hits on retry.
+"""
+
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prerender_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedupe_key TEXT NOT NULL UNIQUE,
+    book_id TEXT NOT NULL,
+    chapter_ids TEXT NOT NULL,
+    voice TEXT NOT NULL,
+    model TEXT NOT NULL,
+    format TEXT NOT NULL DEFAULT 'mp3',
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    next_run_at REAL NOT NULL,
+    lease_until REAL,
+    chapters_done INTEGER NOT NULL DEFAULT 0,
+    segments_total INTEGER NOT NULL DEFAULT 0,
+    segments_done INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prerender_jobs_runnable ON prerender_jobs (status, next_run_at);
+"""
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class JobStore:
+    """SQLite-backed prerender job table"""
+
+    def __init__(self, path, lease_seconds=600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Databases created before jobs carried an audio format
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(prerender_jobs)')}
+            if 'format' not in columns:
+                conn.execute("ALTER TABLE prerender_jobs ADD COLUMN format TEXT NOT NULL DEFAULT 'mp3'")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def enqueue(self, book_id, chapter_ids, voice, model, fmt='mp3', max_attempts=5):
+        """Queue a job, or return the existing one for the same book/chapters/voice/model/format"""
+        chapter_ids = sorted(chapter_ids)
+        # MP3 jobs keep the key they had before formats existed
+        dedupe_key = json.dumps([book_id, chapter_ids, voice, model] + ([] if fmt == 'mp3' else [fmt]))
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT * FROM prerender_jobs WHERE dedupe_key = ?', (dedupe_key,)).fetchone()
+            if row is None:
+                cursor = conn.execute(
+                    'INSERT INTO prerender_jobs (dedupe_key, book_id, chapter_ids, voice, model, format, status, '
+                    'max_attempts, next_run_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (dedupe_key, book_id, json.dumps(chapter_ids), voice, model, fmt, QUEUED,
+                     max_attempts, now, now, now)
+                )
+                job_id, created = cursor.lastrowid, True
+            elif row['status'] in (DONE, FAILED):
+                # Re-run finished jobs: the cache may have evicted some of their audio
+                conn.execute(
+                    'UPDATE prerender_jobs SET status = ?, attempts = 0, next_run_at = ?, lease_until = NULL, '
+                    'chapters_done = 0, segments_done = 0, last_error = NULL, updated_at = ? WHERE id = ?',
+                    (QUEUED, now, now, row['id'])
+                )
+                job_id, created = row['id'], True
+            else:
+                job_id, created = row['id'], False
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return self.get(job_id), created
+
+    def get(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM prerender_jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return job_to_dict(row) if row else None
+
+    def list(self, status=None, limit=50):
+        conn = self._connect()
+        try:
+            if status:
+                rows = conn.execute(
+                    'SELECT * FROM prerender_jobs WHERE status = ? ORDER BY id DESC LIMIT ?', (status, limit)
+                ).fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM prerender_jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [job_to_dict(row) for row in rows]
+
+    def claim(self):
+        """Atomically take the next runnable job (or one whose worker died), or None"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT * FROM prerender_jobs WHERE (status = ? AND next_run_at <= ?) '
+                'OR (status = ? AND lease_until < ?) ORDER BY next_run_at, id LIMIT 1',
+                (QUEUED, now, RUNNING, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    'UPDATE prerender_jobs SET status = ?, attempts = attempts + 1, lease_until = ?, '
+                    'updated_at = ? WHERE id = ?',
+                    (RUNNING, now + self.lease_seconds, now, row['id'])
+                )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return self.get(row['id']) if row is not None else None
+
+    def progress(self, job_id, chapters_done, segments_done, segments_total):
+        """Record progress and extend the job's lease"""
+        now = time.time()
+        self._update(
+            job_id,
+            'chapters_done = ?, segments_done = ?, segments_total = ?, lease_until = ?',
+            (chapters_done, segments_done, segments_total, now + self.lease_seconds)
+        )
+
+    def complete(self, job_id):
+        self._update(job_id, 'status = ?, lease_until = NULL, last_error = NULL', (DONE,))
+
+    def fail(self, job_id, error, retry_at=None):
+        """Requeue the job for retry_at, or mark it failed when retry_at is None"""
+        if retry_at is None:
+            self._update(job_id, 'status = ?, lease_until = NULL, last_error = ?', (FAILED, error))
+        else:
+            self._update(
+                job_id, 'status = ?, lease_until = NULL, last_error = ?, next_run_at = ?',
+                (QUEUED, error, retry_at)
+            )
+
+    def _update(self, job_id, assignments, params):
+        conn = self._connect()
+        try:
+            conn.execute(
+                f'UPDATE prerender_jobs SET {assignments}, updated_at = ? WHERE id = ?',
+                (*params, time.time(), job_id)
+            )
+        finally:
+            conn.close()
+
+
+def job_to_dict(row):
+    job = {key: row[key] for key in row.keys() if key not in ('dedupe_key', 'lease_until')}
+    job['chapter_ids'] = json.loads(job['chapter_ids'])
+    job['progress'] = job['segments_done'] / job['segments_total'] if job['segments_total'] else 0.0
+    return job
+
+
+class PrerenderWorker:
+    """Background thread that runs queued prerender jobs"""
+
+    def __init__(self, store, load_chapter_text, split_text, synthesize, store_chapter=None,
+                 poll_interval=2.0, backoff_base=30.0, backoff_max=3600.0):
+        self.store = store
+        self.load_chapter_text = load_chapter_text  # (book_id, chapter_id) -> text or None
+        self.split_text = split_text                # text -> list of segments
+        self.synthesize = synthesize                # (text, voice, model, fmt) -> (audio_bytes, ...)
+        self.store_chapter = store_chapter          # (book_id, chapter_id, voice, model, segments, audio, fmt) -> anything
+        self.poll_interval = poll_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='prerender-worker', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim()
+            except sqlite3.Error as e:
+                logger.warning("Prerender worker could not claim a job: %s", e)
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        try:
+            self._render(job)
+        except Exception as e:
+            attempts = job['attempts']
+            if attempts >= job['max_attempts']:
+                logger.error("Prerender job %s failed permanently: %s", job['id'], e)
+                self.store.fail(job['id'], str(e))
+            else:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+                delay *= random.uniform(0.5, 1.5)
+                logger.warning(
+                    "Prerender job %s failed (attempt %d), retrying in %.0fs: %s", job['id'], attempts, delay, e
+                )
+                self.store.fail(job['id'], str(e), retry_at=time.time() + delay)
+            return
+        self.store.complete(job['id'])
+        logger.info("Prerender job %s complete", job['id'])
+
+    def _render(self, job):
+        chapters = []
+        for chapter_id in job['chapter_ids']:
+            text = self.load_chapter_text(job['book_id'], chapter_id)
+            if text is None:
+                raise LookupError(f"chapter {chapter_id} of book {job['book_id']} not found")
+            chapters.append(self.split_text(text))
+
+        segments_total = sum(len(segments) for segments in chapters)
+        segments_done = 0
+        self.store.progress(job['id'], 0, 0, segments_total)
+        for chapters_done, (chapter_id, segments) in enumerate(zip(job['chapter_ids'], chapters), start=1):
+            audio = []
+            for segment in segments:
+                if self._stop.is_set():
+                    raise RuntimeError('worker stopping')
+                audio.append(self.synthesize(segment, job['voice'], job['model'], job['format'])[0])
+                segments_done += 1
+                self.store.progress(job['id'], chapters_done - 1, segments_done, segments_total)
+            if self.store_chapter is not None:
+                self.store_chapter(
+                    job['book_id'], chapter_id, job['voice'], job['model'], segments, audio, job['format']
+                )
+            self.store.progress(job['id'], chapters_done, segments_done, segments_total)
@@ -0,0 +1,222 @@
+"""
+Chat prompts laid out for upstream prefix caching.
+
+Providers cache the longest prompt prefix they have seen recently, so
+every message that doesn't change between calls goes first: the static
+instructions (prompts without {user_input}), then the chapter block, then
+the reader's question. Two questions about the same chapter then share
+everything up to the question. The chapter block is rendered and its
+tokens counted once per chapter hash and reused while it stays the same
+text (the whole chapter, or CONTEXT_MODE=full); excerpts picked per
+question are rendered each time.
+
+Tokens are counted locally, with tiktoken when it is installed and a
+characters-per-token estimate otherwise. A prompt over the token budget is
+brought under it by sending fewer chapter excerpts; if the instructions
+and question alone exceed it, PromptTooLargeError is raised before any
+upstream call is made.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from context_selection import estimate_tokens
+from prompt_store import USER_INPUT_PLACEHOLDER
+
+# Per-message framing tokens in the chat format, plus the reply primer
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMER_TOKENS = 3
+
+SELECTION_INSTRUCTIONS = """You are helping to identify the most relevant text snippet from a chapter that relates to a user's question and an AI assistant's response.
+
+You will be given the chapter content, then the user's question and the AI assistant's response. Your task is to find the most relevant text snippet from the chapter content that directly relates to both the user's question and the AI assistant's response. This text will be highlighted to show the connection.
+
+Rules:
+1. Select a continuous text snippet (not multiple separate pieces)
+2. The snippet should be between 10-200 words
+3. It should be the EXACT text as it appears in the chapter (maintain exact spelling, punctuation, and capitalization)
+4. Choose text that most directly relates to what the user asked about and what the AI responded about
+5. If multiple snippets are relevant, choose the most significant one
+6. Respond with ONLY the selected text snippet, no additional commentary or quotation marks"""
+
+
+class PromptTooLargeError(ValueError):
+    """Raised when a prompt can't be brought under the token budget"""
+
+
+class TokenCounter:
+    """Counts tokens with the model's tiktoken encoding, or estimates them"""
+
+    def __init__(self, model=None):
+        self.encoding = None
+        try:
+            import tiktoken
+            try:
+                self.encoding = tiktoken.encoding_for_model(model or '')
+            except KeyError:
+                self.encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            # Not installed, or the encoding couldn't be loaded (e.g. offline)
+            self.encoding = None
+
+    @property
+    def exact(self):
+        return self.encoding is not None
+
+    def count(self, text):
+        if self.encoding is None:
+            return estimate_tokens(text)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def count_messages(self, messages):
+        return sum(self.count(m['content']) + MESSAGE_OVERHEAD_TOKENS for m in messages) + REPLY_PRIMER_TOKENS
+
+
+class PromptBuilder:
+    """Builds Aristo and text-selection messages with stable prefixes and a token budget"""
+
+    def __init__(self, selector, token_budget=8000, model=None, max_blocks=256):
+        self.selector = selector
+        self.token_budget = token_budget
+        self.counter = TokenCounter(model)
+        self.max_blocks = max_blocks
+        self._blocks = OrderedDict()  # (kind, chapter hash, ...) -> (text, tokens)
+        self._lock = threading.Lock()
+        self.block_hits = 0
+        self.block_misses = 0
+        self.trimmed_to_budget = 0
+
+    def _cached_block(self, key, render):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.block_hits += 1
+                return block
+            self.block_misses += 1
+        text = render()
+        block = (text, self.counter.count(text))
+        with self._lock:
+            self._blocks[key] = block
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return block
+
+    def _chapter_block(self, key, content, query, context_mode, content_key, available, render):
+        """(message text, tokens) for the chapter, shrunk to fit available tokens; None if nothing fits"""
+        excerpt, trimmed = self.selector.select(content, query, mode=context_mode, content_key=content_key)
+        if trimmed or not content_key:
+            text = render(excerpt, trimmed)
+            block = (text, self.counter.count(text))
+        else:
+            block = self._cached_block(key, lambda: render(excerpt, False))
+        if block[1] + MESSAGE_OVERHEAD_TOKENS <= available:
+            return block
+
+        # Over budget: keep only the excerpts that fit what the rest of the prompt leaves
+        header_tokens = self.counter.count(render('', True)) + MESSAGE_OVERHEAD_TOKENS
+        excerpt_budget = available - header_tokens
+        if excerpt_budget <= 0:
+            return None
+        with self._lock:
+            self.trimmed_to_budget += 1
+        excerpt, _ = self.selector.select(
+            content, query, mode='passages', content_key=content_key, token_budget=excerpt_budget
+        )
+        text = render(excerpt, True)
+        tokens = self.counter.count(text)
+        while tokens + MESSAGE_OVERHEAD_TOKENS > available and excerpt:
+            # The selector's estimate and the counted tokens disagree; drop the overflow from the end
+            excess = tokens + MESSAGE_OVERHEAD_TOKENS - available
+            excerpt = excerpt[:-(excess * 4 + 1)]
+            text = render(excerpt, True)
+            tokens = self.counter.count(text)
+        return text, tokens
+
+    def _fixed_tokens(self, messages):
+        tokens = self.counter.count_messages(messages)
+        if tokens > self.token_budget:
+            raise PromptTooLargeError(
+                f"Prompt needs {tokens} tokens without the chapter, over the budget of {self.token_budget}"
+            )
+        return tokens
+
+    def aristo_messages(self, standard_prompts, user_input, chapter_context, context_mode=None):
+        """System and static prompts, then the chapter block, then the prompts carrying the question"""
+        static = []
+        questions = []
+        for prompt in standard_prompts:
+            if USER_INPUT_PLACEHOLDER in prompt.content:
+                questions.append({'role': prompt.role, 'content': prompt.render(user_input)})
+            else:
+                static.append({'role': prompt.role, 'content': prompt.content})
+        # System messages lead even if prompts.json lists a user prompt first
+        static.sort(key=lambda m: m['role'] != 'system')
+        fixed_tokens = self._fixed_tokens(static + questions)
+
+        messages = static
+        if chapter_context:
+            def render(text, trimmed):
+                label = 'Relevant Chapter Excerpts' if trimmed else 'Chapter Content'
+                return (
+                    f"CURRENT READING CONTEXT:\n"
+                    f"Chapter {chapter_context['chapterNumber']}: {chapter_context['title']}\n\n"
+                    f"{label}:\n{text}"
+                )
+
+            content_key = chapter_context.get('contentHash')
+            block = self._chapter_block(
+                ('aristo', content_key, chapter_context['chapterNumber'], chapter_context['title']),
+                chapter_context['content'], user_input, context_mode, content_key,
+                self.token_budget - fixed_tokens, render
+            )
+            if block:
+                messages = messages + [{'role': 'user', 'content': block[0]}]
+        return messages + questions
+
+    def selection_messages(self, user_question, aristo_response, chapter_content, context_mode=None, chapter_hash=None):
+        """Selection rules, then the chapter, then the exchange to find a snippet for"""
+        instructions = {'role': 'system', 'content': SELECTION_INSTRUCTIONS}
+        exchange = {
+            'role': 'user',
+            'content': (
+                f"USER'S QUESTION: {user_question}\n\n"
+                f"AI ASSISTANT'S RESPONSE: {aristo_response}\n\n"
+                f"Selected text snippet:"
+            )
+        }
+
+        def render(text, trimmed):
+            return f"CHAPTER CONTENT:\n{text}"
+
+        fixed_tokens = self._fixed_tokens([instructions, exchange])
+        block = self._chapter_block(
+            ('selection', chapter_hash),
+            chapter_content, f"{user_question} {aristo_response}", context_mode, chapter_hash,
+            self.token_budget - fixed_tokens, render
+        )
+        messages = [instructions]
+        if block:
+            messages.append({'role': 'user', 'content': block[0]})
+        return messages + [exchange]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'chapter_blocks': len(self._blocks),
+                'block_hits': self.block_hits,
+                'block_misses': self.block_misses,
+                'trimmed_to_budget': self.trimmed_to_budget,
+                'token_budget': self.token_budget,
+                'exact_token_counts': self.counter.exact,
+            }
+
+
+def create_default_builder(selector):
+    return PromptBuilder(
+        selector,
+        token_budget=int(os.getenv('PROMPT_TOKEN_BUDGET', '8000')),
+        model=os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
+        max_blocks=int(os.getenv('PROMPT_BLOCK_CACHE_ENTRIES', '256'))
+    )
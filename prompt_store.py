@@ -0,0 +1,140 @@
+"""
+Prompt templates loaded once from prompts.json and hot-reloaded on change.
+
+The file is parsed and validated into an immutable snapshot at startup.
+Requests read that snapshot directly; the file's mtime is only re-checked
+every few seconds, and a new snapshot replaces the old one only if it
+parses and validates completely. A broken edit leaves the last good
+version serving.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+VALID_ROLES = ('system', 'user')
+USER_INPUT_PLACEHOLDER = '{user_input}'
+
+
+class PromptConfigError(Exception):
+    """Raised when prompts.json is missing or malformed"""
+
+
+class PromptsNotFoundError(PromptConfigError):
+    """Raised when prompts.json does not exist"""
+
+
+class CompiledPrompt(namedtuple('CompiledPrompt', ['role', 'content', 'parts'])):
+    """A prompt message with its template pre-split around {user_input}"""
+
+    __slots__ = ()
+
+    def render(self, user_input):
+        return user_input.join(self.parts)
+
+
+def compile_prompts(prompts_data):
+    """Validate parsed prompts.json data and return a tuple of CompiledPrompt"""
+    if not isinstance(prompts_data, dict) or not isinstance(prompts_data.get('standard_prompts'), list):
+        raise PromptConfigError("'standard_prompts' must be a list")
+
+    compiled = []
+    for i, prompt in enumerate(prompts_data['standard_prompts']):
+        if not isinstance(prompt, dict):
+            raise PromptConfigError(f"standard_prompts[{i}] must be an object")
+        role = prompt.get('role')
+        content = prompt.get('content')
+        if role not in VALID_ROLES:
+            raise PromptConfigError(f"standard_prompts[{i}] has invalid role {role!r}")
+        if not isinstance(content, str):
+            raise PromptConfigError(f"standard_prompts[{i}] content must be a string")
+        compiled.append(CompiledPrompt(role, content, tuple(content.split(USER_INPUT_PLACEHOLDER))))
+
+    if not compiled:
+        raise PromptConfigError("'standard_prompts' is empty")
+    return tuple(compiled)
+
+
+class PromptStore:
+    """Holds the current compiled prompts and reloads them when the file changes"""
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.version = 0
+
+        self._prompts = None
+        self._error = None
+        self._loaded_mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+        try:
+            self.reload()
+        except PromptConfigError as e:
+            logger.error("Prompts not loaded from %s: %s", self.path, e)
+
+    def get(self):
+        """Return the current tuple of CompiledPrompt, raising PromptConfigError if none ever loaded"""
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._reload_if_changed()
+
+        prompts = self._prompts
+        if prompts is None:
+            raise self._error or PromptConfigError('Prompts not loaded')
+        return prompts
+
+    def request_reload(self):
+        """Make the next get() re-read the file; safe to call from a signal handler"""
+        self._loaded_mtime = None
+        self._next_check = 0.0
+
+    def reload(self):
+        """Force a reload; on failure the previous prompts stay active and the error is raised"""
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                self._error = PromptsNotFoundError(f"{self.path} not found")
+                raise self._error
+            self._load(mtime)
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return  # keep serving the last good prompts
+        if mtime == self._loaded_mtime:
+            return
+        with self._lock:
+            if mtime == self._loaded_mtime:
+                return
+            try:
+                self._load(mtime)
+            except PromptConfigError as e:
+                logger.warning("Rejected prompts update from %s: %s", self.path, e)
+
+    def _load(self, mtime):
+        # Remember the mtime even on failure so a bad file isn't re-parsed on every check
+        self._loaded_mtime = mtime
+        try:
+            with open(self.path, 'r') as f:
+                prompts = compile_prompts(json.load(f))
+        except (OSError, ValueError) as e:
+            self._error = PromptConfigError(f"could not read {self.path}: {e}")
+            raise self._error
+        except PromptConfigError as e:
+            self._error = e
+            raise
+
+        self._prompts = prompts
+        self._error = None
+        self.version += 1
+        logger.info("Loaded %d prompts from %s (version %d)", len(prompts), self.path, self.version)
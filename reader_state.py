@@ -0,0 +1,476 @@
+"""
+Server-side reader state: highlights, notes and reading progress.
+
+Opening a chapter used to cost the browser one Supabase round trip per
+kind of data (highlights, notes, progress, then item audio). This store
+answers all of it in one call:
+
+- Connections come from a small pool and are reused across requests, so
+  there is no per-request connect or TLS handshake. SQLite is the default
+  backend (and the local/test stand-in); a postgresql:// URL uses
+  psycopg2 against the same tables.
+- Chapter state (highlights and notes without their audio payloads) and
+  per-book progress are cached in an LRU. Every write invalidates the
+  entries it touches, and a version check keeps a read that raced with a
+  write from caching stale rows.
+- Writes arrive as batches of operations, are coalesced (progress updates
+  for a book collapse to one upsert, updates to one row merge, a row
+  created and deleted in the same batch is never written) and are applied
+  in a single transaction. Creates are idempotent, so a client can
+  retry a batch whose response it never saw.
+"""
+
+import contextlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+HIGHLIGHT_COLUMNS = (
+    'id', 'book_id', 'chapter_id', 'selected_text', 'highlight_type', 'title', 'content',
+    'created_at', 'updated_at', 'audio_voice', 'audio_model', 'audio_generated_at',
+)
+NOTE_COLUMNS = (
+    'id', 'book_id', 'chapter_id', 'selected_text', 'note_content', 'note_position',
+    'created_at', 'updated_at', 'audio_voice', 'audio_model', 'audio_generated_at',
+)
+PROGRESS_COLUMNS = (
+    'book_id', 'current_chapter_id', 'current_chapter_number', 'progress_percentage',
+    'reading_settings', 'last_read_at',
+)
+JSON_COLUMNS = frozenset({'note_position', 'reading_settings'})
+
+# Item kinds accepted in write batches -> (table, writable columns)
+ITEM_TABLES = {
+    'highlight': ('highlights', frozenset(HIGHLIGHT_COLUMNS[1:]) | {'audio_data'}),
+    'note': ('notes', frozenset(NOTE_COLUMNS[1:]) | {'audio_data'}),
+}
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS highlights (
+        id TEXT PRIMARY KEY,
+        book_id TEXT NOT NULL,
+        chapter_id TEXT NOT NULL,
+        selected_text TEXT,
+        highlight_type TEXT,
+        title TEXT,
+        content TEXT,
+        created_at TEXT,
+        updated_at TEXT,
+        audio_data TEXT,
+        audio_voice TEXT,
+        audio_model TEXT,
+        audio_generated_at TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_highlights_chapter ON highlights (book_id, chapter_id)",
+    """CREATE TABLE IF NOT EXISTS notes (
+        id TEXT PRIMARY KEY,
+        book_id TEXT NOT NULL,
+        chapter_id TEXT NOT NULL,
+        selected_text TEXT,
+        note_content TEXT,
+        note_position TEXT,
+        created_at TEXT,
+        updated_at TEXT,
+        audio_data TEXT,
+        audio_voice TEXT,
+        audio_model TEXT,
+        audio_generated_at TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_notes_chapter ON notes (book_id, chapter_id)",
+    """CREATE TABLE IF NOT EXISTS reading_progress (
+        book_id TEXT PRIMARY KEY,
+        current_chapter_id TEXT,
+        current_chapter_number INTEGER,
+        progress_percentage REAL,
+        reading_settings TEXT,
+        last_read_at TEXT
+    )""",
+)
+
+
+class ReaderStateError(ValueError):
+    """A write batch contained an invalid operation"""
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ConnectionPool:
+    """Fixed-size pool of DB-API connections, opened lazily and kept open between requests"""
+
+    def __init__(self, connect, size=4, timeout=10.0):
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.timeout = timeout
+        self.opened = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection for one transaction: committed on success, rolled back on error"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError('No database connection available')
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+                self.opened += 1
+            yield conn
+            conn.commit()
+        except BaseException:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    # A broken connection is dropped rather than returned to the pool
+                    conn, broken = None, conn
+                    with contextlib.suppress(Exception):
+                        broken.close()
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put(conn)
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def sqlite_connector(path):
+    def connect():
+        conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    return connect
+
+
+def postgres_connector(dsn):
+    try:
+        import psycopg2
+    except ImportError:
+        raise RuntimeError('READER_STATE_DB is a postgresql:// URL but psycopg2 is not installed')
+
+    def connect():
+        return psycopg2.connect(dsn, keepalives=1, keepalives_idle=60)
+    return connect
+
+
+class ReaderStateStore:
+    """Highlights, notes and reading progress behind a connection pool and a chapter-state cache"""
+
+    def __init__(self, pool, placeholder='?', cache_entries=2048):
+        self.pool = pool
+        self.placeholder = placeholder
+        self.cache_entries = cache_entries
+        self._cache = OrderedDict()  # ('chapter', book, chapter) / ('progress', book) -> value
+        self._version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.ops = 0
+        self.ops_coalesced = 0
+
+    def init_schema(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for statement in SCHEMA:
+                cursor.execute(statement)
+
+    def _sql(self, statement):
+        return statement if self.placeholder == '?' else statement.replace('?', self.placeholder)
+
+    def _query(self, cursor, statement, params=()):
+        cursor.execute(self._sql(statement), params)
+        names = [column[0] for column in cursor.description]
+        return [self._decode(dict(zip(names, row))) for row in cursor.fetchall()]
+
+    def _decode(self, row):
+        for column in JSON_COLUMNS & row.keys():
+            if isinstance(row[column], str):
+                try:
+                    row[column] = json.loads(row[column])
+                except ValueError:
+                    pass
+        return row
+
+    def _encode(self, column, value):
+        if column in JSON_COLUMNS and value is not None and not isinstance(value, str):
+            return json.dumps(value)
+        return value
+
+    # Cache
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return True, self._cache[key], self._version
+            self.misses += 1
+            return False, None, self._version
+
+    def _store(self, key, value, version):
+        with self._lock:
+            if version != self._version:
+                return  # a write landed while we were reading; don't cache what may be stale
+            self._cache[key] = value
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def _invalidate(self, keys):
+        with self._lock:
+            self._version += 1
+            for key in keys:
+                self._cache.pop(key, None)
+
+    # Reads
+
+    def progress(self, book_id):
+        key = ('progress', str(book_id))
+        found, value, version = self._cached(key)
+        if found:
+            return value
+        with self.pool.connection() as conn:
+            rows = self._query(
+                conn.cursor(),
+                f"SELECT {', '.join(PROGRESS_COLUMNS)} FROM reading_progress WHERE book_id = ?",
+                (str(book_id),)
+            )
+        value = rows[0] if rows else None
+        self._store(key, value, version)
+        return value
+
+    def _chapter_items(self, book_id, chapter_id):
+        key = ('chapter', str(book_id), str(chapter_id))
+        found, value, version = self._cached(key)
+        if found:
+            return value
+        params = (str(book_id), str(chapter_id))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            value = {}
+            for kind, columns in (('highlights', HIGHLIGHT_COLUMNS), ('notes', NOTE_COLUMNS)):
+                # Audio payloads stay out of the cache; has_audio says whether one exists
+                value[kind] = self._query(
+                    cursor,
+                    f"SELECT {', '.join(columns)}, audio_data IS NOT NULL AS has_audio FROM {kind} "
+                    "WHERE book_id = ? AND chapter_id = ? ORDER BY created_at",
+                    params
+                )
+                for row in value[kind]:
+                    row['has_audio'] = bool(row['has_audio'])
+        self._store(key, value, version)
+        return value
+
+    def _item_audio(self, table, ids, voice, model):
+        placeholders = ', '.join('?' for _ in ids)
+        with self.pool.connection() as conn:
+            rows = self._query(
+                conn.cursor(),
+                f"SELECT id, audio_data FROM {table} WHERE id IN ({placeholders}) "
+                "AND audio_voice = ? AND audio_model = ?",
+                (*ids, voice, model)
+            )
+        return {row['id']: row['audio_data'] for row in rows}
+
+    def chapter_state(self, book_id, chapter_id=None, voice=None, model=None):
+        """
+        Progress for the book plus, when chapter_id is given, the chapter's
+        highlights and notes. With voice and model, items whose stored audio
+        matches them carry it in audio_data.
+        """
+        state = {'book_id': book_id, 'chapter_id': chapter_id, 'progress': self.progress(book_id)}
+        if chapter_id is None:
+            return state
+        items = self._chapter_items(book_id, chapter_id)
+        for kind, table in (('highlights', 'highlights'), ('notes', 'notes')):
+            rows = [dict(row) for row in items[kind]]
+            if voice and model:
+                ids = [row['id'] for row in rows
+                       if row['has_audio'] and row['audio_voice'] == voice and row['audio_model'] == model]
+                audio = self._item_audio(table, ids, voice, model) if ids else {}
+                for row in rows:
+                    if row['id'] in audio:
+                        row['audio_data'] = audio[row['id']]
+            state[kind] = rows
+        return state
+
+    # Writes
+
+    def _coalesce(self, ops):
+        """
+        Validate and merge a batch. Returns (writes, slots): writes is the
+        ordered list of merged operations, slots maps each input op to the
+        write whose result it receives.
+        """
+        writes = []
+        by_item = {}      # (kind, id) -> write
+        by_progress = {}  # book_id -> write
+        slots = []
+        for index, op in enumerate(ops):
+            if not isinstance(op, dict):
+                raise ReaderStateError(f"Operation {index} is not an object")
+            kind, action, data = op.get('type'), op.get('action'), op.get('data') or {}
+            if not isinstance(data, dict):
+                raise ReaderStateError(f"Operation {index}: data must be an object")
+
+            if kind == 'progress':
+                book_id = op.get('book_id') or data.get('book_id')
+                if not book_id or action not in (None, 'update'):
+                    raise ReaderStateError(f"Operation {index}: progress updates need a book_id")
+                unknown = set(data) - set(PROGRESS_COLUMNS)
+                if unknown:
+                    raise ReaderStateError(f"Operation {index}: unknown fields {sorted(unknown)}")
+                write = by_progress.get(str(book_id))
+                if write is None:
+                    write = by_progress[str(book_id)] = {'type': 'progress', 'book_id': str(book_id), 'data': {}}
+                    writes.append(write)
+                else:
+                    self.ops_coalesced += 1
+                write['data'].update(data)
+                slots.append(write)
+                continue
+
+            if kind not in ITEM_TABLES or action not in ('create', 'update', 'delete'):
+                raise ReaderStateError(f"Operation {index}: unsupported operation {kind!r}/{action!r}")
+            unknown = set(data) - ITEM_TABLES[kind][1] - {'id'}
+            if unknown:
+                raise ReaderStateError(f"Operation {index}: unknown fields {sorted(unknown)}")
+
+            if action == 'create':
+                item_id = str(data.get('id') or op.get('id') or uuid.uuid4())
+                if not data.get('book_id') or data.get('chapter_id') is None:
+                    raise ReaderStateError(f"Operation {index}: {kind} needs book_id and chapter_id")
+                write = {'type': kind, 'action': 'create', 'id': item_id, 'data': dict(data, id=item_id)}
+                by_item[(kind, item_id)] = write
+                writes.append(write)
+                slots.append(write)
+                continue
+
+            item_id = op.get('id')
+            if not item_id:
+                raise ReaderStateError(f"Operation {index}: {action} needs an id")
+            item_id = str(item_id)
+            pending = by_item.get((kind, item_id))
+            if pending is not None and pending['action'] != 'delete':
+                self.ops_coalesced += 1
+                if action == 'update':
+                    pending['data'].update(data)
+                elif pending['action'] == 'create':
+                    pending['action'] = 'skip'  # created and deleted in one batch: never written
+                else:
+                    pending['action'], pending['data'] = 'delete', {}
+                slots.append(pending)
+                continue
+            write = {'type': kind, 'action': action, 'id': item_id, 'data': dict(data)}
+            by_item[(kind, item_id)] = write
+            writes.append(write)
+            slots.append(write)
+        return writes, slots
+
+    def apply(self, ops):
+        """Apply a batch of write operations in one transaction; returns one result per op"""
+        writes, slots = self._coalesce(ops)
+        touched = set()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for write in writes:
+                write['result'] = self._apply_one(cursor, write, touched)
+        self._invalidate(touched)
+        with self._lock:
+            self.batches += 1
+            self.ops += len(ops)
+        return [slot.get('result') for slot in slots]
+
+    def _apply_one(self, cursor, write, touched):
+        now = _now()
+        if write['type'] == 'progress':
+            data = dict(write['data'], book_id=write['book_id'], last_read_at=now)
+            columns = list(data)
+            updates = ', '.join(f"{column} = excluded.{column}" for column in columns if column != 'book_id')
+            cursor.execute(self._sql(
+                f"INSERT INTO reading_progress ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+                f"ON CONFLICT (book_id) DO UPDATE SET {updates}"
+            ), [self._encode(column, data[column]) for column in columns])
+            touched.add(('progress', write['book_id']))
+            rows = self._query(
+                cursor, f"SELECT {', '.join(PROGRESS_COLUMNS)} FROM reading_progress WHERE book_id = ?",
+                (write['book_id'],)
+            )
+            return rows[0] if rows else None
+
+        table, _ = ITEM_TABLES[write['type']]
+        columns = HIGHLIGHT_COLUMNS if table == 'highlights' else NOTE_COLUMNS
+        action = write['action']
+        if action == 'skip':
+            return None
+
+        if action == 'create':
+            data = dict(write['data'], created_at=write['data'].get('created_at') or now, updated_at=now)
+            data['book_id'], data['chapter_id'] = str(data['book_id']), str(data['chapter_id'])
+            names = list(data)
+            # A retried batch re-creates the same client id; keep the stored row and return it
+            cursor.execute(self._sql(
+                f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)}) "
+                "ON CONFLICT (id) DO NOTHING"
+            ), [self._encode(name, data[name]) for name in names])
+        else:
+            existing = self._query(cursor, f"SELECT book_id, chapter_id FROM {table} WHERE id = ?", (write['id'],))
+            if not existing:
+                return None
+            touched.add(('chapter', str(existing[0]['book_id']), str(existing[0]['chapter_id'])))
+            if action == 'delete':
+                cursor.execute(self._sql(f"DELETE FROM {table} WHERE id = ?"), (write['id'],))
+                return None
+            data = {name: value for name, value in write['data'].items() if name != 'id'}
+            data['updated_at'] = now
+            if 'audio_data' in data and 'audio_generated_at' not in data:
+                data['audio_generated_at'] = now if data['audio_data'] is not None else None
+            cursor.execute(self._sql(
+                f"UPDATE {table} SET {', '.join(f'{name} = ?' for name in data)} WHERE id = ?"
+            ), [self._encode(name, value) for name, value in data.items()] + [write['id']])
+
+        row = self._query(cursor, f"SELECT {', '.join(columns)} FROM {table} WHERE id = ?", (write['id'],))[0]
+        touched.add(('chapter', str(row['book_id']), str(row['chapter_id'])))
+        return row
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'batches': self.batches,
+                'ops': self.ops,
+                'ops_coalesced': self.ops_coalesced,
+                'connections_opened': self.pool.opened,
+            }
+
+
+def create_default_store():
+    """Store configured by READER_STATE_DB (a SQLite path or postgresql:// URL); None when unset"""
+    url = os.getenv('READER_STATE_DB', '')
+    if not url:
+        return None
+    size = int(os.getenv('READER_STATE_POOL_SIZE', '4'))
+    if url.startswith(('postgres://', 'postgresql://')):
+        store = ReaderStateStore(ConnectionPool(postgres_connector(url), size), placeholder='%s')
+    else:
+        path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else url
+        store = ReaderStateStore(ConnectionPool(sqlite_connector(path), size))
+    store.init_schema()
+    return store
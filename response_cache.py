@@ -0,0 +1,103 @@
+"""
+TTL + LRU cache for Aristo chat answers.
+
+Readers ask near-identical questions about the same chapter, so answers are
+cached under a key built from the normalised question, a hash of the chapter
+(never the chapter text itself), the prompt version and the sampling
+parameters. Entries expire after a TTL and the least recently used entry is
+evicted once the cache is full.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_question(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return _WHITESPACE_RE.sub(' ', text).strip().lower().rstrip('?!. ')
+
+
+def make_response_key(*parts):
+    """Hash the given key parts (None and numbers allowed) into a cache key"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU mapping of key -> value with per-entry expiry"""
+
+    def __init__(self, max_entries=2048, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.bypasses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'bypasses': self.bypasses,
+            }
+
+
+def create_default_cache():
+    return ResponseCache(
+        max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '2048')),
+        ttl_seconds=float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+    )
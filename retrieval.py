@@ -0,0 +1,267 @@
+"""
+Local relevance retrieval over chapter text.
+
+Each chapter is split into sentences once, tokenized and stemmed, and
+indexed into an inverted postings list with cached BM25 statistics.
+Indexes are kept in a small LRU keyed by a hash of the chapter text, so
+repeated questions against the same chapter only pay for scoring.
+"""
+
+import hashlib
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
+    'what', 'how', 'why', 'when', 'where', 'who', 'is', 'are', 'was', 'were', 'be', 'been',
+    'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should',
+    'can', 'may', 'might', 'this', 'that', 'these', 'those', 'it', 'its', 'i', 'me', 'my',
+    'you', 'your', 'we', 'our', 'they', 'them', 'their', 'he', 'she', 'his', 'her', 'as',
+    'from', 'so', 'not', 'no', 'if', 'then', 'than', 'there', 'about', 'into', 'which',
+})
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# A sentence runs to terminal punctuation or a blank line, whichever comes first
+_SENTENCE_RE = re.compile(r'[^.!?\n]+(?:\n(?!\n)[^.!?\n]*)*')
+
+# Porter step 2/3 style derivational suffixes, applied after plurals and
+# -ed/-ing are gone (so "-ly" has already become "-li"). Longest first.
+_SUFFIXES = (
+    ('ational', 'ate'), ('fulness', 'ful'), ('iveness', 'ive'), ('ization', 'ize'),
+    ('ousness', 'ous'), ('tional', 'tion'), ('biliti', 'ble'), ('ation', 'ate'),
+    ('iviti', 'ive'), ('aliti', 'al'), ('ousli', 'ous'), ('fulli', 'ful'),
+    ('entli', 'ent'), ('alli', 'al'), ('abli', 'able'), ('ment', ''), ('ness', ''),
+)
+# "-li" is only an adverb ending after these letters (Snowball), so "reply" keeps it
+_LI_ENDINGS = frozenset('cdeghkmnrt')
+
+
+def _is_consonant(word, i):
+    if word[i] in 'aeiou':
+        return False
+    if word[i] == 'y':
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+
+def _measure(word):
+    """Porter's m: the number of vowel-consonant sequences in word"""
+    m = 0
+    previous_vowel = False
+    for i in range(len(word)):
+        consonant = _is_consonant(word, i)
+        if consonant and previous_vowel:
+            m += 1
+        previous_vowel = not consonant
+    return m
+
+
+def _has_vowel(word):
+    return any(not _is_consonant(word, i) for i in range(len(word)))
+
+
+def _ends_cvc(word):
+    """Consonant-vowel-consonant ending, the last not w, x or y (e.g. "hop", "mak")"""
+    return (
+        len(word) >= 3 and _is_consonant(word, len(word) - 3) and not _is_consonant(word, len(word) - 2)
+        and _is_consonant(word, len(word) - 1) and word[-1] not in 'wxy'
+    )
+
+
+def stem(word):
+    """Light Porter-style stemmer (steps 1a-1c, part of 2/3, and 5a; no dictionary)
+
+    Inflected forms reduce to the same stem as the base word:
+
+    >>> [stem(w) for w in ('plate', 'plates', 'house', 'houses', 'page', 'pages')]
+    ['plate', 'plate', 'hous', 'hous', 'page', 'page']
+    >>> [stem(w) for w in ('quote', 'quoted', 'make', 'making', 'hop', 'hopped')]
+    ['quot', 'quot', 'make', 'make', 'hop', 'hop']
+    >>> [stem(w) for w in ('reply', 'replies', 'replied', 'city', 'cities', 'quickly')]
+    ['repli', 'repli', 'repli', 'citi', 'citi', 'quick']
+    """
+    if len(word) <= 2:
+        return word
+    if word.endswith("'s"):
+        word = word[:-2]
+
+    # Step 1a: plurals
+    if word.endswith('sses'):
+        word = word[:-2]
+    elif word.endswith('ies'):
+        word = word[:-1] if len(word) <= 4 else word[:-2]
+    elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')) and _has_vowel(word[:-2]):
+        word = word[:-1]
+
+    # Step 1b: -eed, -ed, -ing (and their adverbs), restoring the e they may have eaten
+    if word.endswith('eed'):
+        if _measure(word[:-3]) > 0:
+            word = word[:-1]
+    else:
+        for suffix in ('ingly', 'edly', 'ing', 'ed'):
+            if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]):
+                word = word[:-len(suffix)]
+                if word.endswith(('at', 'bl', 'iz')):
+                    word += 'e'
+                elif len(word) > 1 and word[-1] == word[-2] and word[-1] not in 'aeioulsz':
+                    # Undouble consonants (e.g. "running" -> "run")
+                    word = word[:-1]
+                elif _measure(word) == 1 and _ends_cvc(word):
+                    word += 'e'
+                break
+
+    # Step 1c: a final y after a consonant reads as i ("reply", "replied" -> "repli")
+    if len(word) > 2 and word.endswith('y') and _is_consonant(word, len(word) - 2):
+        word = word[:-1] + 'i'
+
+    # Steps 2/3: derivational suffixes
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix):
+            if _measure(word[:-len(suffix)]) > 0:
+                word = word[:-len(suffix)] + replacement
+            break
+    else:
+        if word.endswith('li') and len(word) > 4 and word[-3] in _LI_ENDINGS and _measure(word[:-2]) > 0:
+            word = word[:-2]
+
+    # Step 5a: drop a final e unless the word would end consonant-vowel-consonant
+    if word.endswith('e'):
+        m = _measure(word[:-1])
+        if m > 1 or (m == 1 and not _ends_cvc(word[:-1])):
+            word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Lowercase, drop stop words and stem; returns a list of terms"""
+    return [stem(tok) for tok in _TOKEN_RE.findall(text.lower()) if tok not in STOP_WORDS and len(tok) > 1]
+
+
+def split_sentences(text):
+    """Return (start, end) character spans of the sentences in text, whitespace-trimmed"""
+    spans = []
+    for match in _SENTENCE_RE.finditer(text):
+        start, end = match.span()
+        segment = text[start:end]
+        stripped = segment.strip()
+        if not stripped:
+            continue
+        start += len(segment) - len(segment.lstrip())
+        spans.append((start, start + len(stripped)))
+    return spans
+
+
+class BM25Index:
+    """Inverted index over a list of texts with Okapi BM25 scoring"""
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(texts)
+        self.doc_lengths = []
+        self.postings = {}
+
+        for doc_id, text in enumerate(texts):
+            terms = tokenize(text)
+            self.doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+
+        total = sum(self.doc_lengths)
+        self.avg_doc_length = total / self.doc_count if self.doc_count else 0.0
+        self.idf = {
+            term: math.log(1 + (self.doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+        # Per-document length normalisation is query-independent, so precompute it
+        avg = self.avg_doc_length or 1.0
+        self._norms = [k1 * (1 - b + b * length / avg) for length in self.doc_lengths]
+
+    def score(self, query_terms):
+        """Return {doc_id: score} for documents matching any of query_terms"""
+        scores = {}
+        k1 = self.k1
+        norms = self._norms
+        for term in set(query_terms):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in posting:
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norms[doc_id])
+        return scores
+
+    def search(self, query, top_k=5, allowed=None):
+        """Return up to top_k (doc_id, score) pairs, best first"""
+        scores = self.score(tokenize(query))
+        ranked = [
+            (doc_id, score) for doc_id, score in scores.items()
+            if score > 0 and (allowed is None or allowed[doc_id])
+        ]
+        ranked.sort(key=lambda item: (-item[1], item[0]))
+        return ranked[:top_k]
+
+
+class ChapterIndex:
+    """Sentence-level BM25 index of one chapter"""
+
+    # Very short fragments ("Yes", headings) make poor highlights
+    MIN_SENTENCE_CHARS = 20
+
+    def __init__(self, content):
+        self.content = content
+        self.spans = split_sentences(content)
+        self.index = BM25Index([content[start:end] for start, end in self.spans])
+        self._eligible = [end - start >= self.MIN_SENTENCE_CHARS for start, end in self.spans]
+
+    def search(self, query, top_k=5):
+        """Return up to top_k dicts with text, start, end and score"""
+        return [
+            {
+                'text': self.content[self.spans[doc_id][0]:self.spans[doc_id][1]],
+                'start': self.spans[doc_id][0],
+                'end': self.spans[doc_id][1],
+                'score': score,
+            }
+            for doc_id, score in self.index.search(query, top_k, allowed=self._eligible)
+        ]
+
+    def best_match(self, query):
+        results = self.search(query, top_k=1)
+        return results[0] if results else None
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class IndexCache:
+    """Small thread-safe LRU of per-chapter indexes keyed by chapter text hash"""
+
+    def __init__(self, factory=None, max_entries=64):
+        self.factory = factory or ChapterIndex
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, content, key=None):
+        """Index for content; pass key (its content_hash) when the caller already has it"""
+        key = key or content_hash(content)
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None:
+                self._entries.move_to_end(key)
+                return index
+
+        # Build outside the lock; a concurrent duplicate build is harmless
+        index = self.factory(content)
+        with self._lock:
+            self._entries[key] = index
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+
+chapter_indexes = IndexCache()
@@ -0,0 +1,99 @@
+"""
+Request coalescing ("single-flight") for identical upstream calls.
+
+When many readers ask for the same audio or selection at the same moment,
+only the first caller for a key runs the upstream call; everyone else
+arriving while it is in flight waits for that result (or exception)
+instead of issuing a duplicate request. Keys are the same content hashes
+the caches use, so once the flight lands the cache serves later callers.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Thread-based single-flight group for the Flask (WSGI) handlers"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) once per in-flight key; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._calls), 'leaders': self.leaders, 'coalesced': self.coalesced}
+
+
+class AsyncSingleFlight:
+    """asyncio single-flight group for the ASGI handlers"""
+
+    def __init__(self):
+        self._tasks = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        """Await coro_fn(*args, **kwargs) once per in-flight key; returns (result, shared)"""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        # Shield so one caller disconnecting doesn't cancel the flight for the rest
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the exception retrieved even if every awaiting caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {'in_flight': len(self._tasks), 'leaders': self.leaders, 'coalesced': self.coalesced}
@@ -0,0 +1,174 @@
+"""
+Locate an LLM-quoted snippet inside the chapter it was taken from.
+
+Models often quote text with small changes (curly vs straight quotes,
+collapsed whitespace, a dropped or altered word). Rather than comparing the
+snippet against every sentence, both texts are normalised to lowercase word
+tokens, word 3-gram hashes are used to find the diagonal where the snippet
+lines up with the chapter, and a banded alignment around that diagonal
+recovers the exact chapter span. The result is a pair of character offsets
+into the original chapter, which may cover several sentences.
+"""
+
+import re
+from collections import Counter
+
+from retrieval import IndexCache
+
+_WORD_RE = re.compile(r'\w+')
+_TRAILING_PUNCTUATION = '.!?"\'”’)'
+
+SHINGLE_SIZE = 3
+MATCH, MISMATCH, GAP = 2, -1, -1
+# Fraction of snippet words that must align for a fuzzy span to be accepted
+MIN_COVERAGE = 0.6
+
+
+def word_tokens(text):
+    """Return (words, spans): lowercase word tokens and their character spans"""
+    words = []
+    spans = []
+    for match in _WORD_RE.finditer(text):
+        words.append(match.group().lower())
+        spans.append(match.span())
+    return words, spans
+
+
+def _shingles(words, size):
+    return [hash(tuple(words[i:i + size])) for i in range(len(words) - size + 1)]
+
+
+class ChapterTokens:
+    """Word tokens of a chapter plus a shingle-hash -> positions lookup"""
+
+    def __init__(self, content):
+        self.content = content
+        self.words, self.spans = word_tokens(content)
+        self._positions = {}
+        for size in (1, SHINGLE_SIZE):
+            positions = {}
+            for i, h in enumerate(_shingles(self.words, size)):
+                positions.setdefault(h, []).append(i)
+            self._positions[size] = positions
+
+    def positions(self, shingle_hash, size):
+        return self._positions[size].get(shingle_hash, ())
+
+    def char_span(self, start_token, end_token):
+        """Character (start, end) covering tokens [start_token, end_token), keeping closing punctuation"""
+        start = self.spans[start_token][0]
+        end = self.spans[end_token - 1][1]
+        while end < len(self.content) and self.content[end] in _TRAILING_PUNCTUATION:
+            end += 1
+        return start, end
+
+
+_chapter_tokens = IndexCache(factory=ChapterTokens)
+
+
+def _best_diagonal(chapter, words):
+    """Vote on chapter_offset - snippet_offset for every shared shingle; return the winner"""
+    size = SHINGLE_SIZE if len(words) >= SHINGLE_SIZE else 1
+    votes = Counter()
+    for i, h in enumerate(_shingles(words, size)):
+        for j in chapter.positions(h, size):
+            votes[j - i] += 1
+    if not votes:
+        return None
+    # Most votes wins; ties go to the earliest occurrence
+    return min(votes.items(), key=lambda item: (-item[1], item[0]))[0]
+
+
+def _banded_align(chapter_words, words, diagonal, band):
+    """
+    Semi-global alignment of words against chapter_words restricted to a band
+    around diagonal. The whole snippet must be aligned, but skipping chapter
+    text before and after it is free. Returns (start, end, matches) in chapter
+    token positions, or None.
+    """
+    n = len(chapter_words)
+    m = len(words)
+    width = 2 * band + 1
+    neg = float('-inf')
+
+    # Row i column k corresponds to chapter position j = diagonal + i - band + k
+    score = [[neg] * width for _ in range(m + 1)]
+    move = [[0] * width for _ in range(m + 1)]  # 0 start, 1 diag, 2 up, 3 left
+    for k in range(width):
+        j = diagonal - band + k
+        if 0 <= j <= n:
+            score[0][k] = 0
+
+    for i in range(1, m + 1):
+        row, prev = score[i], score[i - 1]
+        moves = move[i]
+        word = words[i - 1]
+        base = diagonal + i - band
+        for k in range(width):
+            j = base + k
+            if j < 0 or j > n:
+                continue
+            best, how = neg, 0
+            if j > 0 and prev[k] != neg:
+                best = prev[k] + (MATCH if chapter_words[j - 1] == word else MISMATCH)
+                how = 1
+            if k + 1 < width and prev[k + 1] != neg and prev[k + 1] + GAP > best:
+                best, how = prev[k + 1] + GAP, 2
+            if k > 0 and row[k - 1] != neg and row[k - 1] + GAP > best:
+                best, how = row[k - 1] + GAP, 3
+            row[k], moves[k] = best, how
+
+    last = score[m]
+    end_k = max(range(width), key=lambda k: last[k])
+    if last[end_k] == neg:
+        return None
+
+    # Trace back to where the snippet starts, counting exact word matches
+    i, k, matches = m, end_k, 0
+    end = diagonal + m - band + end_k
+    while i > 0:
+        how = move[i][k]
+        j = diagonal + i - band + k
+        if how == 1:
+            if chapter_words[j - 1] == words[i - 1]:
+                matches += 1
+            i -= 1
+        elif how == 2:
+            i -= 1
+            k += 1
+        else:
+            k -= 1
+    start = diagonal + i - band + k
+    return start, end, matches
+
+
+def locate_span(content, snippet):
+    """Return (start, end) character offsets of snippet in content, or None if it isn't there"""
+    snippet = snippet.strip().strip('"“”')
+    if not snippet:
+        return None
+
+    # Fast path: verbatim quote
+    start = content.find(snippet)
+    if start != -1:
+        return start, start + len(snippet)
+
+    words, _ = word_tokens(snippet)
+    if not words:
+        return None
+    chapter = _chapter_tokens.get(content)
+    if not chapter.words:
+        return None
+
+    diagonal = _best_diagonal(chapter, words)
+    if diagonal is None:
+        return None
+
+    band = max(8, len(words) // 5)
+    aligned = _banded_align(chapter.words, words, diagonal, band)
+    if aligned is None:
+        return None
+    start_token, end_token, matches = aligned
+    if end_token <= start_token or matches < MIN_COVERAGE * len(words):
+        return None
+    return chapter.char_span(start_token, end_token)
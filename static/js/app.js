@@ -9,6 +9,7 @@ class BookReader {
         this.chapterHighlights = new Map(); // Cache highlights per chapter
         this.chapterNotes = new Map(); // Cache notes per chapter
         this.audiobookReader = null; // Initialize audiobook reader
+        this.chapterHashes = new WeakMap(); // SHA-256 of each chapter's text, computed once
         this.settings = {
             fontSize: 18,
             lineHeight: 1.6,
@@ -439,11 +440,22 @@ class BookReader {
             this.currentChapterId = chapter.id;
             this.currentChapterNumber = chapterNumber;
 
+            // Highlights and notes arrive together when the server keeps reader state
+            let chapterState = null;
+            try {
+                const audioSettings = this.audiobookReader ? this.audiobookReader.settings : {};
+                chapterState = await DatabaseService.getChapterState(
+                    this.currentBookId, chapter.id, audioSettings.voice, audioSettings.model
+                );
+            } catch (error) {
+                console.error('Error loading chapter state:', error);
+            }
+            
             // Load highlights for this chapter
-            await this.loadChapterHighlights(chapter.id);
+            await this.loadChapterHighlights(chapter.id, chapterState ? chapterState.highlights : null);
             
             // Load notes for this chapter
-            await this.loadChapterNotes(chapter.id);
+            await this.loadChapterNotes(chapter.id, chapterState ? chapterState.notes : null);
 
             // Update content
             const contentDiv = document.getElementById('textContent');
@@ -491,9 +503,9 @@ class BookReader {
         }
     }
 
-    async loadChapterHighlights(chapterId) {
+    async loadChapterHighlights(chapterId, preloaded = null) {
         try {
-            const highlights = await DatabaseService.getHighlights(this.currentBookId, chapterId);
+            const highlights = preloaded || await DatabaseService.getHighlights(this.currentBookId, chapterId);
             console.log('Loading highlights for chapter:', chapterId, highlights);
             
             // Convert highlights array to a map for easy lookup
@@ -1623,10 +1635,10 @@ class BookReader {
         }
     }
     
-    async loadChapterNotes(chapterId) {
+    async loadChapterNotes(chapterId, preloaded = null) {
         try {
             console.log('Loading notes for chapter:', chapterId);
-            const notes = await DatabaseService.getNotes(this.currentBookId, chapterId);
+            const notes = preloaded || await DatabaseService.getNotes(this.currentBookId, chapterId);
             console.log('Raw notes from database:', notes);
             
             // Store notes in cache
@@ -2221,30 +2233,21 @@ class BookReader {
         saveHighlightBtn.style.display = 'none';
         
         try {
-            // Get current chapter content for context
-            let chapterContext = null;
+            // Get current chapter for context
+            let currentChapter = null;
             if (this.currentChapterId && this.book) {
-                const currentChapter = this.book.chapters.find(ch => ch.id === this.currentChapterId);
-                if (currentChapter) {
-                    chapterContext = {
-                        title: currentChapter.title,
-                        content: currentChapter.content,
-                        chapterNumber: this.currentChapterNumber
-                    };
-                }
+                currentChapter = this.book.chapters.find(ch => ch.id === this.currentChapterId) || null;
             }
 
-            // Call the Flask API
-            const response = await fetch('/api/aristo', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    input: userInput,
-                    chapterContext: chapterContext
-                })
-            });
+            // Call the Flask API (the chapter is sent by hash once the server has its text)
+            const response = await this.postWithChapter('/api/aristo', currentChapter, (chapterRef) => ({
+                input: userInput,
+                chapterContext: currentChapter ? {
+                    title: currentChapter.title,
+                    chapterNumber: this.currentChapterNumber,
+                    ...(chapterRef.hash ? { contentHash: chapterRef.hash } : { content: chapterRef.content })
+                } : null
+            }));
             
             const data = await response.json();
             
@@ -2342,9 +2345,10 @@ class BookReader {
             saveHighlightBtn.textContent = 'Finding relevant text...';
             
             // Get current chapter content
+            let currentChapter = null;
             let chapterContent = '';
             if (this.currentChapterId && this.book) {
-                const currentChapter = this.book.chapters.find(ch => ch.id === this.currentChapterId);
+                currentChapter = this.book.chapters.find(ch => ch.id === this.currentChapterId);
                 if (currentChapter) {
                     chapterContent = currentChapter.content;
                     console.log('Chapter content length:', chapterContent.length);
@@ -2363,7 +2367,7 @@ class BookReader {
             
             console.log('Calling AI text selection...');
             // Use AI to find the most relevant text snippet
-            const selectedText = await this.findRelevantTextWithAI(userQuestion, aristoResponse, chapterContent);
+            const selectedText = await this.findRelevantTextWithAI(userQuestion, aristoResponse, currentChapter);
             console.log('AI selected text:', selectedText?.substring(0, 100) + '...');
             
             if (!selectedText) {
@@ -2558,25 +2562,19 @@ class BookReader {
         }
     }
 
-    async findRelevantTextWithAI(userQuestion, aristoResponse, chapterContent) {
+    async findRelevantTextWithAI(userQuestion, aristoResponse, chapter) {
         console.log('=== AI TEXT SELECTION DEBUG START ===');
         console.log('Question length:', userQuestion.length);
         console.log('Response length:', aristoResponse.length);
-        console.log('Chapter content length:', chapterContent.length);
+        console.log('Chapter content length:', chapter.content.length);
         
         try {
             console.log('Making API call to /api/find-relevant-text...');
-            const response = await fetch('/api/find-relevant-text', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    userQuestion,
-                    aristoResponse,
-                    chapterContent
-                })
-            });
+            const response = await this.postWithChapter('/api/find-relevant-text', chapter, (chapterRef) => ({
+                userQuestion,
+                aristoResponse,
+                ...(chapterRef.hash ? { chapterHash: chapterRef.hash } : { chapterContent: chapterRef.content })
+            }));
             
             console.log('API response status:', response.status);
             console.log('API response ok:', response.ok);
@@ -2609,6 +2607,43 @@ class BookReader {
         }
     }
 
+    async chapterContentHash(chapter) {
+        // SHA-256 hex of the chapter text (the server's content hash); null where
+        // SubtleCrypto is unavailable, e.g. pages not served over HTTPS or localhost
+        if (!chapter || !chapter.content || !(window.crypto && window.crypto.subtle)) {
+            return null;
+        }
+        let hash = this.chapterHashes.get(chapter);
+        if (!hash) {
+            const digest = await window.crypto.subtle.digest('SHA-256', new TextEncoder().encode(chapter.content));
+            hash = Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+            this.chapterHashes.set(chapter, hash);
+        }
+        return hash;
+    }
+
+    async postWithChapter(url, chapter, buildBody) {
+        // POST a request that references the chapter by content hash instead of uploading
+        // its text; if the server hasn't seen that text yet (409), resend it in full
+        const post = (body) => fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(body)
+        });
+        
+        const hash = await this.chapterContentHash(chapter);
+        if (hash) {
+            const response = await post(buildBody({ hash }));
+            if (response.status !== 409) {
+                return response;
+            }
+            console.log('Server does not have this chapter yet, sending its text');
+        }
+        return post(buildBody({ content: chapter ? chapter.content : '' }));
+    }
+
     showAristoMenu() {
         // This method is no longer needed since we're opening the modal directly
         // Keeping it for backwards compatibility
@@ -18,9 +18,40 @@ class AudiobookReader {
         this.currentDisplaySegmentIndex = 0; // Track current display segment being highlighted
         this.isGenerating = false;
         this.escapeKeyHandler = null; // For expanded view escape key handling
+        // Opus is a fraction of the size of MP3 for speech; use it wherever the browser can play it
+        this.audioFormat = document.createElement('audio').canPlayType('audio/ogg; codecs=opus') ? 'opus' : 'mp3';
         this.init();
     }
 
+    audioMimeType(format = this.audioFormat) {
+        return { opus: 'audio/ogg', aac: 'audio/aac' }[format] || 'audio/mp3';
+    }
+
+    canPlayFormat(format) {
+        const type = format === 'opus' ? 'audio/ogg; codecs=opus' : this.audioMimeType(format);
+        return document.createElement('audio').canPlayType(type) !== '';
+    }
+
+    // Chapter rows hold bare base64 segments with no format column, so read it from the magic bytes
+    chapterAudioFormat(audioSegments) {
+        const first = audioSegments.find(segment => segment && typeof segment === 'string') || '';
+        if (first.startsWith('T2dnUw')) return 'opus'; // "OggS"
+        if (/^\/\/[E-Hk-n]/.test(first)) return 'aac'; // ADTS sync word
+        return 'mp3';
+    }
+
+    // Another browser may have saved the chapter as Opus, which this one cannot decode
+    isPlayableChapterAudio(chapterAudio) {
+        try {
+            const audioSegments = typeof chapterAudio.audio_data === 'string'
+                ? JSON.parse(chapterAudio.audio_data)
+                : chapterAudio.audio_data;
+            return Array.isArray(audioSegments) && this.canPlayFormat(this.chapterAudioFormat(audioSegments));
+        } catch (error) {
+            return false;
+        }
+    }
+
     init() {
         this.createAudioControls();
         this.loadAudioSettings();
@@ -378,6 +409,7 @@ class AudiobookReader {
         }
 
         const chapterText = textContent.textContent;
+        this.chapterText = chapterText;
         console.log(`📖 Chapter text length:`, chapterText.length);
         console.log(`📖 Chapter text preview:`, chapterText.substring(0, 200) + '...');
 
@@ -453,6 +485,11 @@ class AudiobookReader {
             }
             
             const chapterAudio = await DatabaseService.getChapterAudio(chapterId, this.settings.voice, this.settings.model);
+            if (chapterAudio && chapterAudio.audio_data && !this.isPlayableChapterAudio(chapterAudio)) {
+                console.log(`⚠️ Chapter audio in database is in a format this browser cannot play, regenerating...`);
+                await this.generateAllSegmentAudio(true);
+                return;
+            }
             if (chapterAudio && chapterAudio.audio_data) {
                 console.log(`✅ Found matching chapter audio in database, loading...`);
                 console.log(`✅ Chapter audio details:`, {
@@ -479,6 +516,7 @@ class AudiobookReader {
                     console.log(`🔄 Converting ${audioSegments.length} base64 audio segments to playable format...`);
                     
                     // Convert back to Audio objects with metadata
+                    const mimeType = this.audioMimeType(this.chapterAudioFormat(audioSegments));
                     const audioObjects = [];
                     let validSegmentCount = 0;
                     
@@ -486,7 +524,7 @@ class AudiobookReader {
                         const base64Data = audioSegments[i];
                         if (base64Data && typeof base64Data === 'string') {
                             try {
-                                const blob = this.base64ToBlob(base64Data, 'audio/mp3');
+                                const blob = this.base64ToBlob(base64Data, mimeType);
                                 const audioUrl = URL.createObjectURL(blob);
                                 const audioElement = new Audio(audioUrl);
                                 
@@ -642,18 +680,18 @@ class AudiobookReader {
         const cleanChapterTitle = chapterTitle.replace(/[^a-zA-Z0-9]/g, '-').toLowerCase();
         
         // Create a persistent cache key that will work across sessions
-        const cacheKey = `audio-${cleanBookId}-ch${chapterNumber}-${cleanChapterId}-${cleanChapterTitle}-${this.settings.voice}-${this.settings.model}`.replace(/-+/g, '-');
+        const cacheKey = `audio-${cleanBookId}-ch${chapterNumber}-${cleanChapterId}-${cleanChapterTitle}-${this.settings.voice}-${this.settings.model}-${this.audioFormat}`.replace(/-+/g, '-');
         
         console.log(`🗄️ Generated cache key: ${cacheKey}`);
-        console.log(`🗄️ Based on: bookId=${bookId}, chapterId=${chapterId}, chapterNumber=${chapterNumber}, voice=${this.settings.voice}, model=${this.settings.model}`);
+        console.log(`🗄️ Based on: bookId=${bookId}, chapterId=${chapterId}, chapterNumber=${chapterNumber}, voice=${this.settings.voice}, model=${this.settings.model}, format=${this.audioFormat}`);
         
         return cacheKey;
     }
 
-    async generateAllSegmentAudio() {
+    async generateAllSegmentAudio(replaceUnplayable = false) {
         // Only generate if we don't already have audio
         const chapterId = this.bookReader.currentChapterId;
-        if (chapterId) {
+        if (chapterId && !replaceUnplayable) {
             console.log(`🔍 Final check: Ensuring no audio exists before generating (Chapter ID: ${chapterId})`);
             try {
                 // One final database check before generating
@@ -680,33 +718,48 @@ class AudiobookReader {
             console.log(`🎤 Generating AI audio for ${this.textSegments.length} segments...`);
             console.log(`🎤 Text segments:`, this.textSegments.map(s => s.substring(0, 50) + '...'));
             
+            // Synthesize the chapter in one request; the server segments it and fans out in parallel
+            const segmentResults = await this.generateChapterSegmentAudio(this.chapterText);
+            
+            // Adopt the server's segmentation so highlighting lines up with the audio.
+            // Its offsets count code points, not UTF-16 units, so slice by code point
+            // or every segment after an emoji (or other non-BMP character) shifts.
+            const codePoints = Array.from(this.chapterText);
+            this.textSegments = segmentResults.map(result => codePoints.slice(result.start, result.end).join(''));
+            
             for (let i = 0; i < this.textSegments.length; i++) {
                 const segment = this.textSegments[i];
-                console.log(`🎤 Generating segment ${i + 1}/${this.textSegments.length} (${segment.length} chars)`);
+                const result = segmentResults[i];
                 
                 try {
-                    const audioBlob = await this.generateSegmentAudio(segment);
+                    if (!result || !result.success || !result.audio_data) {
+                        throw new Error(result?.error || 'No audio data received from server');
+                    }
+                    
+                    const audioBlob = this.base64ToBlob(result.audio_data, this.audioMimeType(result.format));
                     const audioUrl = URL.createObjectURL(audioBlob);
                     const audioElement = new Audio(audioUrl);
                     
-                    // Wait for audio to load to get duration
-                    await new Promise((resolve, reject) => {
-                        audioElement.addEventListener('loadedmetadata', () => {
-                            console.log(`✅ Audio metadata loaded for segment ${i + 1}, duration: ${audioElement.duration}s`);
-                            resolve();
+                    // The server measures duration; only decode metadata if it couldn't
+                    if (!result.duration) {
+                        await new Promise((resolve, reject) => {
+                            audioElement.addEventListener('loadedmetadata', () => {
+                                console.log(`✅ Audio metadata loaded for segment ${i + 1}, duration: ${audioElement.duration}s`);
+                                resolve();
+                            });
+                            audioElement.addEventListener('error', (e) => {
+                                console.error(`❌ Audio load error for segment ${i + 1}:`, e);
+                                reject(e);
+                            });
+                            audioElement.load();
                         });
-                        audioElement.addEventListener('error', (e) => {
-                            console.error(`❌ Audio load error for segment ${i + 1}:`, e);
-                            reject(e);
-                        });
-                        audioElement.load();
-                    });
+                    }
                     
                     generatedAudios.push({
                         audio: audioElement,
                         url: audioUrl,
                         blob: audioBlob,
-                        duration: audioElement.duration,
+                        duration: result.duration || audioElement.duration,
                         text: segment
                     });
                     
@@ -777,6 +830,35 @@ class AudiobookReader {
         }
     }
 
+    async generateChapterSegmentAudio(text) {
+        // Ensure voice is a valid string
+        const voice = typeof this.settings.voice === 'string' && this.settings.voice ? this.settings.voice : 'alloy';
+        const model = typeof this.settings.model === 'string' && this.settings.model ? this.settings.model : 'tts-1';
+        
+        console.log(`🎙️ Requesting chapter audio for ${text.length} chars (voice: ${voice}, model: ${model})`);
+        
+        const response = await fetch('/api/generate-audio/chapter', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ text, voice, model, format: this.audioFormat })
+        });
+        
+        const data = await response.json();
+        if (!response.ok) {
+            console.error(`❌ HTTP error ${response.status}:`, data);
+            throw new Error(data.error || `HTTP ${response.status}: Failed to generate audio`);
+        }
+        
+        if (!Array.isArray(data.segments) || data.segments.length === 0) {
+            throw new Error('Chapter audio response contained no segments');
+        }
+        
+        data.segments.forEach(segment => { segment.format = data.format; });
+        return data.segments;
+    }
+
     async generateSegmentAudio(text) {
         try {
             console.log(`🎙️ Generating audio for text (${text.length} chars):`, text.substring(0, 100) + '...');
@@ -792,7 +874,8 @@ class AudiobookReader {
             const requestBody = {
                 text: text,
                 voice: voice,
-                model: model
+                model: model,
+                format: this.audioFormat
             };
             
             console.log(`🎙️ Request body:`, requestBody);
@@ -835,7 +918,7 @@ class AudiobookReader {
 
             console.log(`✅ Converting base64 to blob (${data.audio_data.length} chars)`);
             // Convert base64 to blob
-            const audioBlob = this.base64ToBlob(data.audio_data, 'audio/mp3');
+            const audioBlob = this.base64ToBlob(data.audio_data, this.audioMimeType(data.format));
             console.log(`✅ Audio blob created:`, audioBlob.size, 'bytes');
             return audioBlob;
             
@@ -1653,7 +1736,7 @@ class AudiobookReader {
         // Clear Supabase cache for current chapter
         try {
             const cacheKey = this.getCacheKey();
-            await DatabaseService.clearAudioCache(cacheKey.split('-').slice(0, -2).join('-')); // Clear by book-chapter pattern
+            await DatabaseService.clearAudioCache(cacheKey.split('-').slice(0, -3).join('-')); // Clear by book-chapter pattern
             console.log('✅ Cleared Supabase audio cache');
         } catch (error) {
             console.warn('⚠️ Error clearing Supabase cache:', error);
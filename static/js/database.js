@@ -6,6 +6,9 @@ let supabaseClient = null;
 // Promise that resolves when Supabase is initialized
 let supabaseInitialized = null;
 
+// Whether the backend keeps highlights, notes and progress (/api/reader-state); set from /api/config
+let serverReaderState = false;
+
 // Initialize Supabase client with configuration from backend
 async function initializeSupabase() {
     try {
@@ -17,6 +20,7 @@ async function initializeSupabase() {
         
         SUPABASE_URL = config.supabase.url;
         SUPABASE_ANON_KEY = config.supabase.anonKey;
+        serverReaderState = !!(config.features && config.features.reader_state);
         
         console.log('Setting Supabase config:', {
             url: SUPABASE_URL,
@@ -105,6 +109,71 @@ const isSupabaseConfigured = () => {
     return configured;
 };
 
+// Reader state kept by the backend: a chapter's highlights, notes, progress and
+// item audio come back in one request, and writes made within a few
+// milliseconds of each other are sent together in one batch
+const ReaderStateClient = {
+    BATCH_DELAY_MS: 25,
+    pending: [],
+    timer: null,
+    itemAudio: new Map(), // note/highlight id -> row carrying audio_data
+
+    async getState(bookId, chapterId = null, voice = null, model = null) {
+        const params = new URLSearchParams({ book_id: bookId });
+        if (chapterId !== null && chapterId !== undefined) {
+            params.set('chapter_id', chapterId);
+        }
+        if (voice && model) {
+            params.set('voice', voice);
+            params.set('model', model);
+        }
+        
+        const response = await fetch(`/api/reader-state?${params}`);
+        if (!response.ok) {
+            throw new Error(`Reader state request failed: ${response.status}`);
+        }
+        const state = await response.json();
+        [...(state.highlights || []), ...(state.notes || [])].forEach(item => {
+            if (item.audio_data) {
+                this.itemAudio.set(item.id, item);
+            }
+        });
+        return state;
+    },
+
+    write(op) {
+        return new Promise((resolve, reject) => {
+            this.pending.push({ op, resolve, reject });
+            if (!this.timer) {
+                this.timer = setTimeout(() => this.flush(), this.BATCH_DELAY_MS);
+            }
+        });
+    },
+
+    async flush() {
+        const batch = this.pending;
+        this.pending = [];
+        this.timer = null;
+        
+        try {
+            const response = await fetch('/api/reader-state/batch', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ ops: batch.map(entry => entry.op) })
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || `Reader state write failed: ${response.status}`);
+            }
+            batch.forEach((entry, index) => entry.resolve(data.results[index]));
+        } catch (error) {
+            batch.forEach(entry => entry.reject(error));
+        }
+    }
+};
+
 // Database service for book operations
 class DatabaseService {
     // Utility methods
@@ -420,6 +489,10 @@ class DatabaseService {
     static async getHighlights(bookId, chapterId = null) {
         await ensureSupabaseReady();
         
+        if (serverReaderState && chapterId) {
+            return (await ReaderStateClient.getState(bookId, chapterId)).highlights;
+        }
+        
         if (!isSupabaseConfigured()) {
             return []; // Return empty array for highlights in mock
         }
@@ -445,6 +518,10 @@ class DatabaseService {
         
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            return ReaderStateClient.write({ type: 'highlight', action: 'create', data: highlight });
+        }
+        
         if (!isSupabaseConfigured()) {
             console.log('Supabase not configured, returning mock highlight');
             return { ...highlight, id: 'mock-highlight-' + Date.now() };
@@ -705,6 +782,10 @@ class DatabaseService {
     static async updateHighlight(id, updates) {
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            return ReaderStateClient.write({ type: 'highlight', action: 'update', id, data: updates });
+        }
+        
         if (!isSupabaseConfigured()) {
             return { id, ...updates }; // Return mock updated highlight
         }
@@ -723,6 +804,11 @@ class DatabaseService {
     static async deleteHighlight(id) {
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            await ReaderStateClient.write({ type: 'highlight', action: 'delete', id });
+            return;
+        }
+        
         if (!isSupabaseConfigured()) {
             return; // Do nothing in mock
         }
@@ -735,10 +821,25 @@ class DatabaseService {
         if (error) throw error;
     }
 
+    // Progress, highlights, notes and item audio for a chapter in one request;
+    // null when the backend doesn't keep reader state
+    static async getChapterState(bookId, chapterId, voice = null, model = null) {
+        await ensureSupabaseReady();
+        
+        if (!serverReaderState) {
+            return null;
+        }
+        return ReaderStateClient.getState(bookId, chapterId, voice, model);
+    }
+
     // Reading Progress
     static async getReadingProgress(bookId) {
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            return (await ReaderStateClient.getState(bookId)).progress;
+        }
+        
         if (!isSupabaseConfigured()) {
             return null; // Return null in mock
         }
@@ -756,6 +857,10 @@ class DatabaseService {
     static async updateReadingProgress(bookId, progress) {
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            return ReaderStateClient.write({ type: 'progress', book_id: bookId, data: progress });
+        }
+        
         if (!isSupabaseConfigured()) {
             return { book_id: bookId, ...progress, last_read_at: new Date().toISOString() }; // Return mock progress
         }
@@ -778,6 +883,10 @@ class DatabaseService {
     static async getNotes(bookId, chapterId = null) {
         await ensureSupabaseReady();
         
+        if (serverReaderState && chapterId) {
+            return (await ReaderStateClient.getState(bookId, chapterId)).notes;
+        }
+        
         if (!isSupabaseConfigured()) {
             return []; // Return empty array for notes in mock
         }
@@ -800,6 +909,10 @@ class DatabaseService {
     static async createNote(note) {
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            return ReaderStateClient.write({ type: 'note', action: 'create', data: note });
+        }
+        
         if (!isSupabaseConfigured()) {
             return { 
                 ...note, 
@@ -822,6 +935,10 @@ class DatabaseService {
     static async updateNote(id, updates) {
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            return ReaderStateClient.write({ type: 'note', action: 'update', id, data: updates });
+        }
+        
         if (!isSupabaseConfigured()) {
             return { 
                 id, 
@@ -844,6 +961,11 @@ class DatabaseService {
     static async deleteNote(id) {
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            await ReaderStateClient.write({ type: 'note', action: 'delete', id });
+            return;
+        }
+        
         if (!isSupabaseConfigured()) {
             return; // Do nothing in mock
         }
@@ -1199,6 +1321,11 @@ class DatabaseService {
         
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            // Delivered with the chapter state; null means generate it
+            return ReaderStateClient.itemAudio.get(noteId) || null;
+        }
+        
         if (!isSupabaseConfigured()) {
             console.log('⚠️ Supabase not configured, returning null for note audio');
             return null;
@@ -1278,6 +1405,25 @@ class DatabaseService {
         
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            try {
+                const saved = await ReaderStateClient.write({
+                    type: 'note',
+                    action: 'update',
+                    id: noteId,
+                    data: { audio_data: audioData, audio_voice: voice, audio_model: model }
+                });
+                if (!saved) {
+                    return false;
+                }
+                ReaderStateClient.itemAudio.set(noteId, { ...saved, audio_data: audioData });
+                return true;
+            } catch (error) {
+                console.error('❌ Error saving note audio:', error);
+                return false;
+            }
+        }
+        
         if (!isSupabaseConfigured()) {
             console.log('⚠️ Supabase not configured, cannot save note audio');
             return false;
@@ -1315,6 +1461,11 @@ class DatabaseService {
         
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            // Delivered with the chapter state; null means generate it
+            return ReaderStateClient.itemAudio.get(highlightId) || null;
+        }
+        
         if (!isSupabaseConfigured()) {
             console.log('⚠️ Supabase not configured, returning null for highlight audio');
             return null;
@@ -1394,6 +1545,25 @@ class DatabaseService {
         
         await ensureSupabaseReady();
         
+        if (serverReaderState) {
+            try {
+                const saved = await ReaderStateClient.write({
+                    type: 'highlight',
+                    action: 'update',
+                    id: highlightId,
+                    data: { audio_data: audioData, audio_voice: voice, audio_model: model }
+                });
+                if (!saved) {
+                    return false;
+                }
+                ReaderStateClient.itemAudio.set(highlightId, { ...saved, audio_data: audioData });
+                return true;
+            } catch (error) {
+                console.error('❌ Error saving highlight audio:', error);
+                return false;
+            }
+        }
+        
         if (!isSupabaseConfigured()) {
             console.log('⚠️ Supabase not configured, cannot save highlight audio');
             return false;
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Tests for audio container parsing and the Ogg Opus remuxer (audio_formats.py)
+"""
+import struct
+
+from audio_formats import (
+    _ogg_page, _ogg_pages, audio_duration, join_audio, join_ogg_opus, ogg_crc, ogg_opus_clip,
+    ogg_opus_duration, ogg_opus_pre_skip, sniff_format,
+)
+
+PRE_SKIP = 312
+FRAME = 960  # TOC 0xF8: CELT, 20 ms, one frame
+
+
+def reference_crc(data):
+    """Bit-at-a-time Ogg CRC, straight from the spec"""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def lacing_for(packets):
+    lacing = bytearray()
+    for packet in packets:
+        lacing += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+    return bytes(lacing)
+
+
+def opus_clip(serial, packet_count, trim=0, pre_skip=PRE_SKIP, long_packet=False):
+    """
+    A standalone Ogg Opus clip the way an encoder writes it: OpusHead and
+    OpusTags pages, then audio pages of 20 ms packets, granules counting
+    decoded samples (pre-skip included), trim samples cut from the end.
+    With long_packet, one packet spans two pages.
+    """
+    head = b'OpusHead' + struct.pack('<BBHIhB', 1, 1, pre_skip, 48000, 0, 0)
+    tags = b'OpusTags' + struct.pack('<I', 4) + b'test' + struct.pack('<I', 0)
+    out = _ogg_page(0x02, 0, serial, 0, lacing_for([head]), head)
+    out += _ogg_page(0, 0, serial, 1, lacing_for([tags]), tags)
+    packets = [bytes([0xF8]) + bytes([index % 251]) * 40 for index in range(packet_count)]
+    sequence = 2
+    granule = 0
+    if long_packet:
+        packet = bytes([0xF8]) + b'\x07' * 599
+        # 510 bytes on one page (no packet ends there, so no granule), the rest on the next
+        out += _ogg_page(0, -1, serial, sequence, b'\xff\xff', packet[:510])
+        granule += FRAME
+        out += _ogg_page(0x01, granule, serial, sequence + 1, bytes([90]), packet[510:])
+        sequence += 2
+    for start in range(0, packet_count, 3):
+        page_packets = packets[start:start + 3]
+        granule += FRAME * len(page_packets)
+        last = start + 3 >= packet_count
+        out += _ogg_page(
+            0x04 if last else 0, granule - trim if last else granule, serial, sequence,
+            lacing_for(page_packets), b''.join(page_packets)
+        )
+        sequence += 1
+    return out
+
+
+def pages(data):
+    """(header_type, granule, serial, sequence, crc_ok) of every page in data"""
+    found = []
+    pos = 0
+    while pos < len(data):
+        assert data[pos:pos + 4] == b'OggS'
+        header_type, granule, serial, sequence, crc, count = struct.unpack_from('<BqIIIB', data, pos + 5)
+        size = 27 + count + sum(data[pos + 27:pos + 27 + count])
+        page = bytearray(data[pos:pos + size])
+        page[22:26] = b'\0\0\0\0'
+        found.append((header_type, granule, serial, sequence, reference_crc(page) == crc))
+        pos += size
+    return found
+
+
+def assert_single_stream(data):
+    found = pages(data)
+    assert all(crc_ok for *_, crc_ok in found)
+    assert [sequence for _, _, _, sequence, _ in found] == list(range(len(found)))
+    assert len({serial for _, _, serial, _, _ in found}) == 1
+    flags = [header_type for header_type, *_ in found]
+    assert flags[0] & 0x02 and not any(flag & 0x02 for flag in flags[1:])
+    assert flags[-1] & 0x04 and not any(flag & 0x04 for flag in flags[:-1])
+    granules = [granule for _, granule, _, _, _ in found[2:] if granule >= 0]
+    assert granules == sorted(granules)
+    return found
+
+
+def test_ogg_crc_matches_reference():
+    for data in (b'', b'OggS', bytes(range(256)) * 3, b'\xff' * 1000):
+        assert ogg_crc(data) == reference_crc(data)
+
+
+def test_encoder_style_clip_is_valid():
+    clip = opus_clip(7, 10, trim=100)
+    assert_single_stream(clip)
+    assert ogg_opus_pre_skip(clip) == PRE_SKIP
+    assert abs(ogg_opus_duration(clip) - (10 * FRAME - 100 - PRE_SKIP) / 48000) < 1e-9
+
+
+def test_join_makes_one_logical_stream():
+    clips = [opus_clip(1, 10, trim=200), opus_clip(2, 7, trim=150, long_packet=True), opus_clip(3, 5, trim=80)]
+    data, spans = join_ogg_opus(clips)
+    found = assert_single_stream(data)
+    assert found[0][2] == 1  # the first clip's serial
+    # Only the last clip's end trim survives; the others run to their last packet
+    assert found[-1][1] == (10 + 8 + 5) * FRAME - 80
+    assert ogg_opus_pre_skip(data) == PRE_SKIP
+    assert abs(ogg_opus_duration(data) - ((10 + 8 + 5) * FRAME - 80 - PRE_SKIP) / 48000) < 1e-9
+
+
+def test_join_spans_cover_each_clip():
+    clips = [opus_clip(1, 10, trim=200), opus_clip(2, 8, long_packet=True), opus_clip(3, 5, trim=80)]
+    data, spans = join_ogg_opus(clips)
+    header_length = spans[0][0]
+    assert [(start, end) for _, _, start, end in spans] == [
+        (0, 10 * FRAME), (10 * FRAME, 19 * FRAME), (19 * FRAME, 24 * FRAME - 80)
+    ]
+    # Spans tile the audio pages without gaps
+    for (offset, length, _, _), (next_offset, _, _, _) in zip(spans, spans[1:]):
+        assert offset + length == next_offset
+    assert spans[-1][0] + spans[-1][1] == len(data)
+    assert [offset for offset, _, _, _ in spans] == sorted(offset for offset, _, _, _ in spans)
+    assert len(list(_ogg_pages(data[:header_length]))) == 2
+
+
+def test_segment_clip_is_standalone():
+    clips = [opus_clip(1, 10), opus_clip(2, 8, long_packet=True), opus_clip(3, 5, trim=80)]
+    data, spans = join_ogg_opus(clips)
+    header_length = spans[0][0]
+    for offset, length, start, end in spans:
+        clip = ogg_opus_clip(data, header_length, offset, length, start)
+        found = assert_single_stream(clip)
+        assert found[-1][1] == end - start
+        assert abs(ogg_opus_duration(clip) - (end - start - PRE_SKIP) / 48000) < 1e-9
+
+
+def test_join_handles_empty_clips():
+    data, spans = join_ogg_opus([opus_clip(1, 4), b'', opus_clip(2, 4)])
+    assert_single_stream(data)
+    assert spans[1][1] == 0 and spans[1][2] == spans[1][3] == 4 * FRAME
+    assert join_ogg_opus([]) == (b'', [])
+
+
+def test_join_audio_durations_add_up():
+    clips = [opus_clip(1, 10, trim=200), opus_clip(2, 8, trim=300)]
+    data, durations = join_audio(clips, 'opus')
+    assert abs(sum(durations) - ogg_opus_duration(data)) < 1e-9
+    assert abs(durations[0] - (10 * FRAME - PRE_SKIP) / 48000) < 1e-9
+
+
+def mp3_frames(count):
+    # MPEG-1 layer III, 128 kbps, 44.1 kHz: 417-byte frames of 1152 samples
+    return (b'\xff\xfb\x90\x00' + bytes(413)) * count
+
+
+def test_mp3_and_aac_join_by_concatenation():
+    clips = [mp3_frames(10), mp3_frames(5)]
+    data, durations = join_audio(clips, 'mp3')
+    assert data == b''.join(clips)
+    assert abs(durations[0] - 10 * 1152 / 44100) < 1e-9
+    assert abs(audio_duration(data) - 15 * 1152 / 44100) < 1e-9
+
+
+def test_sniff_format():
+    assert sniff_format(opus_clip(1, 1)) == 'opus'
+    assert sniff_format(mp3_frames(1)) == 'mp3'
+    assert sniff_format(b'ID3\x04\x00\x00\x00\x00\x00\x00' + mp3_frames(1)) == 'mp3'
+    assert sniff_format(b'\xff\xf1\x50\x80' + bytes(10)) == 'aac'
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
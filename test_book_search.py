@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for book-wide passage search and its persisted index (book_search.py)
+"""
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import book_search
+from book_search import BookSearch, SearchIndex, hashed_vector, split_passages
+
+CHAPTERS = [
+    (1, "Nephi was commanded to build a ship. He went into the mountain to find ore for tools. "
+        "The brothers mocked him for building a ship."),
+    (2, "The family crossed the great waters in the ship. A storm drove them back for four days. "
+        "They arrived at the promised land and planted seeds."),
+    (3, "Alma taught the people at the waters of Mormon. Many were baptized there in the forest."),
+]
+
+
+def test_passages_cover_the_text_in_order():
+    text = CHAPTERS[0][1] * 5
+    passages = split_passages(text, max_chars=120)
+    assert len(passages) > 1
+    assert all(start < end for start, end in passages)
+    assert all(a[1] <= b[0] for a, b in zip(passages, passages[1:]))
+    assert all(text[start:end] == text[start:end].strip() for start, end in passages)
+
+
+def test_vectors_are_deterministic_and_stemmed():
+    assert np.array_equal(hashed_vector('Building ships', 256), hashed_vector('building ships', 256))
+    assert np.array_equal(hashed_vector('ship', 256), hashed_vector('ships', 256))
+    assert not hashed_vector('', 256).any()
+
+
+def test_search_ranks_the_matching_passage_first():
+    index = SearchIndex.build(CHAPTERS, dimensions=512)
+    assert len(index) == 3
+    rows = index.search('where was the baptism at the waters of Mormon', top_k=2)
+    assert index.locations[rows[0][0]][0] == 3
+    assert rows[0][1] >= rows[-1][1] > 0
+    assert index.locations[index.search('storm on the great waters')[0][0]][0] == 2
+    assert index.search('zebra quantum') == []
+    norms = np.linalg.norm(index.matrix, axis=1)
+    assert np.allclose(norms, 1.0, atol=1e-5)
+
+
+def test_results_carry_chapter_offsets():
+    search = BookSearch(tempfile.mkdtemp(), dimensions=512)
+    [(chapter_id, start, end, score)] = search.search('b1', 'v1', lambda: CHAPTERS, 'ore for tools', top_k=1)
+    text = dict(CHAPTERS)[chapter_id]
+    assert chapter_id == 1 and 'ore for tools' in text[start:end] and score > 0
+
+
+def test_index_is_persisted_and_memory_mapped():
+    root = tempfile.mkdtemp()
+    BookSearch(root, dimensions=512).index('b1', 'v1', lambda: CHAPTERS)
+
+    def fail():
+        raise AssertionError('index should be loaded from disk, not rebuilt')
+
+    search = BookSearch(root, dimensions=512)
+    index = search.index('b1', 'v1', fail)
+    assert isinstance(index.matrix, np.memmap)
+    assert search.stats()['loads'] == 1 and search.stats()['builds'] == 0
+
+
+def test_new_book_version_replaces_the_old_index():
+    root = tempfile.mkdtemp()
+    search = BookSearch(root, dimensions=512)
+    search.index('b1', 'v1', lambda: CHAPTERS)
+    search.index('b1', 'v2', lambda: CHAPTERS[:1])
+    assert os.listdir(os.path.join(root, 'b1')) == ['v2-512']
+
+
+def test_index_from_an_older_format_is_rebuilt():
+    root = tempfile.mkdtemp()
+    search = BookSearch(root, dimensions=512)
+    search.index('b1', 'v1', lambda: CHAPTERS)
+    meta_path = os.path.join(root, 'b1', 'v1-512', 'passages.json')
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    meta['version'] = book_search.INDEX_VERSION - 1
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    search = BookSearch(root, dimensions=512)
+    search.index('b1', 'v1', lambda: CHAPTERS)
+    assert search.stats()['builds'] == 1
+
+
+def test_invalid_book_id_is_rejected():
+    try:
+        BookSearch(tempfile.mkdtemp()).index('../etc', 'v1', lambda: CHAPTERS)
+    except ValueError:
+        return
+    raise AssertionError('accepted a path as a book id')
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests for the server-side reader state store (reader_state.py) on SQLite
+"""
+import os
+import tempfile
+
+from reader_state import ConnectionPool, ReaderStateError, ReaderStateStore, sqlite_connector
+
+
+def make_store():
+    path = os.path.join(tempfile.mkdtemp(), 'reader_state.db')
+    store = ReaderStateStore(ConnectionPool(sqlite_connector(path), size=2))
+    store.init_schema()
+    return store
+
+
+def create_highlight(item_id, **data):
+    return {
+        'type': 'highlight', 'action': 'create', 'id': item_id,
+        'data': dict({'book_id': 'b1', 'chapter_id': 1, 'selected_text': 'the plates'}, **data),
+    }
+
+
+def test_create_update_delete():
+    store = make_store()
+    [created] = store.apply([create_highlight('h1', title='Plates')])
+    assert created['id'] == 'h1' and created['title'] == 'Plates' and created['chapter_id'] == '1'
+
+    [updated] = store.apply([{'type': 'highlight', 'action': 'update', 'id': 'h1', 'data': {'title': 'Gold'}}])
+    assert updated['title'] == 'Gold' and updated['selected_text'] == 'the plates'
+    assert [row['title'] for row in store.chapter_state('b1', 1)['highlights']] == ['Gold']
+
+    assert store.apply([{'type': 'highlight', 'action': 'delete', 'id': 'h1'}]) == [None]
+    assert store.chapter_state('b1', 1)['highlights'] == []
+
+
+def test_update_of_missing_item_returns_none():
+    store = make_store()
+    assert store.apply([{'type': 'note', 'action': 'update', 'id': 'nope', 'data': {'note_content': 'x'}}]) == [None]
+
+
+def test_retried_create_is_idempotent():
+    store = make_store()
+    batch = [create_highlight('h1', title='First'), {'type': 'progress', 'book_id': 'b1', 'data': {'current_chapter_number': 2}}]
+    first = store.apply(batch)
+    # The client never saw the response and sends the same batch again
+    retried = store.apply(batch)
+    assert retried[0]['id'] == 'h1' and retried[0]['title'] == 'First'
+    assert retried[0]['created_at'] == first[0]['created_at']
+    assert retried[1]['current_chapter_number'] == 2
+    assert len(store.chapter_state('b1', 1)['highlights']) == 1
+
+
+def test_retried_create_keeps_later_updates():
+    store = make_store()
+    store.apply([create_highlight('h1', title='First')])
+    store.apply([{'type': 'highlight', 'action': 'update', 'id': 'h1', 'data': {'title': 'Edited'}}])
+    [row] = store.apply([create_highlight('h1', title='First')])
+    assert row['title'] == 'Edited'
+
+
+def test_batch_coalescing():
+    store = make_store()
+    results = store.apply([
+        create_highlight('h1'),
+        {'type': 'highlight', 'action': 'update', 'id': 'h1', 'data': {'title': 'Merged'}},
+        create_highlight('h2'),
+        {'type': 'highlight', 'action': 'delete', 'id': 'h2'},
+        {'type': 'progress', 'book_id': 'b1', 'data': {'current_chapter_number': 1}},
+        {'type': 'progress', 'book_id': 'b1', 'data': {'progress_percentage': 40.0}},
+    ])
+    assert results[0] is results[1] and results[0]['title'] == 'Merged'
+    assert results[2] is None and results[3] is None
+    assert results[5]['current_chapter_number'] == 1 and results[5]['progress_percentage'] == 40.0
+    assert [row['id'] for row in store.chapter_state('b1', 1)['highlights']] == ['h1']
+    assert store.stats()['ops_coalesced'] == 3
+
+
+def test_writes_invalidate_cached_chapter_state():
+    store = make_store()
+    assert store.chapter_state('b1', 1)['highlights'] == []
+    store.chapter_state('b1', 1)
+    assert store.stats()['hits'] >= 1
+    store.apply([create_highlight('h1')])
+    assert [row['id'] for row in store.chapter_state('b1', 1)['highlights']] == ['h1']
+
+
+def test_item_audio_only_for_matching_voice():
+    store = make_store()
+    store.apply([create_highlight('h1', audio_data='AAAA', audio_voice='alloy', audio_model='tts-1')])
+    [row] = store.chapter_state('b1', 1, 'alloy', 'tts-1')['highlights']
+    assert row['audio_data'] == 'AAAA' and row['has_audio']
+    [row] = store.chapter_state('b1', 1, 'nova', 'tts-1')['highlights']
+    assert 'audio_data' not in row
+
+
+def test_invalid_operations_are_rejected():
+    store = make_store()
+    for ops in (
+        ['not an object'],
+        [{'type': 'highlight', 'action': 'create', 'data': {'book_id': 'b1'}}],
+        [{'type': 'highlight', 'action': 'update', 'data': {}}],
+        [{'type': 'highlight', 'action': 'create', 'data': {'book_id': 'b1', 'chapter_id': 1, 'bogus': 1}}],
+        [{'type': 'bookmark', 'action': 'create', 'data': {}}],
+        [{'type': 'progress', 'data': {}}],
+    ):
+        try:
+            store.apply(ops)
+        except ReaderStateError:
+            continue
+        raise AssertionError(f"accepted {ops!r}")
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for the local BM25 retrieval engine (retrieval.py)
+"""
+import doctest
+
+import retrieval
+from retrieval import BM25Index, ChapterIndex, IndexCache, content_hash, split_sentences, stem, tokenize
+
+CHAPTER = """The rain fell on the plates of gold. Nephi kept the records of his people.
+
+He wrote of the journey into the wilderness. The ship was built with timbers of curious workmanship.
+Quickly the family crossed the great waters."""
+
+
+def test_stem_doctests():
+    """The examples in stem()'s docstring hold"""
+    failures, _ = doctest.testmod(retrieval)
+    assert failures == 0
+
+
+def test_stem_conflates_inflections():
+    """Plural, tense and adverb forms share a stem with their base word"""
+    for forms in (
+        ('plate', 'plates'),
+        ('record', 'records', 'recorded', 'recording'),
+        ('journey', 'journeys', 'journeyed'),
+        ('run', 'running', 'runs'),
+        ('hope', 'hoped', 'hoping', 'hopes'),
+        ('agree', 'agreed'),
+        ('city', 'cities'),
+        ('quick', 'quickly'),
+        ('happy', 'happiness'),
+    ):
+        assert len({stem(word) for word in forms}) == 1, forms
+
+
+def test_stem_keeps_distinct_words_apart():
+    """Endings that only look like suffixes are left alone"""
+    assert stem('reply') != stem('rep')
+    assert stem('hop') != stem('hope')
+    assert stem('this') == 'this'
+    assert stem('gas') == 'gas'
+    assert stem('is') == 'is'
+
+
+def test_tokenize_drops_stop_words_and_stems():
+    assert tokenize("What were the Plates of Nephi's people?") == ['plate', 'nephi', 'peopl']
+
+
+def test_split_sentences_spans_are_trimmed():
+    for start, end in split_sentences(CHAPTER):
+        sentence = CHAPTER[start:end]
+        assert sentence == sentence.strip() and sentence
+    # A blank line ends a sentence even without punctuation
+    assert split_sentences('First line\n\nSecond line') == [(0, 10), (12, 23)]
+
+
+def test_bm25_ranks_matching_document_first():
+    index = BM25Index([
+        'the cat sat on the mat',
+        'dogs chase cats in the garden',
+        'a ship crossed the waters',
+    ])
+    ranked = index.search('ships on the water')
+    assert ranked[0][0] == 2
+    assert all(score > 0 for _, score in ranked)
+    # Inflected query terms match through the stemmer
+    assert index.search('cat')[0][0] in (0, 1)
+    assert {doc_id for doc_id, _ in index.search('cats')} == {0, 1}
+    assert index.search('zebra') == []
+
+
+def test_bm25_rarer_terms_weigh_more():
+    index = BM25Index(['gold gold silver', 'silver bronze', 'silver iron', 'silver tin'])
+    ranked = index.search('gold silver')
+    assert ranked[0][0] == 0
+    assert index.idf[stem('gold')] > index.idf[stem('silver')]
+
+
+def test_chapter_index_returns_offsets_into_chapter():
+    index = ChapterIndex(CHAPTER)
+    match = index.best_match('Who built the ship?')
+    assert match['text'] == 'The ship was built with timbers of curious workmanship'
+    assert CHAPTER[match['start']:match['end']] == match['text']
+    assert ChapterIndex(CHAPTER).best_match('zebra') is None
+
+
+def test_index_cache_reuses_indexes_by_hash():
+    cache = IndexCache(max_entries=1)
+    first = cache.get(CHAPTER)
+    assert cache.get(CHAPTER, content_hash(CHAPTER)) is first
+    cache.get('Another chapter entirely.')
+    assert cache.get(CHAPTER) is not first
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for mapping LLM-quoted snippets back onto chapter offsets (span_locator.py)
+"""
+from span_locator import locate_span
+
+CHAPTER = """In the quiet moments of dawn, when the world still sleeps, there exists a sacred ritual. It is the simple, yet profound act of reading.
+
+Reading is not merely the mechanical process of decoding symbols on a page. It is an intimate conversation between the reader and the writer."""
+
+
+def test_verbatim_quote():
+    snippet = 'It is the simple, yet profound act of reading.'
+    start, end = locate_span(CHAPTER, snippet)
+    assert CHAPTER[start:end] == snippet
+
+
+def test_quote_marks_and_whitespace_are_ignored():
+    start, end = locate_span(CHAPTER, '  "the simple, yet profound act of reading"  ')
+    assert CHAPTER[start:end] == 'the simple, yet profound act of reading'
+
+
+def test_altered_words_still_locate_the_span():
+    snippet = "Reading isn't merely the mechanical process of decoding the symbols on a page."
+    start, end = locate_span(CHAPTER, snippet)
+    assert CHAPTER[start:end].startswith('Reading is not merely')
+    assert CHAPTER[start:end].rstrip('.').endswith('on a page')
+
+
+def test_span_can_cross_sentences():
+    snippet = 'act of reading. Reading is not merely the mechanical process'
+    start, end = locate_span(CHAPTER, snippet.replace('.', ';'))
+    assert CHAPTER[start:end].startswith('act of reading')
+    assert CHAPTER[start:end].endswith('mechanical process')
+
+
+def test_unrelated_text_is_not_found():
+    assert locate_span(CHAPTER, 'The ship sailed across the great waters toward the promised land.') is None
+    assert locate_span(CHAPTER, '') is None
+    assert locate_span('', 'anything at all') is None
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,90 @@
+"""
+Deterministic text segmentation for TTS.
+
+Chapter text is split into segments under the TTS input limit, breaking at
+paragraph boundaries first, then sentence boundaries, then whitespace, and
+only as a last resort mid-word. The result depends on nothing but the text
+and the limit, so every client asking for the same chapter gets the same
+segments and therefore the same audio cache keys. Each segment carries its
+character offsets in the source text so playback can be mapped back onto
+the page.
+"""
+
+import re
+from collections import namedtuple
+
+TTS_MAX_CHARS = 4096
+
+_PARAGRAPH_RE = re.compile(r'\S(?:.*?\S)?(?=\s*\n\s*\n|\s*$)', re.DOTALL)
+_SENTENCE_RE = re.compile(r'[^.!?]+(?:[.!?]+["\'”’)\]]*|$)|[.!?]+')
+
+Segment = namedtuple('Segment', ['index', 'text', 'start', 'end'])
+
+
+def _trimmed_spans(text, pattern, start, end):
+    spans = []
+    for match in pattern.finditer(text, start, end):
+        chunk = match.group()
+        stripped = chunk.strip()
+        if stripped:
+            chunk_start = match.start() + len(chunk) - len(chunk.lstrip())
+            spans.append((chunk_start, chunk_start + len(stripped)))
+    return spans
+
+
+def _hard_split(text, start, end, max_chars):
+    """Split one span at whitespace (or mid-word if there is none) into pieces under max_chars"""
+    spans = []
+    while end - start > max_chars:
+        cut = text.rfind(' ', start + 1, start + max_chars + 1)
+        if cut <= start:
+            cut = start + max_chars
+        spans.append((start, cut))
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if start < end:
+        spans.append((start, end))
+    return spans
+
+
+def split_text(text, max_chars=TTS_MAX_CHARS):
+    """Split text into Segments of at most max_chars, each with (start, end) offsets into text"""
+    pieces = []
+    for para_start, para_end in _trimmed_spans(text, _PARAGRAPH_RE, 0, len(text)):
+        if para_end - para_start <= max_chars:
+            pieces.append((para_start, para_end))
+            continue
+        # Oversized paragraph: fall back to sentences, breaking any giant sentence at spaces
+        for start, end in _trimmed_spans(text, _SENTENCE_RE, para_start, para_end):
+            pieces.extend(_hard_split(text, start, end, max_chars))
+
+    # Greedily merge consecutive pieces while the merged span stays under the limit
+    spans = []
+    for start, end in pieces:
+        if spans and end - spans[-1][0] <= max_chars:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    return [Segment(index, text[start:end], start, end) for index, (start, end) in enumerate(spans)]
+
+
+def split_segments(texts, max_chars=TTS_MAX_CHARS, separator='\n\n'):
+    """Split a list of texts, with offsets into the texts joined by separator"""
+    return split_text(separator.join(text.strip() for text in texts), max_chars)
+
+
+def timing_map(segments, durations):
+    """Per-segment offsets plus audio durations and cumulative start times"""
+    timings = []
+    start_time = 0.0
+    for segment, duration in zip(segments, durations):
+        timings.append({
+            'index': segment.index,
+            'start': segment.start,
+            'end': segment.end,
+            'duration': duration,
+            'start_time': start_time,
+        })
+        start_time += duration or 0.0
+    return timings
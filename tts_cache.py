@@ -0,0 +1,231 @@
+"""
+Server-side cache for generated TTS audio.
+
+Audio is content-addressed by a SHA-256 of (model, voice, text, format) so
+the same passage is synthesized once per deployment instead of once per
+client.
+Two tiers are used: a bounded in-memory LRU for hot entries and a directory
+on disk with size-based eviction (least recently used files go first).
+Files are named by key with the clip's format as extension (.mp3, .opus,
+.aac), sniffed from the audio itself.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from audio_formats import AUDIO_MIME_TYPES, sniff_format
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(text, voice, model, fmt='mp3'):
+    """Return the content hash used to address a synthesized clip"""
+    digest = hashlib.sha256()
+    # MP3 keys leave the format out so clips cached before formats existed stay valid
+    parts = (model, voice, text) if fmt == 'mp3' else (model, voice, text, fmt)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class TTSCache:
+    """Two-tier (memory LRU + disk) cache of synthesized audio bytes"""
+
+    def __init__(self, cache_dir, memory_max_bytes=64 * 1024 * 1024,
+                 disk_max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None  # computed lazily on first disk write
+        self._lock = threading.Lock()
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key, fmt='mp3'):
+        # Shard by the first two hex characters to keep directories small
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{fmt}")
+
+    def _paths(self, key):
+        """Every path key's file could have; the key fixes the format, not the name"""
+        return [self._path(key, fmt) for fmt in AUDIO_MIME_TYPES]
+
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return data
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self._remember(key, data)
+        return data
+
+    def file_path(self, key):
+        """Path of key's file in the disk tier, or None if it isn't on disk"""
+        if not self.cache_dir:
+            return None
+        for path in self._paths(key):
+            try:
+                os.utime(path)
+            except OSError:
+                continue
+            return path
+        return None
+
+    def put(self, key, data):
+        """Store bytes under key in both tiers"""
+        if not data:
+            return
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_bytes': self._disk_bytes,
+                'hits_memory': self.hits_memory,
+                'hits_disk': self.hits_disk,
+                'misses': self.misses,
+            }
+
+    # Memory tier (callers hold self._lock)
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # Disk tier
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        for path in self._paths(key):
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                break
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning("Audio cache read failed for %s: %s", key, e)
+                return None
+        else:
+            return None
+        # Bump mtime so eviction approximates LRU
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write_disk(self, key, data):
+        if not self.cache_dir or len(data) > self.disk_max_bytes:
+            return
+        path = self._path(key, sniff_format(data))
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers never see partial audio
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Audio cache write failed for %s: %s", key, e)
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(data)
+            over_limit = self._disk_bytes > self.disk_max_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _iter_disk_files(self):
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.rpartition('.')[2] in AUDIO_MIME_TYPES:
+                    yield entry
+
+    def _scan_disk_bytes(self):
+        total = 0
+        for entry in self._iter_disk_files():
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _evict_disk(self):
+        """Delete least recently used files until under 90% of the limit"""
+        files = []
+        for entry in self._iter_disk_files():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_bytes = total
+
+
+def create_default_cache():
+    """Build the process-wide cache from environment configuration"""
+    cache_dir = os.getenv(
+        'AUDIO_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio_cache'),
+    )
+    return TTSCache(
+        cache_dir=cache_dir,
+        memory_max_bytes=int(os.getenv('AUDIO_CACHE_MEMORY_MB', '64')) * 1024 * 1024,
+        disk_max_bytes=int(os.getenv('AUDIO_CACHE_DISK_MB', '1024')) * 1024 * 1024,
+    )
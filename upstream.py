@@ -0,0 +1,340 @@
+"""
+Shared guard for calls to the OpenAI API.
+
+Every upstream call goes through an UpstreamPolicy, which combines:
+
+- a token-bucket limiter on requests per minute and (for chat) tokens per
+  minute, so bursts are smoothed out locally instead of being bounced by
+  the API with 429s; a caller that would have to wait longer than
+  max_wait is refused immediately,
+- retries with jittered exponential backoff for 429s, 5xx responses and
+  connection errors, honouring the API's Retry-After hint,
+- a circuit breaker that, after repeated failures, refuses calls for a
+  cool-down period so handlers fall back to local answers at once rather
+  than tying up workers on requests that will time out.
+
+Refused calls raise UpstreamUnavailable, which the handlers treat like any
+other upstream failure (canned/local fallback, or a 503 for audio).
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import threading
+import time
+
+import openai
+
+import metrics
+from context_selection import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling upstream: the circuit is open or the rate limit wait is too long"""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at per_minute / 60 tokens per second"""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount tokens are available (callers hold the limiter's lock)"""
+        self._refill(now)
+        deficit = min(amount, self.capacity) - self._tokens
+        return max(0.0, deficit / self.rate)
+
+    def take(self, amount):
+        # May go negative: later callers then wait for the debt to be repaid
+        self._tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Requests-per-minute and optional tokens-per-minute limits sharing one lock"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute=0, max_wait=5.0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_wait = max_wait
+        self.throttled = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=0):
+        """Reserve capacity for one call; returns seconds to wait first or raises UpstreamUnavailable"""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.requests is not None:
+                wait = self.requests.wait_time(1, now)
+            if self.tokens is not None and tokens:
+                wait = max(wait, self.tokens.wait_time(tokens, now))
+            if wait > self.max_wait:
+                self.rejected += 1
+                raise UpstreamUnavailable('rate limit', retry_after=wait)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None and tokens:
+                self.tokens.take(tokens)
+            if wait > 0:
+                self.throttled += 1
+            return wait
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; lets one probe through after reset_timeout"""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.short_circuited = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN  # this caller is the probe
+                return
+            self.short_circuited += 1
+            raise UpstreamUnavailable('circuit open', retry_after=max(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def cancel_probe(self):
+        """The probe never reached upstream; let the next caller probe instead"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Upstream circuit opened after %d failures", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def is_retryable(error):
+    """429s, 5xx responses, timeouts and connection failures are worth retrying"""
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def retry_after(error):
+    """The server's Retry-After hint in seconds, if it sent one"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def chat_request_tokens(messages, max_tokens):
+    """Tokens a chat completion may consume: the prompt estimate plus the completion cap"""
+    return sum(estimate_tokens(message['content']) for message in messages) + max_tokens
+
+
+class UpstreamPolicy:
+    """Rate limiting, retries and circuit breaking for one upstream"""
+
+    def __init__(self, name, limiter, breaker, max_retries=2, backoff_base=0.5, backoff_max=8.0):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _admit(self, tokens):
+        """Breaker check then limiter reservation; returns seconds to wait before calling"""
+        try:
+            self.breaker.before_call()
+            try:
+                return self.limiter.reserve(tokens)
+            except UpstreamUnavailable:
+                self.breaker.cancel_probe()
+                raise
+        except UpstreamUnavailable:
+            metrics.observe_upstream(self.name, 'refused')
+            raise
+
+    def _backoff(self, error, attempt):
+        """Delay before retry number attempt (0-based), or None if the error shouldn't be retried"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        hint = retry_after(error)
+        if hint is not None:
+            return min(hint, self.backoff_max)
+        # Full jitter keeps a burst of failed callers from retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _record(self, error, started):
+        elapsed = time.perf_counter() - started
+        if not isinstance(error, Exception):
+            # Cancellation or a client hanging up mid-stream says nothing about upstream health
+            metrics.observe_upstream(self.name, 'cancelled', elapsed)
+            self.breaker.cancel_probe()
+            return
+        self.failures += 1
+        if is_retryable(error):
+            metrics.observe_upstream(self.name, 'transient_error', elapsed)
+            self.breaker.record_failure()
+        else:
+            # The API answered (e.g. a 400), so it is reachable
+            metrics.observe_upstream(self.name, 'error', elapsed)
+            self.breaker.record_success()
+
+    def _succeed(self, started, result=None):
+        metrics.observe_upstream(self.name, 'ok', time.perf_counter() - started, result)
+        self.breaker.record_success()
+
+    def call(self, fn, *args, tokens=0, **kwargs):
+        """Call fn(*args, **kwargs) under this policy, retrying transient failures"""
+        attempt = 0
+        while True:
+            time.sleep(self._admit(tokens))
+            self.calls += 1
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                self._record(e, started)
+                if not isinstance(e, Exception):
+                    raise
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+                self.retries += 1
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._succeed(started, result)
+            return result
+
+    async def acall(self, coro_fn, *args, tokens=0, **kwargs):
+        """Async counterpart of call for the ASGI handlers"""
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._admit(tokens))
+            self.calls += 1
+            started = time.perf_counter()
+            try:
+                result = await coro_fn(*args, **kwargs)
+            except BaseException as e:
+                self._record(e, started)
+                if not isinstance(e, Exception):
+                    raise
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+                self.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self._succeed(started, result)
+            return result
+
+    @contextlib.contextmanager
+    def guard(self, tokens=0):
+        """Limit and circuit-break a streaming call; streams are not retried once started"""
+        time.sleep(self._admit(tokens))
+        self.calls += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self._record(e, started)
+            raise
+        self._succeed(started)
+
+    @contextlib.asynccontextmanager
+    async def aguard(self, tokens=0):
+        await asyncio.sleep(self._admit(tokens))
+        self.calls += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self._record(e, started)
+            raise
+        self._succeed(started)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'failures': self.failures,
+            'circuit': self.breaker.state,
+            'short_circuited': self.breaker.short_circuited,
+            'throttled': self.limiter.throttled,
+            'rate_limited': self.limiter.rejected,
+        }
+
+
+def create_default_policies():
+    """Policies keyed by upstream; selection shares chat's limiter and breaker (same quota and API)"""
+    max_wait = float(os.getenv('UPSTREAM_MAX_WAIT', '5'))
+    max_retries = int(os.getenv('UPSTREAM_MAX_RETRIES', '2'))
+    backoff_base = float(os.getenv('UPSTREAM_BACKOFF_SECONDS', '0.5'))
+    threshold = int(os.getenv('UPSTREAM_BREAKER_THRESHOLD', '5'))
+    reset_timeout = float(os.getenv('UPSTREAM_BREAKER_RESET', '30'))
+
+    chat = UpstreamPolicy(
+        'chat',
+        RateLimiter(
+            int(os.getenv('UPSTREAM_CHAT_RPM', '500')),
+            int(os.getenv('UPSTREAM_CHAT_TPM', '200000')),
+            max_wait=max_wait
+        ),
+        CircuitBreaker(threshold, reset_timeout),
+        max_retries=max_retries, backoff_base=backoff_base
+    )
+    tts = UpstreamPolicy(
+        'tts',
+        RateLimiter(int(os.getenv('UPSTREAM_TTS_RPM', '500')), max_wait=max_wait),
+        CircuitBreaker(threshold, reset_timeout),
+        max_retries=max_retries, backoff_base=backoff_base
+    )
+    selection = UpstreamPolicy(
+        'selection', chat.limiter, chat.breaker, max_retries=max_retries, backoff_base=backoff_base
+    )
+    return {'chat': chat, 'selection': selection, 'tts': tts}